@@ -1,60 +1,111 @@
+"""run_mic.py
+
+Repeated runs of the sli simulation (microcircuit.sli), converted to HDF5
+(text_to_hdf5_append.save_sli_to_hdf5, one group per run).
+
+Usage:
+    python run_mic.py [options] [master_seed ...]
+        master_seed ...     one run per master seed
+        --n_runs n          with a single (or no) master seed: n runs (default 20),
+                            master seeds spaced by 2 n_vp + 2 n_populations
+                            (no master seed: the one of sim_params.sli)
+        --n_processes n     processes parsing the text files of one run (default 1)
+
+The master seed and the output directory of each run,
+    data_dir/sli/<sim_spec>/run_<i>_ms<master_seed>
+are passed to nest as user arguments (sim_params.sli, user_params.sli),
+sim_params.sli is not changed.
+Pipeline: while run i + 1 simulates, run i is converted in a background process.
+Conversions are done one after another, in the order of the runs.
+"""
+from __future__ import print_function
 from imp import reload
+import multiprocessing
 import subprocess
 import sys, os, time
 sys.path.append(os.path.abspath('../analysis/')) # include path with simulation specifications
+sys.path.append(os.path.abspath('../simulation/')) # include path with simulation specifications
+import sim_params as sim; reload(sim)
 import text_to_hdf5_append as tth; reload(tth)
 
 sim_spec = "a1.0_t60.2"
-
 n_populations = 8
-sim_params = "./sim_params.sli"
-with open(sim_params, 'r') as file:
-    lines = file.readlines()
-
-# Obtain master seed and n_vp from sim_params.sli
-for i, line in enumerate(lines):
-    if line.startswith(r"/master_seed"): # Master seed
-        i_ms = i
-        ms_line     = line.split(" ")
-    if line.startswith(r"/n_threads_per_proc"): # Number of virtual processes
-        n_vp        = int(line.split(" ")[1])
-
-master_seed = int(ms_line[1])
-
-t0 = time.time()
-n_runs = 20
-for run_i in range(n_runs):
-    print(run_i)
-    # Simulate
-    t0sim = time.time()
-    subprocess.call('nest microcircuit.sli', shell=True)
-    tsim = time.time() - t0sim
-
-    # Save data
-    if run_i == 0:
-        start_file = True # open new file (overwrites!)
-    else:
-        start_file = False # do not overwrite existing hdf5 file but append! ("r+")
+
+def read_sli_params(sim_params="./sim_params.sli"):
+    """Master seed and number of threads (n_vp) of sim_params.sli."""
+    with open(sim_params, 'r') as file:
+        for line in file:
+            if line.startswith(r"/master_seed"): # Master seed
+                master_seed = int(line.split(" ")[1])
+            if line.startswith(r"/n_threads_per_proc"): # Number of virtual processes
+                n_vp        = int(line.split(" ")[1])
+    return master_seed, n_vp
+
+def convert(sim_spec, start_file, run_path, master_seed, n_processes):
+    """Convert the text files of one run (in a background process)."""
     t0save = time.time()
-    tth.save_sli_to_hdf5(sim_spec=sim_spec, start_file=start_file)
-    tsave = time.time() - t0save
-
-    # Change master seed
-    master_seed = master_seed + 1 \
-            + 2 * n_vp + 2 * n_populations \
-            - 1  # last -1 since range ends beforehand
-    ms_line[1] = str(master_seed)
-    ms_line_complete = ""
-    for snip in ms_line:
-        ms_line_complete += snip + " "
-    lines[i_ms] = ms_line_complete
-    with open(sim_params, 'w') as file:
-        file.writelines(lines)
-
-    print("Master seed: %i"%master_seed)
-    print("Time for simulation : %.2f s"%tsim)
-    print("Time for saving data: %.2f s"%tsave)
-
-ttotal = time.time() - t0
-print("Total time: %.2f s"%ttotal)
-    
+    tth.save_sli_to_hdf5(sim_spec=sim_spec, start_file=start_file, sli_data_path=run_path,
+                         master_seed=master_seed, n_processes=n_processes)
+    print("Time for saving data (ms %i): %.2f s"%(master_seed, time.time() - t0save))
+
+if __name__ == "__main__":
+    n_runs      = 20
+    n_processes = 1
+    seeds       = []
+    args        = sys.argv[1:]
+    while len(args) > 0:
+        arg = args.pop(0)
+        if arg == "--n_runs":
+            n_runs = int(args.pop(0))
+        elif arg == "--n_processes":
+            n_processes = int(args.pop(0))
+        else:
+            seeds.append(int(arg))
+
+    master_seed, n_vp = read_sli_params()
+    if len(seeds) > 1:
+        master_seeds = seeds
+    else:
+        if len(seeds) == 1:
+            master_seed = seeds[0]
+        # ranges of the runs do not overlap
+        master_seeds = [master_seed + run_i * (2 * n_vp + 2 * n_populations) for run_i in range(n_runs)]
+    print("Master seeds: " + " ".join(str(seed) for seed in master_seeds))
+
+    runs_path = os.path.join(sim.data_dir, "sli", sim_spec)
+    t0 = time.time()
+    converter = None
+    for run_i, master_seed in enumerate(master_seeds):
+        print(run_i)
+        run_path = os.path.join(runs_path, "run_%02i_ms%i"%(run_i, master_seed))
+        if not os.path.exists(run_path):
+            os.makedirs(run_path)
+
+        # Simulate (while the previous run is converted)
+        t0sim = time.time()
+        exit_code = subprocess.call(["nest", "--userargs=%i:%s"%(master_seed, run_path), "microcircuit.sli"])
+        tsim = time.time() - t0sim
+        if exit_code != 0:
+            raise Exception("nest exited with %i (master seed %i)"%(exit_code, master_seed))
+
+        # Wait for the conversion of the previous run, then convert this one
+        t0wait = time.time()
+        if not converter is None:
+            converter.join()
+            if converter.exitcode != 0:
+                raise Exception("Conversion of run %i failed!"%(run_i - 1))
+        twait = time.time() - t0wait
+        # run 0: open new file (overwrites!), then append ("r+")
+        converter = multiprocessing.Process(target=convert,
+                                            args=(sim_spec, run_i == 0, run_path, master_seed, n_processes))
+        converter.start()
+
+        print("Master seed: %i"%master_seed)
+        print("Time for simulation : %.2f s"%tsim)
+        print("Time waiting for the previous conversion: %.2f s"%twait)
+
+    converter.join()
+    if converter.exitcode != 0:
+        raise Exception("Conversion of run %i failed!"%(len(master_seeds) - 1))
+    ttotal = time.time() - t0
+    print("Total time: %.2f s"%ttotal)
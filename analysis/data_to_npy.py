@@ -27,6 +27,7 @@ import numpy as np
 import sys, os, time
 sys.path.append(os.path.abspath('../')) # include path with style
 sys.path.append(os.path.abspath('../simulation_old/')) # include path with simulation specifications
+sys.path.append(os.path.abspath('../simulation/')) # include path with spike_functions
 # Import specific moduls
 import network_params as net; reload(net)
 import user_params as user; reload(user)
@@ -59,6 +60,7 @@ n_rec_spike = np.load(os.path.join(pynest_path, 'n_neurons_rec_spike.npy'))
 # Simulation parameters
 area    = float(simulation_spec.split("_")[0][1:])          # mm**2
 t_trans = 200. # ms; starting point of analysis (avoid transients)
+voltage_dtype = np.float64 # np.float32: half the size of the voltage files
 
 # statistics generated with sli code (not quite optimal, as parameters must correspond to 
 # those of the pynest simulation!
@@ -108,12 +110,14 @@ for i, population in enumerate(populations):
     file_names = [file_name for file_name in file_names_all if file_name.startswith('voltages')]
     if file_names != []:
         t0 = time.time()
-        Vs_pop, t_max, dt = functions.get_voltages(population, data_path, t_trans, sli=sli)
+        voltages_file = 'voltages_' + population + '.npy'
+        # Written to the .npy file while reading
+        Vs_pop, t_max, dt = functions.get_voltages(population, data_path, t_trans, sli=sli,
+                                                   out_file=os.path.join(output_path, voltages_file), 
+                                                   dtype=voltage_dtype)
+        Vs_pop.flush()
         dt0 = time.time() - t0
         print('time to read data: %.3f s'%dt0)
-       
-        voltages_file = 'voltages_' + population + '.npy'
-        np.save(os.path.join(output_path, voltages_file), Vs_pop)
 
         if i == 0:
             V_times = np.arange(t_trans, t_max + dt, dt)
@@ -5,6 +5,7 @@
 import numpy as np
 import os, time
 import network_params as net
+import spike_functions
 
 def get_GIDs_times(population, data_path, t_trans, sli=False):
     """
@@ -15,8 +16,6 @@ def get_GIDs_times(population, data_path, t_trans, sli=False):
 
     Returns GIDs and times (not ordered)
     """
-    GIDs = []
-    times = []
     if sli:
         pop_id      = np.where(net.populations == population)[0][0]
         type_id     = int(pop_id % len(net.types))
@@ -24,31 +23,23 @@ def get_GIDs_times(population, data_path, t_trans, sli=False):
         prefix = "spikes_" + str(layer_id) + "_" + str(type_id)
     else:
         prefix = "spikes_" + population
-    file_names_all  = os.listdir(data_path)
-    file_names = [file_name for file_name in file_names_all if file_name.startswith(prefix)]
-    for file_name in file_names:
-        print(file_name)
-        with open(data_path + file_name, "r") as file:
-            for line in file:
-                GID, time = line.split()
-                time = float(time)
-                if time >= t_trans:
-                    GIDs.append(int(GID))
-                    times.append(time)
-    GIDs = np.array(GIDs)
-    times = np.array(times)
+    file_paths  = spike_functions.text_file_paths(data_path, prefix)
+    spikes  = spike_functions.read_text_files(file_paths, 2, t_trans)
+    GIDs    = spikes[:, 0].astype(int)
+    times   = spikes[:, 1]
     return GIDs, times
 
-def get_voltages(population, data_path, t_trans, sli=False):
+def get_voltages(population, data_path, t_trans, sli=False, out_file=None, dtype=float):
     """
     Get membrane voltages from files.
 
     Expects: population, data_path, t_trans
     Option: sli (boolean) -- Get data of sli simulation.
+            out_file -- Write Vs to this .npy file (memory mapped) instead of memory.
+            dtype -- e.g. np.float32 to halve the size of Vs.
 
-    Returns Vs[GID, time_index] and dt. 
+    Returns Vs[GID, time_index] (neurons in order of GID), t_max and dt. 
     """
-    GIDs = []
     if sli:
         pop_id      = np.where(net.populations == population)[0][0]
         type_id     = int(pop_id % len(net.types))
@@ -56,34 +47,16 @@ def get_voltages(population, data_path, t_trans, sli=False):
         prefix = "voltages_" + str(layer_id) + "_" + str(type_id)
     else:
         prefix = "voltages_" + population
-    file_names_all  = os.listdir(data_path)
-    file_names = [file_name for file_name in file_names_all if file_name.startswith(prefix)]
-    for i, file_name in enumerate(file_names):
-            print(file_name)
-            Vs = []
-            j  = 0
-            t0 = 0
-            t1 = 0
-            with open(data_path + file_name, "r") as file:
-                for line in file:
-                    GID, time, V = line.split()
-                    time = float(time)
-                    if time >= t_trans:
-                        Vs.append(float(V))
-                        if t0 == 0:
-                            t0 = time
-                        elif t1 == 0:
-                            j += 1
-                            if time != t0:
-                                t1 = time
-                                n_GIDs = j
-            if i == 0:
-                dt = t1 - t0
-                t_max   = time
-                n_times = (t_max - t0) / dt + 1
-                Vs_all = np.reshape(Vs, (n_GIDs, n_times))
-            else:
-                if Vs != []:
-                    Vs_all = np.vstack((Vs_all, np.reshape(Vs, (n_GIDs, n_times))))
+    file_paths  = spike_functions.text_file_paths(data_path, prefix)
+    # Header pass: GIDs and time grid; then fill the preallocated array file by file
+    GIDs, times = spike_functions.voltage_layout(file_paths, t_trans)
+    shape   = (len(GIDs), len(times))
+    if out_file is None:
+        Vs_all  = np.full(shape, np.nan, dtype=dtype)
+    else:
+        Vs_all  = np.lib.format.open_memmap(out_file, mode="w+", dtype=dtype, shape=shape)
+    spike_functions.fill_voltages(Vs_all, file_paths, GIDs, times)
+    dt      = (times[-1] - times[0]) / max(len(times) - 1, 1)
+    t_max   = times[-1]
     return Vs_all, t_max, dt
 
@@ -26,6 +26,7 @@ picture_format = '.pdf'
 # Import specific moduls
 import network_params as net; reload(net)
 import user_params as user; reload(user)
+import spike_store; reload(spike_store)
 
 reverse_order = True # do analysis such that plots resemble those of the paper (starting with L6i)
 plotting = True
@@ -144,10 +145,8 @@ if plotting:
 for i, population in enumerate(populations):
     print(population)
     # Get data
-    times_file = 'times_' + population + '.npy'
-    n_GIDs_file = 'n_GIDs_' + population + '.npy'
-    times_all   = np.load(npy_path + times_file)
-    n_GIDs  = np.load(npy_path + n_GIDs_file)
+    spikes  = spike_store.spike_store(npy_path)[population] # memory mapped
+    n_GIDs  = spikes.rec_neuron_i
     
     # Firing rate:
     n_spikes = np.diff(n_GIDs)
@@ -157,7 +156,7 @@ for i, population in enumerate(populations):
     
     cv_isi_all = np.empty(0)
     for j in range(len(n_GIDs) - 1):
-        times = times_all[n_GIDs[j]:n_GIDs[j+1]]
+        times = spikes.neuron(j, unit='ms')
         hist_spikes[i] += np.histogram(times, bins=n_bins_spikes, range=(t_trans, t_sim))[0]
         if n_spikes[j] > 1:
             isi = np.diff(times)
@@ -13,6 +13,9 @@ import numpy as np
 import h5py
 import sys, os
 import time
+sys.path.append(os.path.abspath('../simulation/')) # include path with spike_store
+from imp import reload
+import spike_store; reload(spike_store)
 
 ######################################################
 # File and path
@@ -101,6 +104,15 @@ for k, sim_spec2 in enumerate(data_file.keys()):
     # Results
     res_grp = res_file.create_group(sim_spec2)
 
+    # Adaptive runs (sim.adaptive) save their own t_trans and t_sim
+    t_trans_k   = data_file[sim_spec2].attrs.get("t_trans", t_trans)
+    t_sim_k     = data_file[sim_spec2].attrs.get("t_sim", t_sim)
+    t_measure_k = t_sim_k - t_trans_k
+    n_bins_spikes_k     = int(t_measure_k / bin_width_spikes) 
+    bin_edges_spikes_k  = np.arange(t_trans_k, t_sim_k, bin_width_spikes)
+    res_grp.attrs["t_trans"]    = t_trans_k
+    res_grp.attrs["t_sim"]      = t_sim_k
+
     ######################################################
     # Analyze spikes
     ######################################################
@@ -111,6 +123,7 @@ for k, sim_spec2 in enumerate(data_file.keys()):
         grp = data_file[sim_spec2 + "/spikes"]
         dt = grp.attrs["dt"]
         n_neurons_rec_spike = grp.attrs["n_neurons_rec_spike"][:]
+        store   = spike_store.spike_store(grp)
 
         # Mean and Std of firing rates and CV of ISI
         rates_mean  = np.zeros(n_populations)
@@ -119,23 +132,24 @@ for k, sim_spec2 in enumerate(data_file.keys()):
         cv_isi_std  = np.zeros(n_populations)
         synchrony   = np.zeros(n_populations)
         n_rec_spikes = np.zeros(n_populations)
-        hist_spikes = np.zeros((n_populations, n_bins_spikes))
+        hist_spikes = np.zeros((n_populations, n_bins_spikes_k))
         
         for i, population in enumerate(populations):
             print(population, end="")
             # Get data
             subgrp = grp[str(population)]
-            raw_times_all   = subgrp["times"][:] * dt * 1e-3 # in seconds
-            try:
-                indices        = subgrp["rec_neuron_i"][:]
+            if "rec_neuron_i" in subgrp:
+                # Memory mapped; times of each neuron are read when used
+                spikes  = store[population]
                 print("")
-            except:
+            else:
                 #print("No rec_neuron_i save -- change this in ../simulation/functions.py!!!")
                 # What is about to come is ambiguous! What if neuron i fired its last spike k 
                 # at t_i^k and neuron j = i+1 its first spike at t_j_1 > t_i_k???
                 # This is very improbable for the given condition: 
                 # Of 1000 neurons, 996 fired (using this technique), thus at maximum 4 neurons have been 
                 # falsely identified.   
+                raw_times_all           = subgrp["times"][:]
                 indices                 = np.zeros(n_neurons_rec_spike[i] + 1) 
                 indices_fired_only      = np.where(np.diff(raw_times_all) < 0)[0] + 1
                 max_index               = len(indices_fired_only)  # number of neurons that fired >= 1 spike
@@ -146,20 +160,21 @@ for k, sim_spec2 in enumerate(data_file.keys()):
                     sorted_indices          = np.sort(np.diff(indices_fired_only))
                     n_neurons_fired_once    = int(np.sum(sorted_indices == 1))
                     print("\t\t{0:4d} | {1:4d}".format(n_neurons_didnt_fire, n_neurons_fired_once))
+                spikes  = spike_store.population_spikes(raw_times_all, indices, dt)
 
             rates           = []
             cv_isi_all      = []
             no_isi          = 0
-            hist_spikes_i   = np.zeros(n_bins_spikes)
+            hist_spikes_i   = np.zeros(n_bins_spikes_k)
             
             for j in range(n_neurons_rec_spike[i]):
-                times = raw_times_all[indices[j]:indices[j+1]]
-                times = times[times > t_trans] # ignore transitional period!
+                times = spikes.neuron(j) # in seconds
+                times = times[(times > t_trans_k) & (times <= t_sim_k)] # ignore transitional period!
                 
                 # histogram, isi
                 n_spikes = len(times)
-                rates.append(n_spikes / t_measure) # Hz; single neuron firing rate
-                hist_spikes_i += np.histogram(times, bins=n_bins_spikes, range=(t_trans, t_sim), density=False)[0]
+                rates.append(n_spikes / t_measure_k) # Hz; single neuron firing rate
+                hist_spikes_i += np.histogram(times, bins=n_bins_spikes_k, range=(t_trans_k, t_sim_k), density=False)[0]
                 if n_spikes > 2:
                     isi         = np.diff(times)
                     mean_isi    = np.mean(isi)
@@ -192,7 +207,7 @@ for k, sim_spec2 in enumerate(data_file.keys()):
         res_grp.create_dataset("synchrony", data=synchrony)
         res_grp.create_dataset("n_neurons_rec_spike", data=n_neurons_rec_spike)
         res_grp.create_dataset("hist_spikes", data=hist_spikes)
-        dset_hist_times = res_grp.create_dataset("hist_times", data=bin_edges_spikes)
+        dset_hist_times = res_grp.create_dataset("hist_times", data=bin_edges_spikes_k)
         dset_hist_times.attrs["bin_size"] = bin_width_spikes
     
     t1 = time.time()
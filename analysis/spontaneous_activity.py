@@ -28,6 +28,7 @@ figure_path = "./figures"
 # Import specific moduls
 import network_params as net; reload(net)
 import user_params as user; reload(user)
+import spike_store; reload(spike_store)
 
 def enum(arr1, *args):
     i_range = range(len(arr1))
@@ -122,16 +123,15 @@ bin_width_spikes = 3e-3  # s
 n_bins_spikes = int(t_measure / bin_width_spikes) 
 
 print("Prepare data")
+store = spike_store.spike_store(npy_path)
 for i, population in enumerate(populations):
     res_raster_pop = res_raster.create_group(str(population))
     
     spikes_raster.append([])
     times_raster.append([])
     # Get data
-    times_file = "times_" + population + ".npy"
-    n_GIDs_file = "n_GIDs_" + population + ".npy"
-    raw_times_all   = np.load(os.path.join(npy_path, times_file)) * 1e-3 # in seconds
-    n_GIDs  = np.load(os.path.join(npy_path, n_GIDs_file))
+    spikes  = store[population] # memory mapped
+    n_GIDs  = spikes.rec_neuron_i
 
     
     # Firing rate:
@@ -141,7 +141,7 @@ for i, population in enumerate(populations):
     cv_isi_all  = np.empty(0)
     hist_spikes = np.zeros(n_bins_spikes)
     for j in range(len(n_GIDs) - 1):
-        times = raw_times_all[n_GIDs[j]:n_GIDs[j+1]]
+        times = spikes.neuron(j) # in seconds
         hist_spikes += np.histogram(times, bins=n_bins_spikes, range=(t_trans, t_sim))[0]
         if n_spikes[j] > 1:
             isi = np.diff(times)
@@ -185,7 +185,7 @@ res_grp.create_dataset("synchrony", data=synchrony)
 res_file.close()
 
 # Free memory from its chains
-raw_times_all = None
+store = None
 times = None
 raster_mask = None
 n_spikes_raster = None
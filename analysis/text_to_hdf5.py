@@ -12,6 +12,8 @@ sys.path.append(os.path.abspath('../')) # include path with style
 sys.path.append(os.path.abspath('../simulation/')) # include path with simulation specifications
 import sim_params as sim; reload(sim)
 import model_class; reload(model_class)
+import spike_functions; reload(spike_functions)
+import registry; reload(registry)
 ######################################################
 def get_GIDs_times(model, population, data_path, t_trans):
     """
@@ -22,27 +24,17 @@ def get_GIDs_times(model, population, data_path, t_trans):
 
     Returns GIDs and times (ordered by times)
     """
-    GIDs = []
-    times = []
     pop_id      = np.where(model.populations == population)[0][0]
     type_id     = int(pop_id % len(model.types))
     layer_id    = int(pop_id / len(model.types))
     prefix = "spikes_" + str(layer_id) + "_" + str(type_id)
-    file_names_all  = os.listdir(data_path)
-    file_names = [file_name for file_name in file_names_all if file_name.startswith(prefix)]
-    for file_name in file_names:
-        print(file_name)
-        with open(os.path.join(data_path, file_name), "r") as file:
-            for line in file:
-                GID, time = line.split()
-                time = float(time)
-                if time >= t_trans:
-                    GIDs.append(int(GID))
-                    times.append(time)
-    GIDs = np.array(GIDs)
-    times = np.array(times) 
+    file_paths  = spike_functions.text_file_paths(data_path, prefix)
+    # Parse the files of all virtual processes in parallel
+    spikes  = spike_functions.read_text_files(file_paths, 2, t_trans)
+    GIDs    = spikes[:, 0].astype(int)
+    times   = spikes[:, 1]
     
-    mask = np.argsort(times)
+    mask = np.argsort(times, kind="mergesort")
     GIDs = GIDs[mask]
     times = times[mask]
     return GIDs, times
@@ -50,9 +42,9 @@ def get_GIDs_times(model, population, data_path, t_trans):
 
 # Model
 connection_rule = "fixed_total_number" # "fixed_indegree", "fixed_total_number"
-PSC_rel_sd      = 0.1 # 0.1 for  Potjans' model
+weight_rel_sd   = 0.1 # 0.1 for  Potjans' model
 model           = model_class.model(connection_rule=connection_rule,
-                                    PSC_rel_sd=PSC_rel_sd) 
+                                    weight_rel_sd=weight_rel_sd) 
 # Parameters
 populations = model.populations
 # Raster:
@@ -101,26 +93,15 @@ with h5py.File(path_hdf5_file, "w") as data_file:
 
     for j, population in enumerate(populations):
         senders, times = get_GIDs_times(model, population, sli_data_path, t_trans)
-        times   = np.uint(times / sim.dt) # in units of dt!
+        times   = spike_functions.to_steps(times, sim.dt) # in units of dt!
 
-        # Create array of indices for data: 
+        # Sort times by recorded neuron and time: 
         # times_{ith neuron} = times[rec_neuron_i[i]:rec_neuron_i[i+1]]
-        rec_neuron_i    = np.zeros(n_neurons_rec_spike[j] + 1)
+        rec_GIDs = spike_functions.rec_GIDs_sli(sli_data_path, j, n_neurons_rec_spike[j], senders)
+        sorted_times, rec_neuron_i = spike_functions.sort_spikes(senders, times, rec_GIDs)
 
-        # Get corresponding reduced GIDs: nth neuron recorded
-        n_spikes_per_neuron = np.unique(senders, return_counts=True)[1]
-        max_index       = len(n_spikes_per_neuron) + 1
-        nth_neuron      = np.cumsum(n_spikes_per_neuron)
-        rec_neuron_i[1 : max_index] = nth_neuron        # leave out 0th index
-        rec_neuron_i[max_index : ]  = nth_neuron[-1]    # in case some neurons didn't fire at all
+        # Save data to HDF5 file:
+        spike_functions.write_spikes(spikes_grp.create_group(population), sorted_times, rec_neuron_i,
+                                     sim.spike_format)
 
-        # sort times
-        sorted_times = times[np.argsort(senders)] 
-        for i in range(len(rec_neuron_i) - 1):
-            i0, i1 = (rec_neuron_i[i], rec_neuron_i[i+1])
-            sorted_times[i0:i1] = np.sort(sorted_times[i0:i1])
-
-        # save data to HDF5 file:
-        spikes_subgrp   = spikes_grp.create_group(population)
-        dset_times      = spikes_subgrp.create_dataset("times", data=sorted_times)
-        dset_indices    = spikes_subgrp.create_dataset("rec_neuron_i", data=rec_neuron_i)
+registry.catalog_file(path_hdf5_file)  # catalog of all data files
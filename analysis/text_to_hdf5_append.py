@@ -14,51 +14,49 @@ sys.path.append(os.path.abspath('../')) # include path with style
 sys.path.append(os.path.abspath('../simulation/')) # include path with simulation specifications
 import sim_params as sim; reload(sim)
 import model_class; reload(model_class)
+import spike_functions; reload(spike_functions)
+import registry; reload(registry)
 ######################################################
-def get_GIDs_times(model, population, data_path, t_trans):
+def get_GIDs_times(model, population, data_path, t_trans, n_processes=None):
     """
     Get spike data from files.
 
     Expects: population, data_path, t_trans
-    Option: sli (boolean) -- Get data of sli simulation.
+    Option: n_processes -- number of processes parsing the files (default: one per file).
 
     Returns GIDs and times (ordered by times)
     """
-    GIDs = []
-    times = []
     pop_id      = np.where(model.populations == population)[0][0]
     type_id     = int(pop_id % len(model.types))
     layer_id    = int(pop_id / len(model.types))
     prefix = "spikes_" + str(layer_id) + "_" + str(type_id)
-    file_names_all  = os.listdir(data_path)
-    file_names = [file_name for file_name in file_names_all if file_name.startswith(prefix)]
-    for file_name in file_names:
-        with open(os.path.join(data_path, file_name), "r") as file:
-            for line in file:
-                GID, time = line.split()
-                time = float(time)
-                if time >= t_trans:
-                    GIDs.append(int(GID))
-                    times.append(time)
-    GIDs = np.array(GIDs)
-    times = np.array(times) 
+    file_paths  = spike_functions.text_file_paths(data_path, prefix)
+    # Parse the files of all virtual processes in parallel
+    spikes  = spike_functions.read_text_files(file_paths, 2, t_trans, n_processes=n_processes)
+    GIDs    = spikes[:, 0].astype(int)
+    times   = spikes[:, 1]
     
-    mask = np.argsort(times)
+    mask = np.argsort(times, kind="mergesort")
     GIDs = GIDs[mask]
     times = times[mask]
     return GIDs, times
 
 
-def save_sli_to_hdf5(sim_spec="a1.0_t60.2", start_file=False):
+def save_sli_to_hdf5(sim_spec="a1.0_t60.2", start_file=False, sli_data_path=None, 
+                     master_seed=None, n_processes=None):
+    """Append the spikes of one sli run (text files in sli_data_path, default:
+    data_dir/sli/sim_spec) as new group to data_dir/sli/<sim_spec>_all.hdf5.
+    master_seed is saved as attribute of the group, if given.
+    """
     n_rec   =  1000
     t_sim   = 60200.0 # ms
     t_trans =   200.0 # ms
     
     # Model
     connection_rule = "fixed_total_number" # "fixed_indegree", "fixed_total_number"
-    PSC_rel_sd      = 0.1 # 0.1 for  Potjans' model
+    weight_rel_sd   = 0.1 # 0.1 for  Potjans' model
     model           = model_class.model(connection_rule=connection_rule,
-                                        PSC_rel_sd=PSC_rel_sd) 
+                                        weight_rel_sd=weight_rel_sd) 
     # Parameters
     populations = model.populations
     # record from 1000 neurons
@@ -71,7 +69,8 @@ def save_sli_to_hdf5(sim_spec="a1.0_t60.2", start_file=False):
     data_path = os.path.join(data_sup_path, sub_path)
     file_name   = sim_spec + "_all.hdf5"
     
-    sli_data_path = os.path.join(data_path, sim_spec)
+    if sli_data_path is None:
+        sli_data_path = os.path.join(data_path, sim_spec)
     path_hdf5_file = os.path.join(data_path, file_name)
 
     if start_file: # overwrites existing file!
@@ -88,6 +87,9 @@ def save_sli_to_hdf5(sim_spec="a1.0_t60.2", start_file=False):
     
         print("new group: ", max_grp)
         grp         = data_file.create_group(str(max_grp))
+        grp.attrs["sli_data_path"] = sli_data_path
+        if not master_seed is None:
+            grp.attrs["master_seed"] = master_seed
         spikes_grp = grp.create_group("spikes")
         spikes_grp.attrs["dt"]  = sim.dt 
         spikes_grp.attrs["info"]  = "times_{ith neuron} = times[rec_neuron_i[i]:rec_neuron_i[i+1]]"
@@ -95,29 +97,18 @@ def save_sli_to_hdf5(sim_spec="a1.0_t60.2", start_file=False):
         spikes_grp.attrs["n_neurons_rec_spike"] = n_neurons_rec_spike
     
         for j, population in enumerate(populations):
-            senders, times = get_GIDs_times(model, population, sli_data_path, t_trans)
-            times   = np.uint(times / sim.dt) # in units of dt!
-    
-            # Create array of indices for data: 
-            # times["ith neuron that fired"] = times[rec_neuron_i[i]:rec_neuron_i[i+1]]
-            n_spikes_per_neuron = np.zeros(n_neurons_rec_spike[j])
-            rec_neuron_i        = np.zeros(n_neurons_rec_spike[j] + 1)
-            # Now the indices:
-            n_spikes_fired = np.unique(senders, return_counts=True)[1] # n spikes, sorted by sender GID
-            max_index       = len(n_spikes_fired)               # number of neurons that fired >= 1 spike
-            n_spikes_per_neuron[:max_index] = n_spikes_fired    # the rest remains zero
-            rec_neuron_i[1 : ] = np.cumsum(n_spikes_per_neuron) # lower and upper bounds, 0th remains 0.
-    
-            # Sort times
-            sorted_times = times[np.argsort(senders)] 
-            for i in range(len(rec_neuron_i) - 1):
-                i0, i1 = (rec_neuron_i[i], rec_neuron_i[i+1])
-                sorted_times[i0:i1] = np.sort(sorted_times[i0:i1])
-    
+            senders, times = get_GIDs_times(model, population, sli_data_path, t_trans, n_processes)
+            times   = spike_functions.to_steps(times, sim.dt) # in units of dt!
+
+            # Sort times by recorded neuron and time: 
+            # times_{ith neuron} = times[rec_neuron_i[i]:rec_neuron_i[i+1]]
+            rec_GIDs = spike_functions.rec_GIDs_sli(sli_data_path, j, n_neurons_rec_spike[j], senders)
+            sorted_times, rec_neuron_i = spike_functions.sort_spikes(senders, times, rec_GIDs)
+
             # Save data to HDF5 file:
-            spikes_subgrp   = spikes_grp.create_group(population)
-            if len(sorted_times) > 0:
-                dset_times      = spikes_subgrp.create_dataset("times", data=sorted_times)
-            else:
-                dset_times      = spikes_subgrp.create_dataset("times", data=np.array([0]))
-            dset_indices    = spikes_subgrp.create_dataset("rec_neuron_i", data=rec_neuron_i)
+            spike_functions.write_spikes(spikes_grp.create_group(population), sorted_times, rec_neuron_i,
+                                         sim.spike_format)
+        if sim.spike_time_index:
+            spike_functions.add_time_index(spikes_grp, sim.t_bucket)
+
+    registry.catalog_file(path_hdf5_file)  # catalog of all data files
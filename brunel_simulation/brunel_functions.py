@@ -12,6 +12,7 @@ Contains:
 # Functions inside the loop
     prepare_simulation
     derive_parameters
+    initialize_neurons
     create_nodes    
     connect         
     save_data
@@ -19,11 +20,14 @@ Contains:
 from __future__ import print_function
 import nest
 import numpy as np
-import os
+import sys, os
 import h5py
+sys.path.append(os.path.abspath("../simulation/")) # include path with spike_functions
 # Import specific moduls
 from imp import reload
 import brunel_sim_params as sim; reload(sim)
+import spike_functions; reload(spike_functions)
+import registry; reload(registry)
 
 #######################################################
 # Pre-loop functions
@@ -87,21 +91,13 @@ def initialize_data_file(sub_path, model, verbose=True, name=None, append=False)
     
     return (data_file, file_name, data_path)
 
-def initialize_seeds():
-    """Creates initial master_seed from file or sim_spec (if no previous seed is found)."""
-    seed_file   = open(os.path.join(sim.log_path, "seeds.log"), "a+")    # File containing previous seed numbers
-    old_seeds   = seed_file.readlines()
-    if old_seeds == []:
-        master_seed = sim.master_seed
-        seed_file.write("seed\t\tdate       time\t\t file\n")
-    else:
-        last_line   = old_seeds[-1]
-        try: 
-            master_seed = int(last_line.split("\t")[0]) + 1
-        except: 
-            master_seed = sim.master_seed
-
-    return (seed_file, master_seed)
+def initialize_seeds(n_populations, data_file=None):
+    """Allocates a range of seeds in the registry of the microcircuit simulations
+    (registry.py, in sim.log_path), such that Brunel and microcircuit runs never share seeds.
+    Returns run_id and master_seed.
+    """
+    return registry.allocate_seeds(sim.n_vp, n_populations, data_file,
+                                   db_path=os.path.join(sim.log_path, "registry.db"))
 
 def initialize_info_file(file_name, data_path):
     """Save simulation details to info file."""
@@ -155,7 +151,48 @@ def derive_parameters(model):
 
     return n_neurons_rec_spike, n_neurons_rec_voltage
 
-def create_nodes(model, pyrngs):
+def initialize_neurons(model, GIDs, pyrngs, param_arrays=None):
+    """Initializes membrane potentials and heterogeneous parameters of the local neurons in GIDs.
+
+    Drawn from normal distributions (mean, std):
+        V_m         (Vm0_mean, Vm0_std), unless V_m is set in model_params
+        model.neuron_params_dist, in order of sorted parameter names
+    The values of all local neurons of one virtual process are drawn in one call
+    of pyrngs[vp] (in order of GIDs), such that results are reproducible per master_seed. 
+    param_arrays: optional dictionary {name: array of length len(GIDs)} of given values.
+
+    All values are applied with one SetStatus call.
+    """
+    distributions = []
+    if not "V_m" in model.model_params:
+        distributions.append(("V_m", (model.Vm0_mean, model.Vm0_std)))
+    for name in sorted(model.neuron_params_dist):
+        distributions.append((name, model.neuron_params_dist[name]))
+    if param_arrays is None:
+        param_arrays = {}
+    if len(distributions) == 0 and len(param_arrays) == 0:
+        return
+
+    nodes_info  = nest.GetStatus(GIDs, ["local", "vp"])
+    local       = np.array([ni[0] for ni in nodes_info], dtype=bool)
+    vps         = np.array([ni[1] for ni in nodes_info])[local]
+    local_GIDs  = list(np.array(GIDs)[local])
+
+    values = {}
+    for name, (mean, std) in distributions:
+        values[name] = np.zeros(len(local_GIDs))
+        for vp in np.unique(vps):
+            vp_mask = vps == vp
+            values[name][vp_mask] = pyrngs[vp].normal(mean, std, np.sum(vp_mask))
+    for name, param_array in param_arrays.items():
+        values[name] = np.asarray(param_array, dtype=float)[local]
+
+    names = list(values.keys())
+    status_dicts = [dict(zip(names, neuron_values)) for neuron_values in 
+                    zip(*[values[name].tolist() for name in names])]
+    nest.SetStatus(local_GIDs, status_dicts)
+
+def create_nodes(model, pyrngs, neuron_params=None):
     """Creates the following GIDs:
         neuron_GIDs
         ext_poisson
@@ -166,7 +203,10 @@ def create_nodes(model, pyrngs):
         multimeters
         th_spike_detector
     
-        Further initializes the neurons" membrane potentials.
+        Further initializes the neurons" membrane potentials 
+        (and heterogeneous parameters, see initialize_neurons).
+        neuron_params: optional list with one dictionary {name: array} per population
+        of per-neuron parameter values.
     """
     neuron_GIDs     = []
     spike_detectors = []
@@ -176,14 +216,11 @@ def create_nodes(model, pyrngs):
     for pop_index, population in enumerate(model.populations):
         # Neurons
         neuron_GIDs.append(nest.Create(model.neuron_model, model.n_neurons[pop_index], params=model.model_params))
-        # Initialize membrane potentials locally
-        # drawn from normal distribution with mu=Vm0_mean, sigma=Vm0_std
-        neurons_info    = nest.GetStatus(neuron_GIDs[pop_index])
-        if not model.model_params.has_key("V_m"):
-            for ni in neurons_info:                 
-                if ni["local"]:                         # only adapt local nodes
-                    Vm_init = pyrngs[ni["vp"]].normal(model.Vm0_mean, model.Vm0_std)
-                    nest.SetStatus([ni["global_id"]], {"V_m": Vm_init})
+        # Initialize membrane potentials (and heterogeneous parameters) locally
+        if neuron_params is None:
+            initialize_neurons(model, neuron_GIDs[pop_index], pyrngs)
+        else:
+            initialize_neurons(model, neuron_GIDs[pop_index], pyrngs, neuron_params[pop_index])
 
         # Devices
         if sim.record_cortical_spikes:
@@ -361,34 +398,19 @@ def save_data(grp, all_GIDs, populations, n_neurons_rec_spike, n_neurons_rec_vol
         spikes_grp.attrs["info2"]  = "times in units of dt; dt in ms  =>  times/ms = times * dt"
         spikes_grp.attrs["n_neurons_rec_spike"] = n_neurons_rec_spike
 
+        neuron_GIDs     = all_GIDs[0]
         for j, population in enumerate(populations):
-            senders = nest.GetStatus(spike_detectors[j])[0]["events"]["senders"]
-            times   = nest.GetStatus(spike_detectors[j])[0]["events"]["times"]
-            times   = np.uint(times / sim.dt) # in units of dt!
-
-            # Create array of indices for data: 
-            # times["ith neuron that fired"] = times[rec_neuron_i[i]:rec_neuron_i[i+1]]
-            n_spikes_per_neuron = np.zeros(n_neurons_rec_spike[j])
-            rec_neuron_i        = np.zeros(n_neurons_rec_spike[j] + 1)
-            # Now the indices:
-            n_spikes_fired = np.unique(senders, return_counts=True)[1] # n spikes, sorted by sender GID
-            max_index       = len(n_spikes_fired)               # number of neurons that fired >= 1 spike
-            n_spikes_per_neuron[:max_index] = n_spikes_fired    # the rest remains zero
-            rec_neuron_i[1 : ] = np.cumsum(n_spikes_per_neuron) # lower and upper bounds, 0th remains 0.
-
-            # Sort times
-            sorted_times = times[np.argsort(senders)] 
-            for i in range(len(rec_neuron_i) - 1):
-                i0, i1 = (rec_neuron_i[i], rec_neuron_i[i+1])
-                sorted_times[i0:i1] = np.sort(sorted_times[i0:i1])
+            events  = nest.GetStatus(spike_detectors[j], "events")[0]
+            times   = spike_functions.to_steps(events["times"], sim.dt) # in units of dt!
+
+            # Sort times by recorded neuron and time: 
+            # times["ith neuron"] = times[rec_neuron_i[i]:rec_neuron_i[i+1]]
+            rec_GIDs = neuron_GIDs[j][:n_neurons_rec_spike[j]]
+            sorted_times, rec_neuron_i = spike_functions.sort_spikes(events["senders"], times, 
+                                                                     rec_GIDs, n_neurons_rec_spike[j])
 
             # Save data to HDF5 file:
-            spikes_subgrp   = spikes_grp.create_group(population)
-            if len(sorted_times) > 0:
-                dset_times      = spikes_subgrp.create_dataset("times", data=sorted_times)
-            else:
-                dset_times      = spikes_subgrp.create_dataset("times", data=np.array([0]))
-            dset_indices    = spikes_subgrp.create_dataset("rec_neuron_i", data=rec_neuron_i)
+            spike_functions.write_spikes(spikes_grp.create_group(population), sorted_times, rec_neuron_i)
             
     if sim.record_voltage:
         multimeters = all_GIDs[2]
@@ -97,6 +97,7 @@ class model:
         self.neuron_model   = neuron_model
         self.Vm0_mean       = net.Vm0_mean            # mean of initial membrane potential (mV)
         self.Vm0_std        = net.Vm0_std            # std of initial membrane potential (mV)
+        self.neuron_params_dist = net.neuron_params_dist  # {name: (mean, std)} of heterogeneous parameters
         self.model_params   = net.model_params
         if not self.neuron_model=="iaf_psc_delta":
             self.model_params["tau_syn_ex"] = net.tau_syn_ex # excitatory synaptic time constant (ms)
@@ -65,6 +65,9 @@ syn_dict = {"model": "static_synapse"}
 neuron_model = "iaf_psc_delta"  # "iaf_psc_delta" or "iaf_psc_exp"
 Vm0_mean    =  0.0             # mean of initial membrane potential (mV)
 Vm0_std     = 0.1              # std of initial membrane potential (mV)
+# Heterogeneous single-neuron parameters, drawn for each neuron from a normal distribution
+# {name: (mean, std)}, e.g. {"V_th": (-50., 1.), "tau_m": (10., 1.)}
+neuron_params_dist = {}
 
 # neuron model parameters
 model_params = {"tau_m": 20.,       # membrane time constant (ms)
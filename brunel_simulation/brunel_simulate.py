@@ -5,7 +5,7 @@ Simulation of Brunel balanced random network (Brunel 2000)
 Structure:
 instantiate model                   from model_class.py
 initialize_data_file                creates file_name and opens HDF5-file
-initialize_seeds                    opens seeds.log and looks for previous master seeds 
+initialize_seeds                    obtains a range of seeds from the registry (simulation/registry.py)
 initialize_info_file                opens and initializes info_file, where basic parameters of the simulation are saved in plain text
 
 prepare_simulation              prepare random generators such that each simulation is independent 
@@ -27,6 +27,7 @@ from imp import reload
 import brunel_sim_params as sim; reload(sim)
 import brunel_functions as functions; reload(functions)
 import brunel_model_class as model_class; reload(model_class)
+import registry; reload(registry)     # simulation/registry.py (path set by brunel_functions)
 verbose     = False                     # whether to print every connection made
 append_data = False                     # whether to append the selected data_file
 synapse_type = "exp"
@@ -49,7 +50,7 @@ model           = model_class.model(neuron_model=neuron_model,
 #######################################################
 sub_path = "brunel"
 data_file, file_name, data_path = functions.initialize_data_file(sub_path, model, verbose, append=append_data, name=name)
-seed_file, master_seed          = functions.initialize_seeds()
+run_id, master_seed             = functions.initialize_seeds(model.n_populations, data_file.filename)
 info_file                       = functions.initialize_info_file(file_name, data_path)
 
 ######################################################
@@ -102,6 +103,7 @@ now         = str(datetime.datetime.now())[:-7]
 grp         = data_file.create_group(group_name)
 grp.attrs["date_and_time"] = now
 grp.attrs["master_seed"] = master_seed
+grp.attrs["run_id"] = run_id
 grp.attrs["C_ab"] = model.C_ab
 
 t_save_0    = time.time()
@@ -109,7 +111,7 @@ functions.save_data(grp, all_GIDs, model.populations, n_neurons_rec_spike, n_neu
 T_save = time.time() - t_save_0
 
 ###################################################
-# Save info, set new seed
+# Save info, record run
 ###################################################
 print("T_connect    = ", T_connect)
 print("T_simulate   = ", T_simulate)
@@ -124,11 +126,9 @@ info_str    = "{0:4s} {1:4.1f} {2:6.1f} {3:8.1f} {4:10.1f} {5:6.1f} {6:4d} {7:11
 info_str += now + "  " + group_name
 info_file.write(info_str + "\n")
 
-# save the last seed to file, such that independent realizations are possible
-last_seed = master_seed + 1 + 2 * sim.n_vp + 2 * model.n_populations - 1  # last -1 since range ends beforehand
-seed_file.write("{0:6d}".format(last_seed) + "\t\t" + 
-                now + "\t" + 
-                os.path.join(file_name, group_name) + "\n")
+# save the run to the registry (its seed range is reserved since initialize_seeds)
+registry.record_run(run_id, db_path=os.path.join(sim.log_path, "registry.db"), group_name=group_name, 
+                    area=model.area, t_sim=sim.t_sim, T_connect=T_connect, T_simulate=T_simulate, T_save=T_save)
     
 T_total = time.time() - T0
 print("T_total      = ", T_total)
@@ -136,6 +136,5 @@ data_file.attrs["total_time"]    = T_total
 info_file.write("total time: %.2f\n"%T_total)
 
 data_file.close()
-seed_file.close()
 info_file.close()
 ####################################################################################
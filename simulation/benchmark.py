@@ -0,0 +1,216 @@
+"""benchmark.py
+
+Scaling benchmark: short simulations of Potjans' model over
+area, threads (n_threads_per_proc), neuron_model and connection_rule.
+
+Usage:
+    python benchmark.py             # NEST (functions.create_nodes, connect, save_data)
+    python benchmark.py numpy       # numpy_backend.py, no NEST required
+
+Structure:
+Loop over all combinations of the parameters:
+    run_benchmark                   in a new python process (peak memory of this configuration only)
+        prepare_simulation, create_nodes, connect, export_connectome, nest.Simulate, save_data
+        or numpy_backend.network, simulate, save_data
+        each phase profiled by profiler.py; export_connectome (connectome_export.py, optional)
+        also records the time spent in nest.GetStatus, which bounds its throughput (conns_per_s)
+Results are printed as table and saved to
+    data_dir/benchmark/benchmark_<backend>_<date>.hdf5   (one group per configuration, attrs as in grp["profile"])
+    data_dir/benchmark/benchmark_<backend>_<date>.txt    (the table)
+"""
+from __future__ import print_function
+import numpy as np
+import h5py
+import sys, os, shutil
+import json
+import subprocess
+import tempfile
+import time, datetime
+
+from imp import reload
+import sim_params as sim; reload(sim)
+import functions; reload(functions)
+import model_class; reload(model_class)
+import profiler; reload(profiler)
+import numpy_backend; reload(numpy_backend)
+import connectome_export; reload(connectome_export)
+
+# Parameters of the sweep
+areas               = [0.05, 0.1, 0.2, 0.5, 1.0]
+n_threads           = [1, 2, 4, 8, 16]
+neuron_models       = ["iaf_psc_delta", "iaf_psc_exp", "iaf_psc_alpha"]
+connection_rules    = ["fixed_total_number", "fixed_indegree"]
+t_sim               = 1000.0    # ms; simulated time of each benchmark
+max_area_numpy      = 0.2       # numpy_backend.py is meant for small networks only
+master_seed         = sim.master_seed
+export_connectome   = True      # NEST: also export the connectome (connectome_export.py)
+
+table_columns = [("backend",          "%-7s"),
+                 ("area",             "%5.2f"),
+                 ("n_threads",        "%3i"),
+                 ("neuron_model",     "%-13s"),
+                 ("connection_rule",  "%-18s"),
+                 ("T_build",          "%8.1f"),
+                 ("T_connect",        "%9.1f"),
+                 ("T_simulate",       "%10.1f"),
+                 ("rtf",              "%6.2f"),
+                 ("T_save",           "%6.1f"),
+                 ("T_export",         "%8.1f"),
+                 ("T_get_status",     "%12.1f"),
+                 ("conns_per_s",      "%11.3g"),
+                 ("peak_rss_mb",      "%11.0f")]
+
+def run_benchmark(config, result_path):
+    """Simulate one configuration and save the profile (profiler.to_dict) to result_path (JSON).
+    Called in a new python process. 
+    (sim_params is changed here, thus modules reloading it must be imported before.)
+    """
+    sim.t_sim           = config["t_sim"]
+    sim.record_voltage  = False
+    model   = model_class.model(area=config["area"],
+                                neuron_model=config["neuron_model"],
+                                connection_rule=config["connection_rule"])
+    (n_neurons_rec_spike, n_neurons_rec_voltage) = functions.derive_parameters(model)
+
+    tmp_dir     = tempfile.mkdtemp()
+    data_file   = h5py.File(os.path.join(tmp_dir, "benchmark.hdf5"), "w")
+    grp         = data_file.create_group("0")
+    prof        = profiler.profiler(data_file)
+    if config["backend"] == "nest":
+        import nest
+        sim.n_threads_per_proc  = config["n_threads"]
+        sim.n_vp                = int(sim.n_threads_per_proc * sim.n_mpi_procs)
+        prof.start("prepare_simulation")
+        pyrngs = functions.prepare_simulation(config["master_seed"], n_populations=model.n_populations)
+        prof.stop()
+        prof.start("create_nodes")
+        all_GIDs = functions.create_nodes(model, pyrngs)
+        prof.stop()
+        prof.start("connect")
+        functions.connect(model, all_GIDs, n_neurons_rec_spike, n_neurons_rec_voltage, False)
+        prof.stop()
+        if config["export_connectome"]:
+            # Throughput of connectome_export.py, bounded by nest.GetStatus
+            prof.start("export_connectome")
+            connectome_export.export_connectome(os.path.join(tmp_dir, "connectome.hdf5"), model, all_GIDs)
+            prof.stop()
+            with h5py.File(os.path.join(tmp_dir, "connectome.hdf5"), "r") as export_file:
+                prof.stats["export_connectome"]["time_get_status"]  = float(export_file.attrs["time_get_status"])
+                prof.stats["export_connectome"]["n_connections"]    = int(export_file.attrs["n_connections"])
+        prof.start("simulate", t_model=sim.t_sim)
+        nest.Simulate(sim.t_sim)
+        prof.stop()
+        prof.start("save_data")
+        functions.save_data(grp, all_GIDs, model.populations, n_neurons_rec_spike, n_neurons_rec_voltage)
+        prof.stop()
+    elif config["backend"] == "numpy":
+        prof.start("connect")   # neurons and connectome
+        network = numpy_backend.network(model, config["master_seed"],
+                                        n_neurons_rec_spike, n_neurons_rec_voltage)
+        prof.stop()
+        prof.start("simulate", t_model=sim.t_sim)
+        network.simulate(sim.t_sim)
+        prof.stop()
+        prof.start("save_data")
+        network.save_data(grp)
+        prof.stop()
+    else:
+        raise Exception("Backend should be 'nest' or 'numpy'!")
+    data_file.close()
+    shutil.rmtree(tmp_dir)
+    with open(result_path, "w") as result_file:
+        json.dump(prof.to_dict(), result_file)
+
+def table_row(config, stats):
+    """Values of table_columns for one configuration."""
+    T_build = sum(stats[phase]["wall"] for phase in ("prepare_simulation", "create_nodes") if phase in stats)
+    values  = dict(config)
+    values.update({"T_build":       T_build,
+                   "T_connect":     stats["connect"]["wall"],
+                   "T_simulate":    stats["simulate"]["wall"],
+                   "rtf":           stats["simulate"]["real_time_factor"],
+                   "T_save":        stats["save_data"]["wall"],
+                   "peak_rss_mb":   max(phase_stats["peak_rss_mb"] for phase_stats in stats.values()),
+                   "T_export":      np.nan,
+                   "T_get_status":  np.nan,
+                   "conns_per_s":   np.nan})
+    if "export_connectome" in stats:
+        export_stats = stats["export_connectome"]
+        values.update({"T_export":      export_stats["wall"],
+                       "T_get_status":  export_stats["time_get_status"],
+                       "conns_per_s":   export_stats["n_connections"] / max(export_stats["wall"], 1e-9)})
+    return " ".join(fmt%values[key] for key, fmt in table_columns)
+
+if __name__ == "__main__" and len(sys.argv) == 4 and sys.argv[1] == "--run":
+    with open(sys.argv[2], "r") as config_file:
+        run_benchmark(json.load(config_file), sys.argv[3])
+
+elif __name__ == "__main__":
+    backend = "nest"
+    if len(sys.argv) > 1:
+        backend = sys.argv[1]
+    if backend == "numpy":
+        areas       = [area for area in areas if area <= max_area_numpy]
+        n_threads   = [1]   # single process, threads are not used
+
+    bench_path  = os.path.join(sim.data_dir, "benchmark")
+    if not os.path.exists(bench_path):
+        os.makedirs(bench_path)
+    now         = str(datetime.datetime.now())[:-7]
+    file_name   = "benchmark_" + backend + "_" + now.replace(" ", "_").replace(":", "-")
+    data_file   = h5py.File(os.path.join(bench_path, file_name + ".hdf5"), "w")
+    data_file.attrs["date_and_time"]    = now
+    data_file.attrs["backend"]          = backend
+    data_file.attrs["t_sim"]            = t_sim
+    data_file.attrs["dt"]               = sim.dt
+    table_file  = open(os.path.join(bench_path, file_name + ".txt"), "w")
+    header      = " ".join(key for key, fmt in table_columns)
+    print(header)
+    table_file.write(header + "\n")
+
+    tmp_dir = tempfile.mkdtemp()
+    for area in areas:
+        for n_thread in n_threads:
+            for neuron_model in neuron_models:
+                for connection_rule in connection_rules:
+                    config = {"backend":            backend,
+                              "area":               area,
+                              "n_threads":          n_thread,
+                              "neuron_model":       neuron_model,
+                              "connection_rule":    connection_rule,
+                              "t_sim":              t_sim,
+                              "master_seed":        master_seed,
+                              "export_connectome":  export_connectome and backend == "nest"}
+                    group_name  = "%s_a%.2f_t%i_%s_%s"%(backend, area, n_thread, neuron_model, connection_rule)
+                    config_path = os.path.join(tmp_dir, group_name + ".json")
+                    result_path = os.path.join(tmp_dir, group_name + "_result.json")
+                    with open(config_path, "w") as config_file:
+                        json.dump(config, config_file)
+                    env = dict(os.environ, OMP_NUM_THREADS=str(n_thread))
+                    return_code = subprocess.call([sys.executable, os.path.abspath(__file__),
+                                                   "--run", config_path, result_path], env=env)
+                    if not return_code == 0:
+                        print(group_name + " failed with code %i"%return_code)
+                        continue
+                    with open(result_path, "r") as result_file:
+                        profile = json.load(result_file)
+
+                    grp = data_file.create_group(group_name)
+                    for key, value in config.items():
+                        grp.attrs[key] = value
+                    profile_grp = grp.create_group("profile")
+                    profile_grp.attrs["phases"] = [str(phase) for phase in profile["phases"]]
+                    for phase in profile["phases"]:
+                        phase_grp = profile_grp.create_group(phase)
+                        for key, value in profile["stats"][phase].items():
+                            phase_grp.attrs[key] = value
+                    data_file.flush()
+
+                    row = table_row(config, profile["stats"])
+                    print(row)
+                    table_file.write(row + "\n")
+                    table_file.flush()
+
+    shutil.rmtree(tmp_dir)
+    table_file.close()
+    data_file.close()
@@ -0,0 +1,199 @@
+"""connectome.py
+
+Connectome of a model_class.model drawn with NumPy, 
+applied in:
+functions.connect (optional)
+numpy_backend.py
+simulate_microcircuit.py
+
+The connectome is a list of tuples, one per pair of populations:
+    (target_index, source_index, sources, targets, weights, delays)
+with sources and targets as indices within their population and delays in ms.
+source_index == model.n_populations denotes the thalamic population.
+
+Connectomes are cached in compressed HDF5 files (in sim.connectome_dir), 
+keyed by a hash of the model parameters and the seed. Repeated runs on the 
+same frozen network thus skip drawing and load the arrays instead.
+
+Contains:
+    normal_clipped
+    draw_connectome
+    connectome_key
+    save_connectome
+    read_connectome
+    load_connectome
+    connect_connectome
+"""
+from __future__ import print_function
+import numpy as np
+import h5py
+import hashlib
+import os
+# Import specific moduls
+from imp import reload
+import sim_params as sim; reload(sim)
+
+def normal_clipped(rng, mu, sigma, size, low=-np.inf, high=np.inf):
+    """Normal distribution clipped to [low, high].
+
+    Values outside the bounds are redrawn, as for NEST's 'normal_clipped'.
+    """
+    if sigma == 0:
+        return np.clip(np.ones(size) * mu, low, high)
+    values  = rng.normal(mu, sigma, size)
+    outside = (values < low) | (values > high)
+    while np.any(outside):
+        values[outside] = rng.normal(mu, sigma, np.sum(outside))
+        outside = (values < low) | (values > high)
+    return values
+
+def draw_connectome(model, rng, verbose=False):
+    """Draw the synapses of all population pairs (and thalamus)
+    following the rules of functions.connect.
+
+    Returns a list of tuples
+        (target_index, source_index, sources, targets, weights, delays)
+    with sources and targets as indices within their population and delays in ms.
+    source_index == model.n_populations denotes the thalamic population.
+    """
+    connections = []
+    for target_index, target_pop in enumerate(model.populations):
+        if verbose: print("Connecting target " + target_pop)
+        n_target = model.n_neurons[target_index]
+        for source_index, source_pop in enumerate(model.populations):
+            n_source    = model.n_neurons[source_index]
+            n_synapses  = model.C_ab[target_index, source_index]
+            if n_synapses < 1:  # in order to not have zero connections!
+                n_target_neurons = int(n_synapses * n_target)
+                target_ids  = rng.choice(n_target, n_target_neurons, replace=False)
+                n_synapses  = 1
+            else:
+                n_synapses  = int(n_synapses)
+                target_ids  = np.arange(n_target)
+            if n_synapses == 0 or len(target_ids) == 0:
+                continue
+            if verbose: print("\t" + source_pop)
+
+            if model.connection_rule == "fixed_total_number":
+                targets = target_ids[rng.randint(0, len(target_ids), n_synapses)]
+            elif model.connection_rule == "fixed_indegree":
+                targets = np.repeat(target_ids, n_synapses)
+            sources = rng.randint(0, n_source, len(targets))
+
+            mean_weight = model.weights[target_index, source_index]
+            std_weight  = abs(mean_weight * model.weight_rel_sd)
+            if mean_weight >= 0:
+                weights = normal_clipped(rng, mean_weight, std_weight, len(targets), low=0.)
+            else:
+                weights = normal_clipped(rng, mean_weight, std_weight, len(targets), high=0.)
+
+            mean_delay  = model.delays[target_index, source_index]
+            std_delay   = mean_delay * model.delay_rel_sd
+            delays      = normal_clipped(rng, mean_delay, std_delay, len(targets), low=0.1)
+
+            connections.append((target_index, source_index, sources, targets, weights, delays))
+
+        # Thalamic population
+        if not model.n_th == 0:
+            n_synapses_th = int(model.C_th_scaled[target_index])
+            if not n_synapses_th == 0:
+                if verbose: print("\tthalamus")
+                targets = rng.randint(0, n_target, n_synapses_th)
+                sources = rng.randint(0, model.n_th, n_synapses_th)
+                weights = normal_clipped(rng, model.weight_th, model.weight_th * model.weight_rel_sd,
+                                         n_synapses_th, low=0.)
+                delays  = normal_clipped(rng, model.delay_th, model.delay_th * model.delay_th_rel_sd,
+                                         n_synapses_th, low=0.1)
+                connections.append((target_index, model.n_populations, sources, targets, weights, delays))
+    return connections
+
+def connectome_key(model, seed):
+    """Hash of all parameters which determine the connectome of model drawn with seed."""
+    key = hashlib.sha1()
+    for array in (model.n_neurons, model.C_ab, model.weights, model.delays):
+        key.update(np.ascontiguousarray(array, dtype=float).tobytes())
+    if not model.n_th == 0:
+        key.update(np.ascontiguousarray(model.C_th_scaled, dtype=float).tobytes())
+    key.update(repr((model.connection_rule, 
+                     float(model.weight_rel_sd), float(model.delay_rel_sd),
+                     int(model.n_th), float(model.weight_th), 
+                     float(model.delay_th), float(model.delay_th_rel_sd),
+                     int(seed))).encode())
+    return key.hexdigest()
+
+def save_connectome(connections, file_path, key=None):
+    """Save connectome to compressed HDF5 file, one group per pair 'target_source'."""
+    with h5py.File(file_path, "w") as data_file:
+        data_file.attrs["info"] = "group 'target_index'_'source_index'; sources and targets are indices within population"
+        if not key is None:
+            data_file.attrs["key"] = key
+        for target_index, source_index, sources, targets, weights, delays in connections:
+            pair_grp = data_file.create_group("%i_%i"%(target_index, source_index))
+            pair_grp.attrs["target_index"] = target_index
+            pair_grp.attrs["source_index"] = source_index
+            for name, data in (("sources", sources.astype(np.uint32)), 
+                               ("targets", targets.astype(np.uint32)), 
+                               ("weights", weights), 
+                               ("delays", delays)):
+                pair_grp.create_dataset(name, data=data, compression="gzip", shuffle=True)
+
+def read_connectome(file_path):
+    """Read connectome saved by save_connectome."""
+    connections = []
+    with h5py.File(file_path, "r") as data_file:
+        pairs = sorted([grp for grp in data_file.values() if "target_index" in grp.attrs], 
+                       key=lambda grp: (grp.attrs["target_index"], grp.attrs["source_index"]))
+        for pair_grp in pairs:
+            connections.append((int(pair_grp.attrs["target_index"]), 
+                                int(pair_grp.attrs["source_index"]), 
+                                pair_grp["sources"][:].astype(np.int64), 
+                                pair_grp["targets"][:].astype(np.int64), 
+                                pair_grp["weights"][:], 
+                                pair_grp["delays"][:]))
+    return connections
+
+def load_connectome(model, seed, cache_dir=None, verbose=False, save=True):
+    """Connectome of model for seed: read from cache if existing, else drawn and cached.
+
+    cache_dir defaults to sim.connectome_dir.
+    save: whether a drawn connectome is written to the cache (with several MPI
+    processes only on rank 0; the others draw the same connectome).
+    """
+    if cache_dir is None:
+        cache_dir = sim.connectome_dir
+    key         = connectome_key(model, seed)
+    file_path   = os.path.join(cache_dir, "connectome_" + key + ".hdf5")
+    if os.path.exists(file_path):
+        if verbose: print("Load connectome " + file_path)
+        return read_connectome(file_path)
+
+    connections = draw_connectome(model, np.random.RandomState(seed), verbose)
+    if not save:
+        return connections
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir)
+    # Write to temporary file first, such that a crash does not leave a corrupt cache
+    temp_path   = file_path + ".%i.tmp"%os.getpid()
+    save_connectome(connections, temp_path, key)
+    os.rename(temp_path, file_path)
+    if verbose: print("Saved connectome " + file_path)
+    return connections
+
+def connect_connectome(model, connections, neuron_GIDs, th_parrots=None, verbose=False):
+    """Create the synapses of connections in NEST,
+    one 'one_to_one' Connect with weight and delay arrays per pair of populations.
+    """
+    import nest
+    neuron_GIDs = [np.array(GIDs) for GIDs in neuron_GIDs]
+    for target_index, source_index, sources, targets, weights, delays in connections:
+        if source_index == model.n_populations:
+            source_GIDs = np.array(th_parrots)[sources]
+        else:
+            source_GIDs = neuron_GIDs[source_index][sources]
+        target_GIDs = neuron_GIDs[target_index][targets]
+        if verbose: print("\t%i -> %i: %i synapses"%(source_index, target_index, len(targets)))
+        syn_dict            = model.syn_dict.copy()
+        syn_dict["weight"]  = weights
+        syn_dict["delay"]   = delays
+        nest.Connect(source_GIDs.tolist(), target_GIDs.tolist(), 
+                     conn_spec={"rule": "one_to_one"}, syn_spec=syn_dict)
@@ -0,0 +1,213 @@
+"""connectome_export.py
+
+Export of the connectome created in NEST and its statistics,
+applied in:
+get_synapse_numbers.py
+
+The synapses of the local target neurons are fetched in chunks of target
+neurons (about chunk_size synapses each) and appended to a compressed HDF5
+file with the layout of connectome.save_connectome (one group 'target_source'
+per pair of populations, sources and targets as indices within population),
+thus readable by connectome.read_connectome. With several MPI processes,
+each rank exports its local synapses to its own file (distributed.rank_file_path).
+
+In the same pass, connectivity_statistics accumulates with bincount
+    in-degrees      per target neuron and source population
+    out-degrees     per source neuron and target population
+    weights         histogram, mean and standard deviation per pair
+    delays          histogram (bins of dt), mean and standard deviation per pair
+which are saved to the group 'statistics' (connectivity_statistics.save).
+The same statistics can be obtained for a NumPy connectome (connectome.py).
+
+Throughput: NEST 2.x has no bulk array access to synapse properties; weights
+and delays are only available through nest.GetStatus of the connection tuples,
+which builds Python objects per synapse. The export is thus bounded by GetStatus
+whatever chunk_size. The time spent in GetStatus, the total time and the number
+of fetched connections (incl. devices and thalamus) are saved as attributes
+of the export file (time_get_status, time_export, n_connections) and measured
+by benchmark.py.
+
+Contains:
+    class connectivity_statistics
+        add
+        save
+    create_export_file
+    append_synapses
+    export_connectome
+    connectome_statistics
+"""
+from __future__ import print_function
+import numpy as np
+import h5py
+import time
+# Import specific moduls
+from imp import reload
+import sim_params as sim; reload(sim)
+import distributed; reload(distributed)
+
+class connectivity_statistics:
+    def __init__(self, model, n_bins_weight=100, n_sd_weight=5.):
+        """Statistics of the synapses between the populations of model.
+        Weights are binned within mean +- n_sd_weight standard deviations of each pair
+        (values outside in the outer bins).
+        """
+        self.model          = model
+        self.n_populations  = model.n_populations
+        self.n_bins_weight  = n_bins_weight
+        n   = self.n_populations
+        self.in_degrees     = [[np.zeros(model.n_neurons[t], dtype=np.int64) for s in range(n)]
+                               for t in range(n)]
+        self.out_degrees    = [[np.zeros(model.n_neurons[s], dtype=np.int64) for s in range(n)]
+                               for t in range(n)]
+        self.weight_edges   = np.zeros((n, n, n_bins_weight + 1))
+        for t in range(n):
+            for s in range(n):
+                mean    = model.weights[t, s]
+                spread  = max(n_sd_weight * model.weight_rel_sd * abs(mean), 1e-3 * abs(mean), 1e-12)
+                self.weight_edges[t, s] = np.linspace(mean - spread, mean + spread, n_bins_weight + 1)
+        self.weight_hist    = np.zeros((n, n, n_bins_weight), dtype=np.int64)
+        self.delay_hist     = [[np.zeros(0, dtype=np.int64) for s in range(n)] for t in range(n)]
+        self.n_synapses     = np.zeros((n, n), dtype=np.int64)
+        self.weight_sum     = np.zeros((n, n))
+        self.weight_sum_sq  = np.zeros((n, n))
+        self.delay_sum      = np.zeros((n, n))
+        self.delay_sum_sq   = np.zeros((n, n))
+
+    def add(self, target_index, source_index, sources, targets, weights, delays):
+        """Add synapses of one pair of populations (indices within population, delays in ms)."""
+        t, s = target_index, source_index
+        if s >= self.n_populations or len(targets) == 0:    # thalamus
+            return
+        self.in_degrees[t][s]   += np.bincount(targets, minlength=self.model.n_neurons[t])
+        self.out_degrees[t][s]  += np.bincount(sources, minlength=self.model.n_neurons[s])
+        weight_bins = np.clip(np.searchsorted(self.weight_edges[t, s], weights, side="right") - 1,
+                              0, self.n_bins_weight - 1)
+        self.weight_hist[t, s]  += np.bincount(weight_bins, minlength=self.n_bins_weight)
+        delay_hist  = np.bincount(np.int_(np.rint(np.asarray(delays) / sim.dt)))
+        n_bins      = max(len(delay_hist), len(self.delay_hist[t][s]))
+        self.delay_hist[t][s] = np.pad(self.delay_hist[t][s], (0, n_bins - len(self.delay_hist[t][s])),
+                                       "constant") + np.pad(delay_hist, (0, n_bins - len(delay_hist)), "constant")
+        self.n_synapses[t, s]       += len(targets)
+        self.weight_sum[t, s]       += np.sum(weights)
+        self.weight_sum_sq[t, s]    += np.sum(np.square(weights))
+        self.delay_sum[t, s]        += np.sum(delays)
+        self.delay_sum_sq[t, s]     += np.sum(np.square(delays))
+
+    def save(self, grp):
+        """Save histograms and moments to grp:
+            n_synapses, weight_mean, weight_sd, delay_mean, delay_sd    arrays (target, source)
+            weight_hist, weight_edges                                   arrays (target, source, bin)
+            <target>/<source>/in_degree_hist    number of target neurons with in-degree k
+            <target>/<source>/out_degree_hist   number of source neurons with out-degree k
+            <target>/<source>/delay_hist        number of synapses with delay k * dt
+        """
+        n           = np.maximum(self.n_synapses, 1)
+        weight_mean = self.weight_sum / n
+        delay_mean  = self.delay_sum / n
+        grp.attrs["dt"] = sim.dt
+        grp.create_dataset("n_synapses", data=self.n_synapses)
+        grp.create_dataset("weight_mean", data=weight_mean)
+        grp.create_dataset("weight_sd", data=np.sqrt(np.maximum(self.weight_sum_sq / n - weight_mean**2, 0.)))
+        grp.create_dataset("delay_mean", data=delay_mean)
+        grp.create_dataset("delay_sd", data=np.sqrt(np.maximum(self.delay_sum_sq / n - delay_mean**2, 0.)))
+        grp.create_dataset("weight_hist", data=self.weight_hist)
+        grp.create_dataset("weight_edges", data=self.weight_edges)
+        for t, target_pop in enumerate(self.model.populations):
+            for s, source_pop in enumerate(self.model.populations):
+                pair_grp = grp.create_group(target_pop + "/" + source_pop)
+                pair_grp.create_dataset("in_degree_hist", data=np.bincount(self.in_degrees[t][s]))
+                pair_grp.create_dataset("out_degree_hist", data=np.bincount(self.out_degrees[t][s]))
+                pair_grp.create_dataset("delay_hist", data=self.delay_hist[t][s])
+
+def create_export_file(file_path, model, chunk_size=2**16):
+    """HDF5 file with extendable compressed datasets sources, targets (uint32),
+    weights and delays per pair of populations (layout of connectome.save_connectome).
+    """
+    export_file = h5py.File(file_path, "w")
+    export_file.attrs["info"] = "group 'target_index'_'source_index'; sources and targets are indices within population"
+    for target_index in range(model.n_populations):
+        for source_index in range(model.n_populations):
+            pair_grp = export_file.create_group("%i_%i"%(target_index, source_index))
+            pair_grp.attrs["target_index"] = target_index
+            pair_grp.attrs["source_index"] = source_index
+            for name, dtype in (("sources", np.uint32), ("targets", np.uint32),
+                                ("weights", float), ("delays", float)):
+                pair_grp.create_dataset(name, shape=(0,), maxshape=(None,), chunks=(chunk_size,),
+                                        dtype=dtype, compression="gzip", shuffle=True)
+    return export_file
+
+def append_synapses(pair_grp, sources, targets, weights, delays):
+    """Append synapses to the datasets of pair_grp."""
+    n_old   = pair_grp["targets"].shape[0]
+    n_new   = n_old + len(targets)
+    for name, data in (("sources", sources), ("targets", targets),
+                       ("weights", weights), ("delays", delays)):
+        pair_grp[name].resize((n_new,))
+        pair_grp[name][n_old:n_new] = data
+
+def export_connectome(file_path, model, all_GIDs, chunk_size=2**20, verbose=False):
+    """Export the synapses between the neurons of all_GIDs[0] (local targets)
+    to file_path and save their connectivity_statistics to its group 'statistics'.
+    Returns the statistics.
+    """
+    import nest
+    if distributed.n_procs() > 1:
+        file_path = distributed.rank_file_path(file_path, distributed.rank())
+    neuron_GIDs = [np.array(GIDs) for GIDs in all_GIDs[0]]
+    first_GIDs  = np.array([GIDs[0] for GIDs in neuron_GIDs])
+    pop_order   = np.argsort(first_GIDs)
+    statistics  = connectivity_statistics(model)
+    # Target neurons per chunk such that a chunk has about chunk_size synapses
+    in_degree   = np.sum(model.K_ab, axis=1)
+
+    t0 = time.time()
+    T_get_status    = 0.
+    n_connections   = 0
+    with create_export_file(file_path, model) as export_file:
+        for target_index, target_pop in enumerate(model.populations):
+            local       = np.array(nest.GetStatus(neuron_GIDs[target_index].tolist(), "local"), dtype=bool)
+            local_GIDs  = neuron_GIDs[target_index][local]
+            n_targets   = max(int(chunk_size / max(in_degree[target_index], 1.)), 1)
+            for chunk_start in range(0, len(local_GIDs), n_targets):
+                chunk_GIDs  = local_GIDs[chunk_start:chunk_start + n_targets]
+                conns       = nest.GetConnections(target=chunk_GIDs.tolist())
+                if len(conns) == 0:
+                    continue
+                conn_array  = np.array(conns)
+                source_GIDs = conn_array[:, 0]
+                t_get_status    = time.time()
+                weights, delays = np.array(nest.GetStatus(conns, ["weight", "delay"])).T
+                T_get_status   += time.time() - t_get_status
+                n_connections  += len(conns)
+                # Source population of each synapse; drop devices (and thalamus)
+                source_index = pop_order[np.maximum(np.searchsorted(first_GIDs[pop_order],
+                                                                    source_GIDs, side="right") - 1, 0)]
+                sources     = source_GIDs - first_GIDs[source_index]
+                cortical    = (source_GIDs >= first_GIDs[source_index]) & \
+                              (sources < model.n_neurons[source_index])
+                targets     = conn_array[:, 1] - first_GIDs[target_index]
+                order       = np.argsort(source_index[cortical], kind="mergesort")
+                source_index, sources, targets, weights, delays = [array[cortical][order] for array in
+                    (source_index, sources, targets, weights, delays)]
+                bounds      = np.searchsorted(source_index, np.arange(model.n_populations + 1))
+                for s in range(model.n_populations):
+                    pair    = slice(bounds[s], bounds[s + 1])
+                    if bounds[s] == bounds[s + 1]:
+                        continue
+                    append_synapses(export_file["%i_%i"%(target_index, s)],
+                                    sources[pair], targets[pair], weights[pair], delays[pair])
+                    statistics.add(target_index, s, sources[pair], targets[pair], weights[pair], delays[pair])
+            if verbose: print("\t%s: %.1f s"%(target_pop, time.time() - t0))
+        statistics.save(export_file.create_group("statistics"))
+        export_file.attrs["time_get_status"]    = T_get_status
+        export_file.attrs["time_export"]        = time.time() - t0
+        export_file.attrs["n_connections"]      = n_connections
+        if verbose: print("\t%i connections, %.1f s in GetStatus"%(n_connections, T_get_status))
+    return statistics
+
+def connectome_statistics(model, connections):
+    """connectivity_statistics of a NumPy connectome (connectome.py)."""
+    statistics = connectivity_statistics(model)
+    for target_index, source_index, sources, targets, weights, delays in connections:
+        statistics.add(target_index, source_index, sources, targets, weights, delays)
+    return statistics
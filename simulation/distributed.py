@@ -0,0 +1,176 @@
+"""distributed.py
+
+Output of simulations with several MPI processes (sim.n_mpi_procs > 1),
+applied in:
+functions.py    (initialize_data_file, save_data, run_simulation)
+registry.py     (allocate_seeds_rank0)
+
+Each rank only sees the events of its local neurons. Instead of gathering them,
+each rank writes them to its own file, next to the data file,
+    <data file>.rank<r>.hdf5
+with the group structure of the data file (rank 0 opens it in addition to the
+data file, the other ranks use it as their data file). Then, collectively,
+    spikes      rank 0 gathers the spike counts of the recorded neurons of
+                each rank, writes rec_neuron_i and joins the times of all ranks
+                in a virtual dataset
+    voltage     rank 0 gathers the indices of the recorded neurons of each rank
+                and joins their rows in a virtual dataset
+such that the data file has the same layout as for serial runs. The rank files
+have to stay in the directory of the data file. Collective operations use mpi4py.
+
+Contains:
+    rank
+    n_procs
+    broadcast
+    rank_file_path
+    local_group
+    join_spikes
+    virtual_spikes
+    join_voltage
+    virtual_voltage
+"""
+from __future__ import print_function
+try:
+    import nest
+except ImportError:
+    nest = None
+try:
+    from mpi4py import MPI
+except ImportError:
+    MPI = None
+import numpy as np
+import h5py
+import os
+
+def rank():
+    """MPI rank of this process (0 without NEST)."""
+    if nest is None:
+        return 0
+    return nest.Rank()
+
+def n_procs():
+    """Number of MPI processes (1 without NEST)."""
+    if nest is None:
+        return 1
+    return nest.NumProcesses()
+
+def communicator():
+    if MPI is None:
+        raise Exception("Output of several MPI processes requires mpi4py!")
+    return MPI.COMM_WORLD
+
+def broadcast(value):
+    """value of rank 0 on all ranks."""
+    if n_procs() == 1:
+        return value
+    return communicator().bcast(value, root=0)
+
+def rank_file_path(file_path, rank_i):
+    """Path of the file of rank rank_i for the data file file_path."""
+    return os.path.splitext(file_path)[0] + ".rank%i.hdf5"%rank_i
+
+def local_group(grp):
+    """Group of the file of this rank corresponding to grp of the data file.
+    Ranks > 0 use their file as data file, thus grp itself.
+    """
+    if rank() > 0:
+        return grp
+    local_file = h5py.File(rank_file_path(grp.file.filename, 0), "a")
+    return local_file.require_group(grp.name)
+
+def join_spikes(spikes_grp, local_spikes_grp, populations):
+    """Collective: join the spikes of local_spikes_grp of all ranks in spikes_grp
+    (of the data file, None on ranks > 0).
+    """
+    local_spikes_grp.file.flush()
+    counts  = [np.diff(local_spikes_grp[population]["rec_neuron_i"][:]).astype(int)
+               for population in populations]
+    counts_all = communicator().gather(counts, root=0)
+    if rank() == 0:
+        file_names = [os.path.basename(rank_file_path(spikes_grp.file.filename, rank_i))
+                      for rank_i in range(len(counts_all))]
+        for j, population in enumerate(populations):
+            sources = [(file_name, local_spikes_grp.name + "/" + population + "/times")
+                       for file_name in file_names]
+            local_times = local_spikes_grp[population]["times"]
+            pop_grp     = spikes_grp.create_group(population)
+            virtual_spikes(pop_grp, sources, np.array([counts_rank[j] for counts_rank in counts_all]),
+                           local_times.dtype, local_times.attrs.get("encoding", "plain"))
+            for key, value in local_times.attrs.items():    # encoding (delta: restarts per neuron)
+                pop_grp["times"].attrs[key] = value
+    communicator().Barrier()
+
+def virtual_spikes(pop_grp, sources, counts, dtype=np.uint64, spike_format="plain"):
+    """Write rec_neuron_i and the virtual dataset times to pop_grp.
+
+    sources: (file name, dataset) of the sorted times of each rank
+    counts: array (n_ranks, n_neurons_rec), spikes of each recorded neuron on each rank
+    spike_format: of the sources; "delta": rec_neuron_i as int64 (spike_functions.write_spikes)
+    The times of each neuron are contiguous in the file of each rank; consecutive
+    neurons of the same rank are mapped at once.
+    """
+    rec_neuron_i        = np.zeros(counts.shape[1] + 1)
+    if spike_format == "delta":
+        rec_neuron_i    = np.zeros(counts.shape[1] + 1, dtype=np.int64)
+    rec_neuron_i[1:]    = np.cumsum(np.sum(counts, axis=0))
+    n_spikes    = int(rec_neuron_i[-1])
+    if n_spikes == 0:
+        pop_grp.create_dataset("times", data=np.array([0]))
+        pop_grp.create_dataset("rec_neuron_i", data=rec_neuron_i)
+        return
+
+    # Blocks (rank, neuron) with spikes, in order of the data file
+    neurons, ranks  = np.nonzero(counts.T)
+    block_counts    = counts[ranks, neurons]
+    global_start    = np.append(0, np.cumsum(block_counts)[:-1])
+    local_offsets   = np.append(np.zeros((counts.shape[0], 1), dtype=int),
+                                np.cumsum(counts, axis=1), axis=1)
+    local_start     = local_offsets[ranks, neurons]
+    # Runs of consecutive blocks of the same rank
+    new_run         = np.append(True, ranks[1:] != ranks[:-1])
+    run_first       = np.flatnonzero(new_run)
+    run_last        = np.append(run_first[1:], len(ranks)) - 1
+
+    layout  = h5py.VirtualLayout(shape=(n_spikes,), dtype=dtype)
+    for first, last in zip(run_first, run_last):
+        rank_i  = ranks[first]
+        file_name, dataset = sources[rank_i]
+        source  = h5py.VirtualSource(file_name, dataset, shape=(int(local_offsets[rank_i, -1]),))
+        n       = int(global_start[last] + block_counts[last] - global_start[first])
+        layout[int(global_start[first]):int(global_start[first]) + n] = \
+            source[int(local_start[first]):int(local_start[first]) + n]
+    pop_grp.create_virtual_dataset("times", layout)
+    pop_grp.create_dataset("rec_neuron_i", data=rec_neuron_i)
+
+def join_voltage(voltage_grp, local_voltage_grp, populations, n_neurons_rec_voltage):
+    """Collective: join the membrane potentials of local_voltage_grp of all ranks
+    in voltage_grp (of the data file, None on ranks > 0).
+    """
+    local_voltage_grp.file.flush()
+    local   = [(local_voltage_grp[population + "_neuron_i"][:], local_voltage_grp[population].shape)
+               for population in populations]
+    local_all = communicator().gather(local, root=0)
+    if rank() == 0:
+        file_names = [os.path.basename(rank_file_path(voltage_grp.file.filename, rank_i))
+                      for rank_i in range(len(local_all))]
+        for j, population in enumerate(populations):
+            sources = [(file_name, local_voltage_grp.name + "/" + population, local_rank[j][1],
+                        local_rank[j][0]) for file_name, local_rank in zip(file_names, local_all)]
+            virtual_voltage(voltage_grp, population, sources, n_neurons_rec_voltage[j])
+    communicator().Barrier()
+
+def virtual_voltage(voltage_grp, population, sources, n_neurons_rec):
+    """Write the virtual dataset population (n_neurons_rec, n_times) to voltage_grp.
+
+    sources: (file name, dataset, shape, neuron_i) of each rank, where row k of
+    the dataset holds the membrane potentials of recorded neuron neuron_i[k].
+    """
+    n_times = max([shape[1] for file_name, dataset, shape, neuron_i in sources if shape[0] > 0] + [0])
+    layout  = h5py.VirtualLayout(shape=(n_neurons_rec, n_times), dtype=float)
+    for file_name, dataset, shape, neuron_i in sources:
+        if shape[0] == 0:
+            continue
+        source  = h5py.VirtualSource(file_name, dataset, shape=shape)
+        for k, i in enumerate(neuron_i):
+            layout[int(i)] = source[k]
+    voltage_grp.create_virtual_dataset(population, layout, fillvalue=np.nan)
@@ -0,0 +1,111 @@
+"""downscaling.py
+
+Report how well downscaled models (area < 1) preserve the input statistics
+of the full-scale model (model_class.py, scaling "linear" or "compensated").
+
+Usage:
+    python downscaling.py [area ...]            # default areas: 0.1 0.01
+    python downscaling.py --simulate [area ...] # also simulated rates (numpy_backend.py)
+
+Structure:
+full-scale model, mean field rates (rates_full)
+For each area and scaling:
+    mean (mu) and standard deviation (sd) of the input at rates_full,
+    compared to the full-scale model (first and second order statistics)
+    in-degrees K, fraction K / N of the source populations (shared input,
+    > 1: multapses), DC input, mean field rates of the downscaled model
+    rate_s (--simulate): rates simulated with numpy_backend.py (validate_background.py),
+    which also reflect the correlations due to shared input
+The table is printed and saved to
+    data_dir/downscaling/downscaling_<date>.txt
+
+Contains:
+    input_statistics
+    report
+"""
+from __future__ import print_function
+import numpy as np
+import sys, os
+import datetime
+
+from imp import reload
+import sim_params as sim; reload(sim)
+import model_class; reload(model_class)
+import functions; reload(functions)
+import validate_background; reload(validate_background)
+
+# Parameters of the report
+neuron_model    = "iaf_psc_exp"
+connection_rule = "fixed_indegree"  # mean field (mat_mu, mat_var) assumes in-degrees C_ab
+scalings        = ["linear", "compensated"]
+
+def input_statistics(model, rates):
+    """Mean and standard deviation (mV) of the input of each population at rates (Hz),
+    and the largest fraction K_ab / N_b of a source population b.
+    """
+    shared = np.max(model.K_ab / np.maximum(model.n_neurons, 1), axis=1)
+    return model.mu(rates), model.sd(rates), shared
+
+def report(area, model_full, rates_full, simulate=False):
+    """Lines of the table comparing the models of all scalings at area to model_full."""
+    mu_full, sd_full, shared_full = input_statistics(model_full, rates_full)
+    n_synapses_full = np.sum(model_full.K_ab.T * model_full.n_neurons)
+    lines = []
+    for scaling in scalings:
+        model = model_class.model(area=area, neuron_model=neuron_model,
+                                  connection_rule=connection_rule,
+                                  scaling=scaling, rates_full=rates_full)
+        mu, sd, shared = input_statistics(model, rates_full)
+        try:
+            rates = model.mean_field_rates(rates_full)
+        except Exception:
+            rates = np.nan * np.ones(model.n_populations)
+        n_synapses = np.sum(model.K_ab.T * model.n_neurons)
+        if simulate:
+            print("Simulate area %.3f, %s"%(area, scaling))
+            rates_sim = validate_background.run_numpy(model, *functions.derive_parameters(model))
+        else:
+            rates_sim = np.nan * np.ones(model.n_populations)
+
+        lines.append("area %.3f, %s: %.2e synapses (%.4f of full scale)"%(
+            area, scaling, n_synapses, n_synapses / n_synapses_full))
+        lines.append("%-6s %8s %8s %7s %7s %7s %7s %6s %6s %8s %7s %7s %7s"%(
+            "pop", "K_full", "K", "mu_f", "mu", "sd_f", "sd", "K/N_f", "K/N", "dc", 
+            "rate_f", "rate", "rate_s"))
+        for j, population in enumerate(model.populations):
+            lines.append("%-6s %8.1f %8.1f %7.2f %7.2f %7.2f %7.2f %6.3f %6.3f %8.1f %7.3f %7.3f %7.3f"%(
+                population, np.sum(model_full.K_ab[j]), np.sum(model.K_ab[j]),
+                mu_full[j], mu[j], sd_full[j], sd[j], shared_full[j], shared[j],
+                model.dc_ext[j], rates_full[j], rates[j], rates_sim[j]))
+        lines.append("max |mu - mu_f| = %.3f mV, max |sd / sd_f - 1| = %.4f, max |rate / rate_f - 1| = %.4f"%(
+            np.max(np.abs(mu - mu_full)), np.max(np.abs(sd / sd_full - 1.)),
+            np.max(np.abs(rates / rates_full - 1.))))
+        lines.append("")
+    return lines
+
+if __name__ == "__main__":
+    simulate    = "--simulate" in sys.argv
+    args        = [arg for arg in sys.argv[1:] if not arg == "--simulate"]
+    areas       = [0.1, 0.01]
+    if len(args) > 0:
+        areas = [float(arg) for arg in args]
+    if simulate:
+        sim.t_sim           = validate_background.t_sim
+        sim.record_voltage  = False
+
+    model_full  = model_class.model(area=1., neuron_model=neuron_model,
+                                    connection_rule=connection_rule)
+    rates_full  = model_full.mean_field_rates()
+    lines = ["%s, %s; full-scale mean field rates (Hz): "%(neuron_model, connection_rule) +
+             " ".join("%.3f"%rate for rate in rates_full), ""]
+    for area in areas:
+        lines += report(area, model_full, rates_full, simulate)
+
+    print("\n".join(lines))
+    result_path = os.path.join(sim.data_dir, "downscaling")
+    if not os.path.exists(result_path):
+        os.makedirs(result_path)
+    now         = str(datetime.datetime.now())[:-7]
+    file_name   = "downscaling_" + now.replace(" ", "_").replace(":", "-") + ".txt"
+    with open(os.path.join(result_path, file_name), "w") as result_file:
+        result_file.write("\n".join(lines) + "\n")
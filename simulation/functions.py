@@ -8,23 +8,37 @@ simulate_transition.py
 Contains:
 # Pre-loop
     initialize_data_file
-    initialize_seeds
-    initialize_info_file
 # Functions inside the loop
     prepare_simulation
     derive_parameters
+    initialize_neurons
     create_nodes    
     connect         
+    create_spikes_group
+    save_checkpoint
+    restore_checkpoint
+    simulate_chunked
+    simulate_adaptive
+    run_simulation
     save_data
 """
 from __future__ import print_function
-import nest
+try:
+    import nest
+except ImportError:     # pre-loop functions remain usable without NEST (numpy_backend.py)
+    nest = None
 import numpy as np
 import os
 import h5py
 # Import specific moduls
 from imp import reload
 import sim_params as sim; reload(sim)
+import connectome; reload(connectome)
+import spike_functions; reload(spike_functions)
+import stationarity; reload(stationarity)
+import online_statistics; reload(online_statistics)
+import random_streams; reload(random_streams)
+import distributed; reload(distributed)
 
 #######################################################
 # Pre-loop functions
@@ -49,8 +63,10 @@ def initialize_data_file(sub_path, model, verbose=True, name=None, append=False)
         sim_spec = "a%.1f_t%.1f"%(model.area, sim.t_sim * 1e-3)
         if not model.n_th == 0:
             sim_spec += "_th"
-        if not model.dc_amplitude == 0:
+        if np.any(model.dc_ext != 0):
             sim_spec += "_dc"
+        if not model.scaling == "linear":
+            sim_spec += "_" + model.scaling
         if model.connection_rule=="fixed_indegree":
             sim_spec += "_fixindeg"
     else:
@@ -68,6 +84,8 @@ def initialize_data_file(sub_path, model, verbose=True, name=None, append=False)
                     if file_number.isdigit():
                         max_n = max(max_n, int(file_number))
             file_name = sim_spec + "_" + str(max_n + 1).zfill(2) + ".hdf5"
+    # Rank 0 chooses the file name; the other ranks write to their own files (distributed.py)
+    file_name   = distributed.broadcast(file_name)
     if verbose: print("Filename: micro/" + file_name)
     
     if append:
@@ -75,7 +93,12 @@ def initialize_data_file(sub_path, model, verbose=True, name=None, append=False)
     else:
         write_mode = "w"
 
-    data_file = h5py.File(os.path.join(data_path, file_name), write_mode)
+    file_path   = os.path.join(data_path, file_name)
+    if distributed.rank() > 0:
+        file_path   = distributed.rank_file_path(file_path, distributed.rank())
+        if append and not os.path.exists(file_path):
+            write_mode = "w"
+    data_file = h5py.File(file_path, write_mode)
     
     # Attributes
     data_file.attrs["area"]     = model.area
@@ -85,6 +108,7 @@ def initialize_data_file(sub_path, model, verbose=True, name=None, append=False)
     data_file.attrs["dt"]       = sim.dt
     data_file.attrs["neuron_model"]     = model.neuron_model
     data_file.attrs["connection_rule"]  = model.connection_rule
+    data_file.attrs["scaling"]          = model.scaling
     data_file.attrs["populations"]      = model.populations 
     data_file.attrs["layers"]           = model.layers 
     data_file.attrs["types"]            = model.types 
@@ -96,38 +120,15 @@ def initialize_data_file(sub_path, model, verbose=True, name=None, append=False)
     
     return (data_file, file_name, data_path)
 
-def initialize_seeds():
-    """Creates initial master_seed from file or sim_spec (if no previous seed is found)."""
-    seed_file   = open(os.path.join(sim.log_path, "seeds.log"), "a+")    # File containing previous seed numbers
-    old_seeds   = seed_file.readlines()
-    if old_seeds == []:
-        master_seed = sim.master_seed
-        seed_file.write("seed\t\tdate       time\t\t file\n")
-    else:
-        last_line   = old_seeds[-1]
-        try: 
-            master_seed = int(last_line.split("\t")[0]) + 1
-        except: 
-            master_seed = sim.master_seed
-
-    return (seed_file, master_seed)
-
-def initialize_info_file(file_name, data_path):
-    """Save simulation details to info file."""
-    info_file_dir = os.path.join(data_path, "info.log")
-    info_file   = open(info_file_dir, "a+")     # save the parameters of the simulation(s)
-    info_file.write("\nfilename: " + file_name + "\n")
-    info_str0   = "i    area t_sim  T_conn   T_sim      T_save n_vp master_seed  date       time      groupname"
-    info_file.write(info_str0 + "\n")
-
-    return info_file
-
 
 #######################################################
 # Functions inside the loop
 #######################################################
 def prepare_simulation(master_seed, n_populations):
-    """Prepare random generators with master seed."""
+    """Prepare random generators with master seed.
+    Returns pyrngs, one per virtual process, or a random_streams.counter_stream
+    if sim.counter_streams.
+    """
     nest.ResetKernel()
     # set global kernel parameters
     nest.SetKernelStatus(
@@ -140,13 +141,15 @@ def prepare_simulation(master_seed, n_populations):
         nest.SetKernelStatus({"data_path": os.path.join(sim.data_dir, "text")})
    
     # Set random seeds
+    rng_seeds, grng_seed = random_streams.nest_seeds(master_seed, sim.n_vp)
     nest.sli_run('0 << /rngs [%i %i] Range { rngdict/gsl_mt19937 :: exch CreateRNG } Map >> SetStatus'%(
-                 master_seed, master_seed + sim.n_vp - 1))
-    #nest.SetKernelStatus({"rng_seeds" : range(master_seed, master_seed + sim.n_vp)})
-    nest.sli_run('0 << /grng rngdict/gsl_mt19937 :: %i CreateRNG >> SetStatus'%(master_seed + sim.n_vp))
-    #nest.SetKernelStatus({"grng_seed" : master_seed + sim.n_vp})
-    pyrngs = [np.random.RandomState(s) for s in 
-                range(master_seed + sim.n_vp + 1, master_seed + 2 * sim.n_vp + 1)]
+                 rng_seeds[0], rng_seeds[-1]))
+    #nest.SetKernelStatus({"rng_seeds" : rng_seeds})
+    nest.sli_run('0 << /grng rngdict/gsl_mt19937 :: %i CreateRNG >> SetStatus'%(grng_seed))
+    #nest.SetKernelStatus({"grng_seed" : grng_seed})
+    if sim.counter_streams:
+        return random_streams.counter_stream(master_seed)
+    pyrngs = [np.random.RandomState(s) for s in random_streams.pyrng_seeds(master_seed, sim.n_vp)]
     return pyrngs
 
 def derive_parameters(model):
@@ -166,10 +169,56 @@ def derive_parameters(model):
 
     return n_neurons_rec_spike, n_neurons_rec_voltage
 
-def create_nodes(model, pyrngs):
+def initialize_neurons(model, GIDs, pyrngs, param_arrays=None, pop_index=0):
+    """Initializes membrane potentials and heterogeneous parameters of the local neurons in GIDs.
+
+    Drawn from normal distributions (mean, std):
+        V_m         (Vm0_mean, Vm0_std), unless V_m is set in model_params
+        model.neuron_params_dist, in order of sorted parameter names
+    The values of all local neurons of one virtual process are drawn in one call
+    of pyrngs[vp] (in order of GIDs), such that results are reproducible per master_seed. 
+    If pyrngs is a random_streams.counter_stream, the value of the i-th neuron of GIDs
+    is drawn for (name, pop_index, i), independent of the virtual processes.
+    param_arrays: optional dictionary {name: array of length len(GIDs)} of given values.
+
+    All values are applied with one SetStatus call.
+    """
+    distributions = []
+    if not "V_m" in model.model_params:
+        distributions.append(("V_m", (model.Vm0_mean, model.Vm0_std)))
+    for name in sorted(model.neuron_params_dist):
+        distributions.append((name, model.neuron_params_dist[name]))
+    if param_arrays is None:
+        param_arrays = {}
+    if len(distributions) == 0 and len(param_arrays) == 0:
+        return
+
+    nodes_info  = nest.GetStatus(GIDs, ["local", "vp"])
+    local       = np.array([ni[0] for ni in nodes_info], dtype=bool)
+    vps         = np.array([ni[1] for ni in nodes_info])[local]
+    local_GIDs  = list(np.array(GIDs)[local])
+
+    values = {}
+    for name, (mean, std) in distributions:
+        if isinstance(pyrngs, random_streams.counter_stream):
+            values[name] = pyrngs.normal(name, pop_index, np.flatnonzero(local), mean, std)
+            continue
+        values[name] = np.zeros(len(local_GIDs))
+        for vp in np.unique(vps):
+            vp_mask = vps == vp
+            values[name][vp_mask] = pyrngs[vp].normal(mean, std, np.sum(vp_mask))
+    for name, param_array in param_arrays.items():
+        values[name] = np.asarray(param_array, dtype=float)[local]
+
+    names = list(values.keys())
+    status_dicts = [dict(zip(names, neuron_values)) for neuron_values in 
+                    zip(*[values[name].tolist() for name in names])]
+    nest.SetStatus(local_GIDs, status_dicts)
+
+def create_nodes(model, pyrngs, neuron_params=None):
     """Creates the following GIDs:
         neuron_GIDs
-        ext_poisson
+        ext_poisson     (noise generators for model.background == "noise")
         ext_dc
         th_parrots
         th_poisson
@@ -177,7 +226,10 @@ def create_nodes(model, pyrngs):
         multimeters
         th_spike_detector
     
-        Further initializes the neurons" membrane potentials.
+        Further initializes the neurons" membrane potentials 
+        (and heterogeneous parameters, see initialize_neurons).
+        neuron_params: optional list with one dictionary {name: array} per population
+        of per-neuron parameter values.
     """
     neuron_GIDs     = []
     spike_detectors = []
@@ -187,14 +239,12 @@ def create_nodes(model, pyrngs):
     for pop_index, population in enumerate(model.populations):
         # Neurons
         neuron_GIDs.append(nest.Create(model.neuron_model, model.n_neurons[pop_index], params=model.model_params))
-        # Initialize membrane potentials locally
-        # drawn from normal distribution with mu=Vm0_mean, sigma=Vm0_std
-        neurons_info    = nest.GetStatus(neuron_GIDs[pop_index])
-        if not model.model_params.has_key("V_m"):
-            for ni in neurons_info:                 
-                if ni["local"]:                         # only adapt local nodes
-                    Vm_init = pyrngs[ni["vp"]].normal(model.Vm0_mean, model.Vm0_std)
-                    nest.SetStatus([ni["global_id"]], {"V_m": Vm_init})
+        # Initialize membrane potentials (and heterogeneous parameters) locally
+        if neuron_params is None:
+            initialize_neurons(model, neuron_GIDs[pop_index], pyrngs, pop_index=pop_index)
+        else:
+            initialize_neurons(model, neuron_GIDs[pop_index], pyrngs, neuron_params[pop_index], 
+                               pop_index=pop_index)
 
         # Devices
         if sim.record_cortical_spikes:
@@ -213,13 +263,21 @@ def create_nodes(model, pyrngs):
             multimeters.append(nest.Create("multimeter", 1, params=multimeter_dict))
         
         # External input
-        # One poisson generator per population. 
-        #Rate is determined by base rate times in-degree[population]
-        ext_poisson_params = {"rate": model.rate_ext * model.C_aext[pop_index]}
-        ext_poisson.append(nest.Create("poisson_generator", 1, params=ext_poisson_params))
+        if model.background == "poisson":
+            # One poisson generator per population. 
+            #Rate is determined by base rate times in-degree[population]
+            ext_poisson_params = {"rate": model.rate_ext * model.C_aext[pop_index]}
+            ext_poisson.append(nest.Create("poisson_generator", 1, params=ext_poisson_params))
+        else:
+            # One noise generator per population (independent noise for each target)
+            ext_noise_params = {"mean": model.noise_mean[pop_index], 
+                                "std": model.noise_std[pop_index], 
+                                "dt": model.dt_noise}
+            ext_poisson.append(nest.Create("noise_generator", 1, params=ext_noise_params))
         # One dc generator per population. 
         # Amplitude is determined by base amplitude times in-degree[population]
-        ext_dc_params = {"amplitude": model.dc_amplitude * model.C_aext[pop_index]}
+        # (and the compensation of downscaling, model.dc_ext)
+        ext_dc_params = {"amplitude": model.dc_ext[pop_index]}
         ext_dc.append(nest.Create("dc_generator", 1, params=ext_dc_params))
         
     # Thalamic neurons: parrot neurons and Poisson bg
@@ -245,14 +303,22 @@ def create_nodes(model, pyrngs):
 
 def connect(model, all_GIDs, 
             n_neurons_rec_spike, n_neurons_rec_voltage,
-            verbose):
+            verbose, connections=None):
     """Connect input GIDs according to connection_rule and dictionaries
     given in network_params.py
+
+    connections: optional connectome drawn with NumPy (see connectome.py). 
+    If given, the synapses between neurons (and from thalamus) are bulk-loaded
+    from its arrays instead of being drawn by NEST.
     """
     (neuron_GIDs, 
      spike_detectors, multimeters,
      ext_poisson, ext_dc, 
      th_parrots, th_poisson, th_spike_detector) = all_GIDs
+
+    if not connections is None:
+        if verbose: print("Connecting neurons from connectome")
+        connectome.connect_connectome(model, connections, neuron_GIDs, th_parrots, verbose)
     
     # Connect target populations...
     for target_index, target_pop in enumerate(model.populations):
@@ -260,73 +326,74 @@ def connect(model, all_GIDs,
         if verbose: print("with source")
         target_GIDs = neuron_GIDs[target_index]    # transform indices to GIDs of target population
     
-        # ...to source populations
-        for source_index, source_pop in enumerate(model.populations):
-            source_GIDs = neuron_GIDs[source_index] # transform indices to GIDs of source population
-            n_synapses  = model.C_ab[target_index, source_index]  # connection probability
-            if n_synapses < 1:  # in order to not have zero connections!
-                n_target_neurons = n_synapses * len(target_GIDs)
-                target_GIDs_temp = tuple(np.random.choice(target_GIDs, n_target_neurons, replace=False))
-                n_synapses = 1
-            else:
-                n_synapses = int(n_synapses)
-                target_GIDs_temp = target_GIDs
+        if connections is None:
+            # ...to source populations
+            for source_index, source_pop in enumerate(model.populations):
+                source_GIDs = neuron_GIDs[source_index] # transform indices to GIDs of source population
+                n_synapses  = model.C_ab[target_index, source_index]  # connection probability
+                if n_synapses < 1:  # in order to not have zero connections!
+                    n_target_neurons = n_synapses * len(target_GIDs)
+                    target_GIDs_temp = tuple(np.random.choice(target_GIDs, n_target_neurons, replace=False))
+                    n_synapses = 1
+                else:
+                    n_synapses = int(n_synapses)
+                    target_GIDs_temp = target_GIDs
 
-            if not n_synapses == 0:
-                if verbose: print("\t" + source_pop)
+                if not n_synapses == 0:
+                    if verbose: print("\t" + source_pop)
     
-                conn_dict       = model.conn_dict.copy()
-                if model.connection_rule == "fixed_total_number":
-                    conn_dict["N"]  = n_synapses
-                elif model.connection_rule == "fixed_indegree":
-                    conn_dict["indegree"]  = n_synapses
+                    conn_dict       = model.conn_dict.copy()
+                    if model.connection_rule == "fixed_total_number":
+                        conn_dict["N"]  = n_synapses
+                    elif model.connection_rule == "fixed_indegree":
+                        conn_dict["indegree"]  = n_synapses
     
-                mean_weight             = model.weights[target_index, source_index]
-                std_weight              = abs(mean_weight * model.weight_rel_sd)
-                if mean_weight >= 0:
-                    weight_dict = model.weight_dict_exc.copy()
-                else:
-                    weight_dict = model.weight_dict_inh.copy()
-                weight_dict["mu"]       = mean_weight
-                weight_dict["sigma"]    = std_weight
+                    mean_weight             = model.weights[target_index, source_index]
+                    std_weight              = abs(mean_weight * model.weight_rel_sd)
+                    if mean_weight >= 0:
+                        weight_dict = model.weight_dict_exc.copy()
+                    else:
+                        weight_dict = model.weight_dict_inh.copy()
+                    weight_dict["mu"]       = mean_weight
+                    weight_dict["sigma"]    = std_weight
     
-                mean_delay              = model.delays[target_index, source_index]
-                std_delay               = mean_delay * model.delay_rel_sd 
-                delay_dict              = model.delay_dict.copy()
-                delay_dict["mu"]        = mean_delay
-                delay_dict["sigma"]     = std_delay
+                    mean_delay              = model.delays[target_index, source_index]
+                    std_delay               = mean_delay * model.delay_rel_sd 
+                    delay_dict              = model.delay_dict.copy()
+                    delay_dict["mu"]        = mean_delay
+                    delay_dict["sigma"]     = std_delay
     
-                syn_dict                = model.syn_dict.copy()
-                syn_dict["weight"]      = weight_dict
-                syn_dict["delay"]       = delay_dict
+                    syn_dict                = model.syn_dict.copy()
+                    syn_dict["weight"]      = weight_dict
+                    syn_dict["delay"]       = delay_dict
     
-                nest.Connect(source_GIDs, target_GIDs_temp, conn_dict, syn_dict)
+                    nest.Connect(source_GIDs, target_GIDs_temp, conn_dict, syn_dict)
         
-        # ...to thalamic population
-        if not model.n_th == 0:
-            n_synapses_th   = model.C_th_scaled[target_index]
-            if not n_synapses_th == 0:
-                if verbose: print("\tthalamus")
-                conn_dict_th        = model.conn_dict.copy()
-                conn_dict_th["N"]   = n_synapses_th
+            # ...to thalamic population
+            if not model.n_th == 0:
+                n_synapses_th   = model.C_th_scaled[target_index]
+                if not n_synapses_th == 0:
+                    if verbose: print("\tthalamus")
+                    conn_dict_th        = model.conn_dict.copy()
+                    conn_dict_th["N"]   = n_synapses_th
                 
-                mean_weight_th      = model.weight_th
-                std_weight_th       = mean_weight_th * model.weight_rel_sd
-                weight_dict_th      = model.weight_dict_exc.copy()
-                weight_dict_th["mu"]    = mean_weight_th
-                weight_dict_th["sigma"] = std_weight_th
+                    mean_weight_th      = model.weight_th
+                    std_weight_th       = mean_weight_th * model.weight_rel_sd
+                    weight_dict_th      = model.weight_dict_exc.copy()
+                    weight_dict_th["mu"]    = mean_weight_th
+                    weight_dict_th["sigma"] = std_weight_th
     
-                mean_delay_th       = model.delay_th
-                std_delay_th        = mean_delay_th * model.delay_th_rel_sd 
-                delay_dict_th       = model.delay_dict.copy()
-                delay_dict_th["mu"]     = mean_delay_th
-                delay_dict_th["sigma"]  = std_delay_th
+                    mean_delay_th       = model.delay_th
+                    std_delay_th        = mean_delay_th * model.delay_th_rel_sd 
+                    delay_dict_th       = model.delay_dict.copy()
+                    delay_dict_th["mu"]     = mean_delay_th
+                    delay_dict_th["sigma"]  = std_delay_th
     
-                syn_dict_th             = model.syn_dict.copy()
-                syn_dict_th["weight"]   = weight_dict_th
-                syn_dict_th["delay"]    = delay_dict_th
+                    syn_dict_th             = model.syn_dict.copy()
+                    syn_dict_th["weight"]   = weight_dict_th
+                    syn_dict_th["delay"]    = delay_dict_th
     
-                nest.Connect(th_parrots, target_GIDs, conn_dict_th, syn_dict_th)
+                    nest.Connect(th_parrots, target_GIDs, conn_dict_th, syn_dict_th)
     
         # ...to spike detector
         if sim.record_cortical_spikes:
@@ -344,11 +411,18 @@ def connect(model, all_GIDs,
      
         # ...to background
         if not model.rate_ext == 0:
-            if verbose: print("\tpoisson background")
-            nest.Connect(ext_poisson[target_index], target_GIDs, 
-                conn_spec={"rule": "all_to_all"}, 
-                syn_spec={"weight": model.weight_ext, "delay": model.delay_ext}) 
-        if not model.dc_amplitude == 0:
+            if model.background == "poisson":
+                if verbose: print("\tpoisson background")
+                nest.Connect(ext_poisson[target_index], target_GIDs, 
+                    conn_spec={"rule": "all_to_all"}, 
+                    syn_spec={"weight": model.weight_ext, "delay": model.delay_ext}) 
+            else:
+                if verbose: print("\tnoise background")
+                nest.Connect(ext_poisson[target_index], target_GIDs, 
+                    conn_spec={"rule": "all_to_all"}, 
+                    syn_spec={"weight": 1., "delay": model.delay_ext, 
+                              "receptor_type": model.noise_receptor}) 
+        if np.any(model.dc_ext != 0):
             if verbose: print("\tDC background" )
             nest.Connect(ext_dc[target_index], target_GIDs, "all_to_all")
     
@@ -360,65 +434,311 @@ def connect(model, all_GIDs,
             if verbose: print("Connect thalamus to th_spike_detector")
             nest.Connect(th_parrots, th_spike_detector, "all_to_all")
 
-def save_data(grp, all_GIDs, populations, n_neurons_rec_spike, n_neurons_rec_voltage):
+def create_spikes_group(grp, n_neurons_rec_spike):
+    """Create group 'spikes' of grp with attributes explaining the data layout."""
+    spikes_grp = grp.create_group("spikes")
+    spikes_grp.attrs["dt"]  = sim.dt 
+    spikes_grp.attrs["info"]  = "times_{ith neuron} = times[rec_neuron_i[i]:rec_neuron_i[i+1]]"
+    spikes_grp.attrs["info2"]  = "times in units of dt; dt in ms  =>  times/ms = times * dt"
+    spikes_grp.attrs["n_neurons_rec_spike"] = n_neurons_rec_spike
+    return spikes_grp
+
+# Neuron state saved in checkpoints, per neuron model
+# (the synaptic currents of iaf_psc_alpha are not accessible via GetStatus)
+checkpoint_keys = {"iaf_psc_delta": ["V_m"],
+                   "iaf_psc_exp":   ["V_m", "I_syn_ex", "I_syn_in"],
+                   "iaf_psc_alpha": ["V_m"]}
+
+def stream_file_path(grp):
+    """Path of the temporary file streaming spikes (and checkpoints) of grp."""
+    return grp.file.filename + "_" + grp.name.strip("/").replace("/", "_") + ".spikes.tmp"
+
+def save_checkpoint(stream_file, model, all_GIDs, t_elapsed, master_seed):
+    """Save the state of all local neurons and the seed bookkeeping to stream_file."""
+    keys    = checkpoint_keys[model.neuron_model]
+    states  = []
+    for GIDs in all_GIDs[0]:
+        local_GIDs  = [GID for GID, local in zip(GIDs, nest.GetStatus(GIDs, "local")) if local]
+        values      = np.array(nest.GetStatus(local_GIDs, keys), dtype=float)
+        states.append((np.array(local_GIDs), values))
+    seeds = {"master_seed": master_seed, "n_vp": sim.n_vp, 
+             "last_seed": random_streams.last_seed(master_seed, sim.n_vp, model.n_populations)}
+    spike_functions.write_checkpoint(stream_file, model.populations, keys, states, t_elapsed, seeds)
+
+def restore_checkpoint(stream_file, model, all_GIDs):
+    """Set the neuron state saved by save_checkpoint and shift the thalamic 
+    input to the new time origin. Returns the elapsed simulated time (ms).
+
+    The network has to be built with the same master_seed and n_vp.
+    Membrane potentials are not checkpointed, thus not combined with sim.record_voltage.
+    """
+    if sim.record_voltage:
+        raise Exception("Membrane potentials are not part of checkpoints; set record_voltage = False.")
+    checkpoint = spike_functions.read_checkpoint(stream_file, model.populations)
+    if not checkpoint["seeds"]["n_vp"] == sim.n_vp:
+        raise Exception("Checkpoint was written with n_vp = %i, not %i!"%(
+                        checkpoint["seeds"]["n_vp"], sim.n_vp))
+    keys = checkpoint["keys"]
+    for GIDs, values in checkpoint["states"]:
+        nest.SetStatus(GIDs.tolist(), [dict(zip(keys, neuron_values)) for neuron_values in values.tolist()])
+    t_elapsed   = checkpoint["t_elapsed"]
+    th_poisson  = all_GIDs[6]
+    if not th_poisson is None:
+        nest.SetStatus(th_poisson, {"start": max(0., model.th_start - t_elapsed), 
+                                    "stop": max(0., model.th_start + model.th_duration - t_elapsed)})
+    return t_elapsed
+
+def simulate_chunked(grp, model, all_GIDs, n_neurons_rec_spike, 
+                     master_seed=None, resume=False, 
+                     t_sim=None, t_chunk=None, t_checkpoint=None, verbose=True,
+                     res_grp=None):
+    """Simulate in slices of t_chunk (ms) and stream the spikes of each slice to disk. 
+
+    After each slice, the events of the spike detectors are appended to extendable 
+    datasets of a temporary HDF5 file and the detectors are reset (n_events = 0). 
+    Thus, memory is bounded by the slice length instead of the full recording.
+    At the end, spikes are sorted per population and saved to grp["spikes"] 
+    (same layout as save_data; use save_data(..., save_spikes=False) for the voltages).
+
+    Every t_checkpoint (ms), a checkpoint (neuron state, elapsed time, seeds)
+    is written to the temporary file. With resume=True, the run continues from 
+    the last checkpoint: the network must have been rebuilt with the same 
+    master_seed; spikes recorded after the checkpoint are discarded. 
+    The external Poisson input is not reproduced exactly after resuming, 
+    spikes in transit at the checkpoint are lost.
+
+    With res_grp, the statistics of prep_data.py are accumulated after each slice
+    and written to res_grp (online_statistics.py); raw spikes are saved only if 
+    sim.save_raw_spikes. Statistics are not part of the checkpoints.
+
+    Defaults: t_sim = sim.t_sim, t_chunk = sim.t_chunk (t_sim if None), 
+    t_checkpoint = sim.t_checkpoint.
+    """
+    if t_sim is None:
+        t_sim = sim.t_sim
+    if t_chunk is None:
+        t_chunk = sim.t_chunk
+    if t_checkpoint is None:
+        t_checkpoint = sim.t_checkpoint
+    if resume and (t_chunk is None or t_checkpoint is None):
+        raise Exception("Resuming requires t_chunk and t_checkpoint!")
+    if t_chunk is None:
+        t_chunk = t_sim
+    populations     = model.populations
+    neuron_GIDs     = all_GIDs[0]
+    spike_detectors = all_GIDs[1]
+    rec_GIDs_all    = [neuron_GIDs[j][:n_neurons_rec_spike[j]] for j in range(len(populations))]
+    save_raw_spikes = res_grp is None or sim.save_raw_spikes
+    if not res_grp is None:
+        if resume:
+            raise Exception("Online statistics can't be resumed from a checkpoint.")
+        statistics  = online_statistics.spike_statistics(n_neurons_rec_spike, sim.t_trans, t_sim)
+    stream_path     = stream_file_path(grp)
+    if resume:
+        if not os.path.exists(stream_path):
+            raise Exception("No checkpoint to resume from: " + stream_path + " does not exist!")
+        stream_file = h5py.File(stream_path, "r+")
+        t_done      = restore_checkpoint(stream_file, model, all_GIDs)
+        if verbose: print("Resume at %.1f s"%(t_done * 1e-3))
+    else:
+        stream_file = spike_functions.create_stream_file(stream_path, populations)
+        t_done      = 0.
+    t_offset        = np.uint(np.rint(t_done / sim.dt)) # NEST starts at time 0 again after resuming
+    t_last_checkpoint = t_done
+
+    while t_done < t_sim:
+        t_slice = min(t_chunk, t_sim - t_done)
+        nest.Simulate(t_slice)
+        t_done += t_slice
+        if verbose: print("Simulated %.1f of %.1f s"%(t_done * 1e-3, t_sim * 1e-3))
+        if sim.record_cortical_spikes:
+            for j, population in enumerate(populations):
+                events  = nest.GetStatus(spike_detectors[j], "events")[0]
+                if save_raw_spikes:
+                    times   = spike_functions.to_steps(events["times"], sim.dt) + t_offset # in units of dt!
+                    spike_functions.append_spikes(stream_file[population], events["senders"], times)
+                if not res_grp is None:
+                    neuron_i, recorded = spike_functions.rec_neuron_index(events["senders"], rec_GIDs_all[j])
+                    statistics.add_spikes(j, neuron_i, events["times"][recorded])
+                nest.SetStatus(spike_detectors[j], {"n_events": 0})
+            stream_file.flush()
+        if not t_checkpoint is None and t_done - t_last_checkpoint >= t_checkpoint and t_done < t_sim:
+            save_checkpoint(stream_file, model, all_GIDs, t_done, master_seed)
+            t_last_checkpoint = t_done
+            if verbose: print("Checkpoint at %.1f s"%(t_done * 1e-3))
+
+    if not res_grp is None:
+        statistics.save(res_grp, populations, t_sim)
+    if sim.record_cortical_spikes and save_raw_spikes:
+        spikes_grp  = create_spikes_group(grp, n_neurons_rec_spike)
+        spike_functions.finalize_spikes(stream_file, spikes_grp, populations, 
+                                        rec_GIDs_all, n_neurons_rec_spike, sim.spike_format)
+        if sim.spike_time_index:
+            spike_functions.add_time_index(spikes_grp, sim.t_bucket)
+    else:
+        stream_file.close()
+        os.remove(stream_path)
+
+def simulate_adaptive(grp, model, all_GIDs, n_neurons_rec_spike, verbose=True, res_grp=None):
+    """Simulate in windows of sim.t_window until the rates are stationary and precise
+    (stationarity.py), at most sim.t_trans_max + sim.t_measure.
+
+    Spikes are streamed to disk as in simulate_chunked and saved to grp["spikes"]
+    (use save_data(..., save_spikes=False) for the voltages).
+    With res_grp, the statistics of the measurement are written to res_grp 
+    (online_statistics.py); raw spikes are saved only if sim.save_raw_spikes.
+    The actual t_trans, t_measure and t_sim (s, as the attributes of the data file)
+    and the online estimates (rates_online, rates_ci, cv_isi_online) are saved 
+    as attributes of grp. Returns the simulated time (ms).
+    """
+    if not sim.record_cortical_spikes:
+        raise Exception("Adaptive runs require record_cortical_spikes = True.")
+    populations     = model.populations
+    neuron_GIDs     = all_GIDs[0]
+    spike_detectors = all_GIDs[1]
+    rec_GIDs_all    = [neuron_GIDs[j][:n_neurons_rec_spike[j]] for j in range(len(populations))]
+    save_raw_spikes = res_grp is None or sim.save_raw_spikes
+    monitor = stationarity.stationarity_monitor(n_neurons_rec_spike, sim.t_window, 
+                                                sim.n_windows_stable, sim.drift_z, sim.t_trans_max,
+                                                sim.t_batch, sim.rel_precision, 
+                                                sim.t_measure_min, sim.t_measure)
+    if save_raw_spikes:
+        stream_file = spike_functions.create_stream_file(stream_file_path(grp), populations)
+    t_done      = 0.
+    done        = False
+    while not done:
+        nest.Simulate(sim.t_window)
+        t_done += sim.t_window
+        for j, population in enumerate(populations):
+            events  = nest.GetStatus(spike_detectors[j], "events")[0]
+            if save_raw_spikes:
+                spike_functions.append_spikes(stream_file[population], events["senders"], 
+                                              spike_functions.to_steps(events["times"], sim.dt))
+            nest.SetStatus(spike_detectors[j], {"n_events": 0})
+            neuron_i, recorded = spike_functions.rec_neuron_index(events["senders"], rec_GIDs_all[j])
+            monitor.add_spikes(j, neuron_i, events["times"][recorded])
+        was_transient = monitor.in_transient
+        done = monitor.end_window(t_done)
+        if verbose and was_transient and not monitor.in_transient:
+            print("Transient ends at %.2f s"%(t_done * 1e-3))
+    if verbose: print("Measured %.1f s, converged: %s"%(monitor.t_measure * 1e-3, monitor.converged))
+
+    if not res_grp is None:
+        monitor.statistics.save(res_grp, populations, t_done)
+    if save_raw_spikes:
+        spikes_grp  = create_spikes_group(grp, n_neurons_rec_spike)
+        spike_functions.finalize_spikes(stream_file, spikes_grp, populations, 
+                                        rec_GIDs_all, n_neurons_rec_spike, sim.spike_format)
+        if sim.spike_time_index:
+            spike_functions.add_time_index(spikes_grp, sim.t_bucket)
+    grp.attrs["t_trans"]        = monitor.t_trans * 1e-3
+    grp.attrs["t_measure"]      = monitor.t_measure * 1e-3
+    grp.attrs["t_sim"]          = t_done * 1e-3
+    grp.attrs["converged"]      = monitor.converged
+    grp.attrs["rates_online"]   = monitor.rates()
+    grp.attrs["rates_ci"]       = monitor.rates_ci()
+    grp.attrs["cv_isi_online"]  = monitor.cv_isi()
+    return t_done
+
+def run_simulation(grp, model, all_GIDs, n_neurons_rec_spike, 
+                   master_seed=None, resume=False, res_grp=None):
+    """Simulate sim.t_sim at once, in slices (simulate_chunked: sim.t_chunk, 
+    online statistics) or adaptively (simulate_adaptive: sim.adaptive). 
+
+    res_grp: group of the result file for the online statistics (sim.online_statistics).
+    Returns the simulated time (ms) and whether the spikes are handled already 
+    (then save_data(..., save_spikes=False)).
+    """
+    if distributed.n_procs() > 1 and (sim.adaptive or not sim.t_chunk is None or not res_grp is None):
+        raise Exception("Several MPI processes only support t_chunk = None, adaptive = False " + 
+                        "and online_statistics = False!")
+    if sim.adaptive:
+        t_simulated = simulate_adaptive(grp, model, all_GIDs, n_neurons_rec_spike, res_grp=res_grp)
+        return t_simulated, True
+    elif sim.t_chunk is None and res_grp is None:
+        nest.Simulate(sim.t_sim)
+        return sim.t_sim, False
+    else:
+        simulate_chunked(grp, model, all_GIDs, n_neurons_rec_spike, 
+                         master_seed, resume=resume, res_grp=res_grp)
+        return sim.t_sim, True
+
+def save_data(grp, all_GIDs, populations, n_neurons_rec_spike, n_neurons_rec_voltage, 
+              save_spikes=True, t_origin=0., t_simulated=None):
     """Save spike data and membrane potentials (if specified so in sim_params.py).
     Thalamic spikes not yet included.
+    save_spikes: False if spikes have already been saved by simulate_chunked.
+    t_simulated: simulated time (ms) as returned by run_simulation (default: sim.t_sim),
+    end of the recorded membrane potentials (adaptive runs stop before sim.t_sim).
+    t_origin: time (ms) at which the run started (warm_network.py), saved times are relative to it.
+    With several MPI processes, each rank saves the events of its local neurons
+    to its own file, joined by virtual datasets (distributed.py).
     """
-    if sim.record_cortical_spikes:
+    distributed_output = distributed.n_procs() > 1
+    if distributed_output:
+        local_grp   = distributed.local_group(grp)
+    else:
+        local_grp   = grp
+
+    if sim.record_cortical_spikes and save_spikes:
         spike_detectors = all_GIDs[1]
-        spikes_grp = grp.create_group("spikes")
-        spikes_grp.attrs["dt"]  = sim.dt 
-        spikes_grp.attrs["info"]  = "times_{ith neuron} = times[rec_neuron_i[i]:rec_neuron_i[i+1]]"
-        spikes_grp.attrs["info2"]  = "times in units of dt; dt in ms  =>  times/ms = times * dt"
-        spikes_grp.attrs["n_neurons_rec_spike"] = n_neurons_rec_spike
+        spikes_grp = create_spikes_group(local_grp, n_neurons_rec_spike)
 
+        neuron_GIDs     = all_GIDs[0]
         for j, population in enumerate(populations):
-            senders = nest.GetStatus(spike_detectors[j])[0]["events"]["senders"]
-            times   = nest.GetStatus(spike_detectors[j])[0]["events"]["times"]
-            times   = np.uint(times / sim.dt) # in units of dt!
-
-            # Create array of indices for data: 
-            # times["ith neuron that fired"] = times[rec_neuron_i[i]:rec_neuron_i[i+1]]
-            n_spikes_per_neuron = np.zeros(n_neurons_rec_spike[j])
-            rec_neuron_i        = np.zeros(n_neurons_rec_spike[j] + 1)
-            # Now the indices:
-            n_spikes_fired = np.unique(senders, return_counts=True)[1] # n spikes, sorted by sender GID
-            max_index       = len(n_spikes_fired)               # number of neurons that fired >= 1 spike
-            n_spikes_per_neuron[:max_index] = n_spikes_fired    # the rest remains zero
-            rec_neuron_i[1 : ] = np.cumsum(n_spikes_per_neuron) # lower and upper bounds, 0th remains 0.
-
-            # Sort times
-            sorted_times = times[np.argsort(senders)] 
-            for i in range(len(rec_neuron_i) - 1):
-                i0, i1 = (rec_neuron_i[i], rec_neuron_i[i+1])
-                sorted_times[i0:i1] = np.sort(sorted_times[i0:i1])
+            events  = nest.GetStatus(spike_detectors[j], "events")[0]
+            times   = spike_functions.to_steps(events["times"] - t_origin, sim.dt) # in units of dt!
+
+            # Sort times by recorded neuron and time: 
+            # times["ith neuron"] = times[rec_neuron_i[i]:rec_neuron_i[i+1]]
+            rec_GIDs = neuron_GIDs[j][:n_neurons_rec_spike[j]]
+            sorted_times, rec_neuron_i = spike_functions.sort_spikes(events["senders"], times, 
+                                                                     rec_GIDs, n_neurons_rec_spike[j])
 
             # Save data to HDF5 file:
-            spikes_subgrp   = spikes_grp.create_group(population)
-            if len(sorted_times) > 0:
-                dset_times      = spikes_subgrp.create_dataset("times", data=sorted_times)
-            else:
-                dset_times      = spikes_subgrp.create_dataset("times", data=np.array([0]))
-            dset_indices    = spikes_subgrp.create_dataset("rec_neuron_i", data=rec_neuron_i)
+            spike_functions.write_spikes(spikes_grp.create_group(population), sorted_times, rec_neuron_i,
+                                         sim.spike_format)
+
+        if distributed_output:
+            joined_spikes_grp = None
+            if distributed.rank() == 0:
+                joined_spikes_grp = create_spikes_group(grp, n_neurons_rec_spike)
+            distributed.join_spikes(joined_spikes_grp, spikes_grp, populations)
+            if distributed.rank() == 0 and sim.spike_time_index:
+                spike_functions.add_time_index(joined_spikes_grp, sim.t_bucket)
+        elif sim.spike_time_index:
+            spike_functions.add_time_index(spikes_grp, sim.t_bucket)
             
     if sim.record_voltage:
         multimeters = all_GIDs[2]
-        voltage_grp = grp.create_group("voltage")
+        voltage_grp = local_grp.create_group("voltage")
 
         # Times can be reconstructed with times = np.arange(start, stop, dt_volt)
         start       = nest.GetStatus(multimeters[0])[0]["start"]   # ms
         stop        = nest.GetStatus(multimeters[0])[0]["stop"]   # ms
-        if stop == float("inf"):
-            stop = sim.t_sim
+        if t_simulated is None:
+            t_simulated = sim.t_sim
+        stop        = min(stop, t_simulated)
         dt_volt     = nest.GetStatus(multimeters[0])[0]["interval"]   # ms
-        voltage_grp.attrs["dt_volt"]     = dt_volt 
-        voltage_grp.attrs["t_min"]  = start 
-        voltage_grp.attrs["t_max"]  = stop 
-        voltage_grp.attrs["n_neurons_rec_voltage"] = n_neurons_rec_voltage
+        voltage_attrs = {"dt_volt": dt_volt, "t_min": start, "t_max": stop, 
+                         "n_neurons_rec_voltage": n_neurons_rec_voltage}
+        for key, value in voltage_attrs.items():
+            voltage_grp.attrs[key] = value
 
         for j, population in enumerate(populations):
             volts       = nest.GetStatus(multimeters[j])[0]["events"]["V_m"]
             senders     = nest.GetStatus(multimeters[j])[0]["events"]["senders"]
+            if distributed_output:
+                # Rows of the local recorded neurons only, in order of neuron and time
+                times       = nest.GetStatus(multimeters[j])[0]["events"]["times"]
+                rec_GIDs    = all_GIDs[0][j][:n_neurons_rec_voltage[j]]
+                neuron_i    = spike_functions.rec_neuron_index(senders, rec_GIDs)[0]
+                local_neuron_i = np.unique(neuron_i)
+                order       = np.lexsort((times, neuron_i))
+                sorted_volts = volts[order].reshape(len(local_neuron_i), -1)
+                voltage_grp.create_dataset(population, data=sorted_volts)
+                voltage_grp.create_dataset(population + "_neuron_i", data=local_neuron_i)
+                continue
             n_events    = nest.GetStatus(multimeters[j])[0]["n_events"]   # number of events
             n_rec       = n_neurons_rec_voltage[j]
             n_times     = n_events / n_rec
@@ -430,3 +750,14 @@ def save_data(grp, all_GIDs, populations, n_neurons_rec_spike, n_neurons_rec_vol
             # save data to HDF5 file:
             dset_volts      = voltage_grp.create_dataset(population, data=sorted_volts)
 
+        if distributed_output:
+            joined_voltage_grp = None
+            if distributed.rank() == 0:
+                joined_voltage_grp = grp.create_group("voltage")
+                for key, value in voltage_attrs.items():
+                    joined_voltage_grp.attrs[key] = value
+            distributed.join_voltage(joined_voltage_grp, voltage_grp, populations, n_neurons_rec_voltage)
+
+    if distributed_output and distributed.rank() == 0:
+        local_grp.file.close()
+
@@ -2,6 +2,11 @@
 
 Retrieve the numbers of synapses (-> distributions) obtain in the 
 microcircuit level. This has validation purpose only. 
+
+The connectome is exported in chunks to data_dir/micro/connectome_export.hdf5,
+together with in-/out-degree histograms and weight/delay distributions
+(connectome_export.py). synapse_numbers.hdf5 contains the in-degree histograms 
+in the format used before.
 """
 from __future__ import print_function
 import nest
@@ -14,15 +19,16 @@ from imp import reload
 import sim_params as sim; reload(sim)
 import functions; reload(functions)
 import model_class; reload(model_class)
+import connectome_export; reload(connectome_export)
 verbose     = True                     # whether to print every connection made
 #######################################################
 # Instantiate model
 #######################################################
 # Unchanged parameters
 connection_rule = "fixed_total_number" # "fixed_indegree", "fixed_total_number"
-PSC_rel_sd      = 0.1 # 0.1 for  Potjans' model
+weight_rel_sd   = 0.1 # 0.1 for  Potjans' model
 model           = model_class.model(connection_rule=connection_rule,
-                                    PSC_rel_sd=PSC_rel_sd) 
+                                    weight_rel_sd=weight_rel_sd) 
 master_seed = 0
 
 ######################################################
@@ -53,9 +59,9 @@ T_connect   = time.time() - t_connect_0
 print("T_connect    = ", T_connect)
 
 ###################################################
-# Get connection numbers
+# Export connectome and get connection numbers
 ###################################################
-print("Count synapse numbers")
+print("Export connectome")
 t_count_0 = time.time()
 
 data_sup_path = sim.data_dir
@@ -63,7 +69,9 @@ sub_path = "micro"
 data_path = os.path.join(data_sup_path, sub_path)
 file_name   = "synapse_numbers.hdf5"
 
-neuron_GIDs = all_GIDs[0]
+statistics  = connectome_export.export_connectome(os.path.join(data_path, "connectome_export.hdf5"),
+                                                  model, all_GIDs, verbose=verbose)
+
 # Histogram template
 bin_size        = 10
 hist_max        = 3000
@@ -75,19 +83,11 @@ with h5py.File(os.path.join(data_path, file_name), "w") as data_file:
     data_file.attrs["bin_size"]  = bin_size
     data_file.attrs["hist_max"]  = hist_max
     for target_index, target_pop in enumerate(model.populations):
-        if verbose: print("to target " + target_pop)
-        if verbose: print("from source")
-        target_GIDs = neuron_GIDs[target_index]
         target_group = data_file.create_group(target_pop)
-        n_neurons = len(target_GIDs)
-
         for source_index, source_pop in enumerate(model.populations):
-            source_GIDs = neuron_GIDs[source_index] 
-            if verbose: print("\t" + source_pop)
-            
-            # Get connections for entire populations
-            conns   = nest.GetConnections(source=source_GIDs, target=target_GIDs)
-            n_conns = np.unique(nest.GetStatus(conns, "target"), return_counts=True)[1]
+            # In-degrees of the target neurons (with at least one synapse)
+            n_conns = statistics.in_degrees[target_index][source_index]
+            n_conns = n_conns[n_conns > 0]
 
             # Calculate histograms
             n_conns_hist = np.histogram(n_conns, bins=n_bins_hist, 
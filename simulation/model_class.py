@@ -8,6 +8,7 @@
 from imp import reload
 import numpy as np
 import network_params as net; reload(net)
+import sim_params as sim; reload(sim)
 
 class model:
     def __init__(self, 
@@ -20,7 +21,11 @@ class model:
                  weight_rel_sd   = net.weight_rel_sd, 
                  delay_rel_sd    = net.delay_rel_sd,  
                  g               = net.g, 
-                 rate_ext        = net.rate_ext):                
+                 rate_ext        = net.rate_ext,
+                 background      = net.background,      # "poisson" or "noise"
+                 scaling         = net.scaling,         # "linear" or "compensated"
+                 k_indegree      = net.k_indegree,      # in-degrees relative to full scale ("compensated")
+                 rates_full      = net.rates_full):     # full-scale rates for "compensated"
 
         """Class of network parameters.
 
@@ -30,9 +35,21 @@ class model:
         - stimulus parameters
         
         Specify area, neuron_model, neuron_numbers, C_ab, 
-            j02, connection_rule, weight_rel_sd, g, rate_ext_factor.
+            j02, connection_rule, weight_rel_sd, g, rate_ext_factor, background, scaling.
         Default values correspond to Potjans' model.
 
+        background = "noise" replaces the external Poisson input by Gaussian 
+        white noise currents with the same mean and variance of the membrane 
+        potential (mu_ext, var_ext), see noise_mean and noise_std. For iaf_psc_exp,
+        the noise is filtered with tau_syn_ex (noise_receptor) as the Poisson input.
+
+        scaling sets the in-degrees of downscaled networks (area < 1):
+        "linear" uses C_ab as set by net.scale_C_linearly, "compensated" the full-scale 
+        in-degrees K_full times k_indegree (default: area), with weights scaled by 
+        1 / sqrt(k_scaling) and the DC input dc_ext, such that mu and sd at rates_full 
+        (Hz; default: mean field rates of the full-scale model) are those of the 
+        full-scale model. "compensated" requires C_ab = "micro".
+
         Neuron numbers and synapse numbers (C_ab) can be specified separately.
         Both except either a string in {'micro', 'brunel'} or an array of 
         the corresponding shape.
@@ -92,10 +109,10 @@ class model:
         # Synapse numbers
         # Connection probabilities: conn_probs[post, pre] = conn_probs[target, source]
         conn_probs = net.conn_probs
+        n_outer_full    = np.outer(net.full_scale_n_neurons, net.full_scale_n_neurons)
+        C_full_scale    = np.log(1. - conn_probs) / np.log(1. - 1. / n_outer_full)
         # Scale synapse numbers of the C_ab
         if net.scale_C_linearly:
-            n_outer_full    = np.outer(net.full_scale_n_neurons, net.full_scale_n_neurons)
-            C_full_scale    = np.log(1. - conn_probs) / np.log(1. - 1. / n_outer_full)
             C_scaled        = np.int_(C_full_scale * self.area)
         else:
             n_outer         = np.outer(self.n_neurons, self.n_neurons)
@@ -127,6 +144,31 @@ class model:
                 raise Exception("'C_ab' expects either numpy.ndarray or string "+
                                 "in {'micro', 'brunel'}")
 
+        # Downscaling: in-degrees K_ab relative to the full-scale in-degrees K_full
+        self.scaling    = scaling
+        if not self.scaling in ("linear", "compensated"):
+            raise Exception("Scaling should be 'linear' or 'compensated'!")
+        self.K_full     = (C_full_scale.T / net.full_scale_n_neurons).T
+        if self.scaling == "compensated":
+            if not (type(C_ab) == str and C_ab == "micro"):
+                raise Exception("Scaling 'compensated' requires C_ab = 'micro'!")
+            if k_indegree is None:
+                k_indegree  = self.area
+            self.k_indegree = k_indegree
+            if self.connection_rule == "fixed_total_number":
+                self.C_ab   = np.int_((self.K_full.T * self.n_neurons).T * k_indegree)
+            else:
+                self.C_ab   = self.K_full * k_indegree
+        if self.connection_rule == "fixed_total_number":
+            self.K_ab   = (self.C_ab.T / np.maximum(self.n_neurons, 1).astype(float)).T
+        else:
+            self.K_ab   = self.C_ab * 1.
+        self.k_scaling  = np.ones((self.n_populations, self.n_populations))
+        if self.scaling == "compensated":
+            self.k_scaling[self.K_full > 0] = self.K_ab[self.K_full > 0] / self.K_full[self.K_full > 0]
+            if np.any(self.k_scaling <= 0):
+                raise Exception("Scaling 'compensated' requires in-degrees > 0, increase k_indegree!")
+
 
         ###################################################
         ###          Single-neuron parameters		###        
@@ -134,6 +176,7 @@ class model:
         self.neuron_model   = neuron_model
         self.Vm0_mean       = net.Vm0_mean            # mean of initial membrane potential (mV)
         self.Vm0_std        = net.Vm0_std            # std of initial membrane potential (mV)
+        self.neuron_params_dist = net.neuron_params_dist  # {name: (mean, std)} of heterogeneous parameters
         self.model_params   = net.model_params
         if not self.neuron_model=="iaf_psc_delta":
             self.model_params["tau_syn_ex"] = net.tau_syn_ex # excitatory synaptic time constant (ms)
@@ -162,7 +205,7 @@ class model:
         g_all[L23e_index, L4e_index] *= self.j02
         
         self.J              = net.PSP_e           # mv; mean PSP, used as reference PSP
-        self.J_ab           = self.J * g_all
+        self.J_ab           = self.J * g_all / np.sqrt(self.k_scaling)
         self.weight_rel_sd  = weight_rel_sd # Standard deviation of weight relative to mean weight
         # Transformation from peak PSP to PSC
         delta_tau       = self.tau_syn - self.tau_m
@@ -212,6 +255,10 @@ class model:
         self.delay_ext  = self.delay_e  # ms;  mean delay of external input
         self.dc_amplitude = net.dc_amplitude  # constant bg amplitude
         self.C_aext     = net.C_aext        # in-degrees for background input
+        if not background in ("poisson", "noise"):
+            raise Exception("Background should be 'poisson' or 'noise'!")
+        self.background = background
+        self.dt_noise   = net.dt_noise      # ms
         # Adapt weights
         if self.neuron_model=="iaf_psc_exp": # PSCs calculated from PSP amplitudes
             self.weight_ext = self.J_ext * PSC_over_PSP[0, 0] 
@@ -273,22 +320,67 @@ class model:
             self.J_sd       = self.weights    * self.tau_syn**(3./2.)    / (self.C_m * 2.)
             self.J_mu_ext   = self.weight_ext * self.tau_syn_ex**2       / self.C_m
             self.J_sd_ext   = self.weight_ext * self.tau_syn_ex**(3./2.) / (self.C_m * 2.)
+        # DC input (pA) of each population, compensating the mean input lost by
+        # downscaling ("compensated"): tau_m sum_b J_mu_ab K_full_ab (1 - sqrt(k_ab)) rates_full_b
+        self.dc_ext     = self.dc_amplitude * self.C_aext
+        if self.scaling == "compensated":
+            if rates_full is None:
+                model_full  = model(neuron_model=neuron_model, connection_rule="fixed_indegree",
+                                    area=1., j02=j02, weight_rel_sd=weight_rel_sd, 
+                                    delay_rel_sd=delay_rel_sd, g=g, rate_ext=rate_ext, 
+                                    background=background, scaling="linear")
+                rates_full  = model_full.mean_field_rates()
+            self.rates_full = np.array(rates_full, dtype=float)
+            J_mu_full       = self.J_mu * np.sqrt(self.k_scaling)
+            mu_lost         = self.tau_m * 1e-3 * np.dot(J_mu_full * self.K_full * 
+                                                         (1. - np.sqrt(self.k_scaling)), self.rates_full)
+            self.dc_ext     = self.dc_ext + self.C_m * mu_lost / self.tau_m
+        self.mu_dc      = self.tau_m * self.dc_ext / self.C_m   # mV
+
         self.mat_mu     = self.tau_m * 1e-3 * self.J_mu        * self.C_ab
         self.mu_ext     = self.tau_m * 1e-3 * self.J_mu_ext    * self.C_aext * self.rate_ext
         self.mat_var    = self.tau_m * 1e-3 * (1 + self.weight_rel_sd ** 2) * self.J_sd**2     * self.C_ab
         self.var_ext    = self.tau_m * 1e-3 * (1 + self.weight_rel_sd ** 2) * self.J_sd_ext**2 * self.C_aext * self.rate_ext
 
+        # Diffusion approximation of the background (background = "noise"):
+        # tau_m dV = (mu_ext - V) dt + sqrt(var_ext * tau_m) dW, i.e. a current of 
+        # mean C_m mu_ext / tau_m and, constant over dt_noise, std C_m sqrt(var_ext / (tau_m dt_noise))
+        self.noise_mean = self.C_m * self.mu_ext / self.tau_m                               # pA
+        self.noise_std  = self.C_m * np.sqrt(self.var_ext / (self.tau_m * self.dt_noise))   # pA
+        self.noise_receptor = 0     # current directly into the membrane
+        if self.neuron_model == "iaf_psc_exp":
+            # Filtered with tau_syn_ex (receptor 1 of iaf_psc_exp) like the Poisson input: 
+            # same mean and low frequency power as the shot noise (w tau_syn)^2 (1 + rel_sd^2) rate, 
+            # i.e. an Ornstein-Uhlenbeck current with the autocorrelation of the synaptic current.
+            # Receptor 1 adds (1 - exp(-dt / tau_syn)) I per step, spikes w per step: 
+            # scaled such that both give the same synaptic current.
+            step_factor     = sim.dt / self.tau_syn_ex / (1. - np.exp(-sim.dt / self.tau_syn_ex))
+            self.noise_mean = step_factor * self.noise_mean
+            self.noise_std  = step_factor * self.C_m * self.J_mu_ext * np.sqrt(
+                (1 + self.weight_rel_sd ** 2) * self.C_aext * self.rate_ext * 1e-3 / self.dt_noise)
+            self.noise_receptor = 1
+
     ######################################################
     # Methods                                           ##
     ######################################################
     def mu(self, v):
         """Mean input in Brunel's model"""
-        return (np.dot(self.mat_mu, v) + self.mu_ext)
+        return (np.dot(self.mat_mu, v) + self.mu_ext + self.mu_dc)
 
     def sd(self, v):
         """Fluctuation of input in Brunel's model"""
         return np.sqrt(np.dot(self.mat_var, v) + self.var_ext)
 
+    def mean_field_rates(self, v_guess=None):
+        """Rates (Hz) solving root_v0, starting at v_guess (default: rates of Potjans' model)."""
+        from scipy.optimize import root
+        if v_guess is None:
+            v_guess = np.array([0.6, 2.5, 4., 5.6, 8.2, 8., 1.6, 7.6])
+        solution = root(self.root_v0, v_guess, jac=self.jacobian, method="hybr")
+        if not solution["success"]:
+            raise Exception("No mean field solution found: " + solution["message"])
+        return solution["x"]
+
     def root_v0(self, v):
         """The integral equations to be solved
         Returns the array 'root', each entry corresponding to one population.
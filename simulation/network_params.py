@@ -33,6 +33,21 @@ area    = 1.0
 # Note that this produces different dynamics compared to the original model.
 scale_C_linearly  = True
 
+# Downscaling (area < 1), see model_class.py and downscaling.py:
+# "linear"      C_ab as above; with scale_C_linearly, the in-degrees are those of
+#               the full-scale model, but each neuron receives input from a larger
+#               fraction of its source populations (K / N grows as 1 / area)
+# "compensated" in-degrees k_indegree * full-scale in-degrees, weights scaled by 
+#               1 / sqrt(k_indegree) and a DC input added such that mean and variance 
+#               of the input at the full-scale rates are those of the full-scale model 
+#               (van Albada et al. 2015)
+scaling = "linear"
+# In-degrees relative to full scale for "compensated"; None: area (K / N as in full scale)
+k_indegree = None
+# Full-scale rates (Hz) used for the DC input of "compensated";
+# None: mean field rates of the full-scale model
+rates_full = None
+
 layers  = np.array(["L23", "L4", "L5", "L6"])
 types = np.array(["e", "i"]) 
 
@@ -100,6 +115,9 @@ syn_dict = {"model": "static_synapse"}
 neuron_model = "iaf_psc_exp"    # "iaf_psc_delta" or "iaf_psc_exp"
 Vm0_mean    = -58.0             # mean of initial membrane potential (mV)
 Vm0_std     = 10.0              # std of initial membrane potential (mV)
+# Heterogeneous single-neuron parameters, drawn for each neuron from a normal distribution
+# {name: (mean, std)}, e.g. {"V_th": (-50., 1.), "tau_m": (10., 1.)}
+neuron_params_dist = {}
 
 # neuron model parameters
 model_params = {"tau_m": 10.,       # membrane time constant (ms)
@@ -124,6 +142,11 @@ PSP_ext     = 0.15      # mean EPSP amplitude (mV) for external input
 # DC amplitude at each external input synapse (pA)
 # This is relevant for reproducing Potjans & Diesmann (2012) Fig. 7.
 dc_amplitude = 0. 
+# Background input: "poisson" (one poisson_generator per population) or 
+# "noise" (diffusion approximation: Gaussian white current with the mean and 
+# variance of the Poisson input, mu_ext and var_ext; noise_generator)
+background = "poisson"
+dt_noise    = 0.1       # ms; the noise current is constant over dt_noise (multiple of sim.dt)
 # in-degrees for background input
 C_aext = np.array([
         1600,   # 2/3e
@@ -0,0 +1,296 @@
+"""numpy_backend.py
+
+In-process simulation of a model_class.model without NEST,
+applied in:
+simulate_numpy.py
+
+Neurons are integrated with the exact propagators of the NEST models
+iaf_psc_delta, iaf_psc_exp and iaf_psc_alpha, vectorized over all neurons.
+Synapses are stored as CSR matrix (sorted by source), spikes are delivered
+through a ring buffer over the delays.
+
+Meant for small networks (area ~ 0.05 - 0.2) for parameter exploration and tests,
+where starting a NEST kernel costs more than the simulation itself.
+Data is saved with the same layout as functions.save_data.
+
+Contains:
+    network
+        simulate
+        save_data
+"""
+from __future__ import print_function
+import numpy as np
+# Import specific moduls
+from imp import reload
+import sim_params as sim; reload(sim)
+import connectome; reload(connectome)
+import random_streams; reload(random_streams)
+import spike_functions; reload(spike_functions)
+import functions; reload(functions)
+
+class network:
+    def __init__(self, model, master_seed,
+                 n_neurons_rec_spike, n_neurons_rec_voltage,
+                 connections=None, verbose=False):
+        """Network of model_class.model simulated with NumPy.
+
+        Uses two random streams: master_seed for the network (initial membrane
+        potentials and connections), master_seed + 1 for the external input.
+        With sim.counter_streams, the initial membrane potentials are those of 
+        functions.initialize_neurons (random_streams.counter_stream).
+        connections: optional connectome (see connectome.py), e.g. loaded from cache;
+        drawn with the first stream if None.
+        The recorded neurons are the first n_neurons_rec_{spike, voltage}
+        of each population, as in functions.connect.
+        """
+        self.model  = model
+        self.master_seed = master_seed
+        self.dt     = sim.dt
+        self.step   = 0     # number of simulated steps
+        rng_net     = np.random.RandomState(master_seed)
+        self.rng    = np.random.RandomState(master_seed + 1)
+
+        # Global neuron indices: population j has indices pop_first[j]:pop_first[j+1]
+        # Thalamic neurons follow the cortical ones.
+        self.pop_first  = np.append(0, np.cumsum(model.n_neurons))
+        self.n_total    = self.pop_first[-1]
+        self.pop_index  = np.repeat(np.arange(model.n_populations), model.n_neurons)
+
+        self.n_neurons_rec_spike    = n_neurons_rec_spike
+        self.n_neurons_rec_voltage  = n_neurons_rec_voltage
+
+        self._init_neurons(rng_net)
+        if connections is None:
+            connections = connectome.draw_connectome(model, rng_net, verbose)
+        self._init_synapses(connections)
+        self._init_recording()
+
+    def _init_neurons(self, rng):
+        """Propagators and state variables. V is relative to E_L."""
+        from scipy.linalg import expm
+        model   = self.model
+        params  = model.model_params
+        h       = self.dt
+        tau_m   = params["tau_m"]
+        C_m     = params["C_m"]
+        self.theta      = params["V_th"] - params["E_L"]
+        self.V_reset    = params["V_reset"] - params["E_L"]
+        self.ref_steps  = int(round(params["t_ref"] / h))
+        self.I_e        = params.get("I_e", 0.)
+
+        self.P33    = np.exp(-h / tau_m)
+        self.P30    = tau_m / C_m * (1. - self.P33)
+        if model.neuron_model == "iaf_psc_exp":
+            # state (I_syn, V)
+            self.P = []
+            for tau_syn in (model.tau_syn_ex, model.tau_syn_in):
+                A = np.array([[-1. / tau_syn, 0.],
+                              [1. / C_m, -1. / tau_m]])
+                self.P.append(expm(A * h))
+        elif model.neuron_model == "iaf_psc_alpha":
+            # state (dI_syn, I_syn, V)
+            self.P = []
+            for tau_syn in (model.tau_syn_ex, model.tau_syn_in):
+                A = np.array([[-1. / tau_syn, 0., 0.],
+                              [1., -1. / tau_syn, 0.],
+                              [0., 1. / C_m, -1. / tau_m]])
+                self.P.append(expm(A * h))
+            self.psc_initial = np.array([np.e / model.tau_syn_ex, np.e / model.tau_syn_in])
+        elif not model.neuron_model == "iaf_psc_delta":
+            raise Exception("Neuron model should be iaf_psc_ - {delta, exp, alpha}!")
+
+        # State
+        if "V_m" in params:
+            self.V  = np.ones(self.n_total) * (params["V_m"] - params["E_L"])
+        elif sim.counter_streams:
+            neuron_index = np.arange(self.n_total) - self.pop_first[self.pop_index]
+            self.V  = random_streams.counter_stream(self.master_seed).normal(
+                "V_m", self.pop_index, neuron_index, model.Vm0_mean, model.Vm0_std) - params["E_L"]
+        else:
+            self.V  = rng.normal(model.Vm0_mean, model.Vm0_std, self.n_total) - params["E_L"]
+        self.ref    = np.zeros(self.n_total, dtype=int)
+        self.I_syn  = np.zeros((2, self.n_total))     # excitatory, inhibitory
+        self.dI_syn = np.zeros((2, self.n_total))     # only for iaf_psc_alpha
+
+        # External input: Poisson events per step (or Gaussian current for background "noise")
+        # and constant current
+        self.lam_ext    = (model.rate_ext * model.C_aext * h * 1e-3)[self.pop_index]
+        self.I_dc       = model.dc_ext[self.pop_index] + self.I_e
+        if model.background == "noise":
+            self.noise_steps    = max(int(round(model.dt_noise / h)), 1)    # redrawn every dt_noise
+            self.noise_mean     = model.noise_mean[self.pop_index]
+            self.noise_std      = model.noise_std[self.pop_index]
+            self.I_noise        = np.zeros(self.n_total)
+
+    def _init_synapses(self, connections):
+        """CSR matrix sorted by source; the thalamic neurons are the last sources."""
+        model       = self.model
+        n_sources   = self.n_total + model.n_th
+        sources, targets, weights, delays = [], [], [], []
+        for target_index, source_index, sources_i, targets_i, weights_i, delays_i in connections:
+            if source_index == model.n_populations:
+                sources.append(sources_i + self.n_total)
+            else:
+                sources.append(sources_i + self.pop_first[source_index])
+            targets.append(targets_i + self.pop_first[target_index])
+            weights.append(weights_i)
+            delays.append(delays_i)
+        sources = np.concatenate(sources) if sources else np.zeros(0, dtype=int)
+        order   = np.argsort(sources, kind="mergesort")
+        self.indptr     = np.append(0, np.cumsum(np.bincount(sources, minlength=n_sources)))
+        self.targets    = np.concatenate(targets)[order].astype(np.int32) if targets else np.zeros(0, dtype=np.int32)
+        self.weights    = np.concatenate(weights)[order] if weights else np.zeros(0)
+        # Delays in steps, rounded to the resolution as in NEST
+        delay_steps     = np.rint(np.concatenate(delays)[order] / self.dt) if delays else np.zeros(0)
+        self.delays     = np.maximum(delay_steps, 1).astype(np.int16)
+        self.n_synapses = len(self.targets)
+
+        # Ring buffer: [channel (ex, in), slot, neuron]
+        self.n_slots    = int(self.delays.max()) + 1 if self.n_synapses > 0 else 1
+        self.ring       = np.zeros((2, self.n_slots, self.n_total))
+
+    def _init_recording(self):
+        model = self.model
+        self.rec_spike      = np.zeros(self.n_total, dtype=bool)
+        self.rec_voltage    = np.zeros(self.n_total, dtype=bool)
+        for j in range(model.n_populations):
+            i0 = self.pop_first[j]
+            self.rec_spike[i0 : i0 + min(self.n_neurons_rec_spike[j], model.n_neurons[j])]      = True
+            self.rec_voltage[i0 : i0 + min(self.n_neurons_rec_voltage[j], model.n_neurons[j])]  = True
+        self.spike_steps    = []
+        self.spike_senders  = []
+        self.volt_steps     = []
+        self.volts          = []
+        # Multimeter as in functions.create_nodes: interval 1 ms
+        self.volt_interval  = int(round(1.0 / self.dt))
+        self.volt_start     = int(round(sim.t_rec_volt_start / self.dt))
+        self.volt_stop      = int(round(sim.t_rec_volt_stop / self.dt))
+
+    def _deliver(self, spiking):
+        """Write the weights of all synapses of spiking sources to the ring buffer."""
+        starts  = self.indptr[spiking]
+        counts  = self.indptr[spiking + 1] - starts
+        n_syn   = np.sum(counts)
+        if n_syn == 0:
+            return
+        # Concatenated ranges starts[k]:starts[k]+counts[k]
+        syn     = np.repeat(starts - np.cumsum(counts) + counts, counts) + np.arange(n_syn)
+        weights = self.weights[syn]
+        slots   = (self.step + self.delays[syn].astype(np.intp)) % self.n_slots  # int16 delays
+        channel = (weights < 0).astype(np.intp)
+        flat    = (channel * self.n_slots + slots) * self.n_total + self.targets[syn]
+        np.add.at(self.ring.reshape(-1), flat, weights)
+
+    def _update(self):
+        """One step of size dt; returns the indices of spiking neurons."""
+        model   = self.model
+        slot    = self.step % self.n_slots
+        inputs  = self.ring[:, slot].copy()
+        self.ring[:, slot] = 0.
+        if model.background == "poisson":
+            inputs[0] += self.rng.poisson(self.lam_ext) * model.weight_ext
+            I_ext   = self.I_dc
+        else:
+            if self.step % self.noise_steps == 0:
+                self.I_noise = self.noise_mean + self.noise_std * self.rng.standard_normal(self.n_total)
+            if model.noise_receptor == 0:
+                I_ext   = self.I_dc + self.I_noise
+            else:
+                I_ext   = self.I_dc
+
+        active  = self.ref == 0
+        if model.neuron_model == "iaf_psc_delta":
+            V_new       = self.P30 * I_ext + self.P33 * self.V + inputs[0] + inputs[1]
+        elif model.neuron_model == "iaf_psc_exp":
+            V_new       = self.P30 * I_ext + self.P33 * self.V
+            for k in range(2):
+                V_new      += self.P[k][1, 0] * self.I_syn[k]
+                self.I_syn[k]   = self.P[k][0, 0] * self.I_syn[k] + inputs[k]
+            if model.background == "noise" and model.noise_receptor == 1:
+                # noise current filtered with tau_syn_ex (receptor 1 of NEST's iaf_psc_exp)
+                self.I_syn[0]  += (1. - self.P[0][0, 0]) * self.I_noise
+        elif model.neuron_model == "iaf_psc_alpha":
+            V_new       = self.P30 * I_ext + self.P33 * self.V
+            for k in range(2):
+                V_new      += self.P[k][2, 0] * self.dI_syn[k] + self.P[k][2, 1] * self.I_syn[k]
+                self.I_syn[k]   = self.P[k][1, 0] * self.dI_syn[k] + self.P[k][1, 1] * self.I_syn[k]
+                self.dI_syn[k]  = self.P[k][0, 0] * self.dI_syn[k] + self.psc_initial[k] * inputs[k]
+        self.V      = np.where(active, V_new, self.V)
+        self.ref[~active] -= 1
+
+        spiking = np.flatnonzero(self.V >= self.theta)
+        self.V[spiking]     = self.V_reset
+        self.ref[spiking]   = self.ref_steps
+        return spiking
+
+    def _thalamic_spikes(self):
+        """Indices (as sources) of spiking thalamic neurons in the current step."""
+        model = self.model
+        t = (self.step + 1) * self.dt
+        if model.n_th == 0 or not (model.th_start < t <= model.th_start + model.th_duration):
+            return np.zeros(0, dtype=int)
+        p_spike = model.th_rate * self.dt * 1e-3
+        return np.flatnonzero(self.rng.random_sample(model.n_th) < p_spike) + self.n_total
+
+    def simulate(self, t_sim, verbose=False):
+        """Simulate t_sim ms, continuing from the current state."""
+        n_steps = int(round(t_sim / self.dt))
+        print_every = int(round(1e3 / self.dt))   # every simulated second
+        for i in range(n_steps):
+            spiking = self._update()
+            self._deliver(np.append(spiking, self._thalamic_spikes()))
+            self.step += 1
+            # Recording: spike time is the end of the step, in units of dt
+            recorded = spiking[self.rec_spike[spiking]]
+            if len(recorded) > 0:
+                self.spike_steps.append(np.ones(len(recorded), dtype=np.uint) * self.step)
+                self.spike_senders.append(recorded)
+            if sim.record_voltage and self.step % self.volt_interval == 0 and \
+                    self.volt_start < self.step <= self.volt_stop:
+                self.volt_steps.append(self.step)
+                self.volts.append(self.V[self.rec_voltage] + self.model.model_params["E_L"])
+            if verbose and self.step % print_every == 0:
+                print("%.1f s simulated"%(self.step * self.dt * 1e-3))
+
+    def save_data(self, grp):
+        """Save spike data and membrane potentials (if specified so in sim_params.py)
+        with the layout of functions.save_data.
+        """
+        populations = self.model.populations
+        n_neurons_rec_spike     = self.n_neurons_rec_spike
+        n_neurons_rec_voltage   = self.n_neurons_rec_voltage
+        if sim.record_cortical_spikes:
+            spikes_grp = functions.create_spikes_group(grp, n_neurons_rec_spike)
+
+            if self.spike_steps:
+                all_times   = np.concatenate(self.spike_steps)
+                all_senders = np.concatenate(self.spike_senders)
+            else:
+                all_times   = np.zeros(0, dtype=np.uint)
+                all_senders = np.zeros(0, dtype=int)
+            for j, population in enumerate(populations):
+                in_pop  = self.pop_index[all_senders] == j
+                senders = all_senders[in_pop] - self.pop_first[j]
+                times   = all_times[in_pop]
+                # The recorded neurons are the first of each population
+                rec_indices = np.arange(min(n_neurons_rec_spike[j], self.model.n_neurons[j]))
+                sorted_times, rec_neuron_i = spike_functions.sort_spikes(senders, times, rec_indices,
+                                                                         n_neurons_rec_spike[j])
+
+                # Save data to HDF5 file:
+                spike_functions.write_spikes(spikes_grp.create_group(population), sorted_times, rec_neuron_i,
+                                             sim.spike_format)
+            if sim.spike_time_index:
+                spike_functions.add_time_index(spikes_grp, sim.t_bucket)
+
+        if sim.record_voltage:
+            voltage_grp = grp.create_group("voltage")
+            voltage_grp.attrs["dt_volt"]    = self.volt_interval * self.dt
+            voltage_grp.attrs["t_min"]      = sim.t_rec_volt_start
+            voltage_grp.attrs["t_max"]      = min(sim.t_rec_volt_stop, self.step * self.dt)
+            voltage_grp.attrs["n_neurons_rec_voltage"] = n_neurons_rec_voltage
+
+            volts   = np.array(self.volts).reshape(len(self.volts), -1).T  # [neuron, time]
+            rec_pop = self.pop_index[self.rec_voltage]
+            for j, population in enumerate(populations):
+                dset_volts = voltage_grp.create_dataset(population, data=volts[rec_pop == j])
@@ -0,0 +1,131 @@
+"""online_statistics.py
+
+Spike statistics accumulated while simulating, instead of from the saved spikes,
+applied in:
+functions.py        (run_simulation, simulate_chunked, simulate_adaptive)
+stationarity.py
+sweep_functions.py
+
+After each slice, the spikes of the recorded neurons are added to running sums:
+    per neuron      spike count, number, sum and sum of squares of ISIs
+    per population  histogram of spike times (bins of bin_width)
+only for spikes after t_start (the transient). At the end, the datasets of
+analysis/prep_data.py are written to the result file (<data file>_res.hdf5):
+    rates_mean, rates_std, cv_isi_mean, cv_isi_std, synchrony,
+    n_neurons_rec_spike, hist_spikes, hist_times, single_rates, single_cv_isi
+CVs of ISIs are taken over neurons with more than 2 spikes, as in prep_data.py.
+
+Contains:
+    initialize_result_file
+    class spike_statistics
+        add_spikes
+        cv_isi
+        save
+"""
+from __future__ import print_function
+import numpy as np
+import h5py
+import os
+
+# Attributes of the data file passed to the result file (as in prep_data.py)
+result_attrs = ["area", "t_sim", "t_trans", "dt", "populations", "layers", "types",
+                "n_populations", "n_layers", "n_types"]
+
+def initialize_result_file(data_file):
+    """Open the result file of data_file (<data file>_res.hdf5) and copy its attributes."""
+    res_file = h5py.File(os.path.splitext(data_file.filename)[0] + "_res.hdf5", "a")
+    for key in result_attrs:
+        res_file.attrs[key] = data_file.attrs[key]
+    return res_file
+
+class spike_statistics:
+    def __init__(self, n_neurons_rec, t_start, t_stop, bin_width=3.0):
+        """Statistics of the spikes of n_neurons_rec[j] neurons of each population j
+        after t_start. t_stop: latest end of the run, bin_width: of the histogram.
+        Times in ms.
+        """
+        self.n_neurons_rec  = np.array(n_neurons_rec)
+        self.n_populations  = len(n_neurons_rec)
+        self.t_start        = t_start
+        self.bin_width      = bin_width
+        n_bins              = int((t_stop - t_start) / bin_width)
+        self.hist_spikes    = np.zeros((self.n_populations, n_bins))
+        self.n_spikes       = [np.zeros(n) for n in self.n_neurons_rec]
+        self.last_spike     = [np.nan * np.ones(n) for n in self.n_neurons_rec]
+        self.isi_n          = [np.zeros(n) for n in self.n_neurons_rec]
+        self.isi_sum        = [np.zeros(n) for n in self.n_neurons_rec]
+        self.isi_sum_sq     = [np.zeros(n) for n in self.n_neurons_rec]
+
+    def add_spikes(self, pop_index, neuron_index, times):
+        """Spikes of the last slice: index of the recorded neuron and time (ms).
+        Slices have to be added in order of time.
+        """
+        times       = np.asarray(times, dtype=float)
+        after       = times > self.t_start
+        neuron_index, times = neuron_index[after], times[after]
+        if len(times) == 0:
+            return
+        n           = self.n_neurons_rec[pop_index]
+        self.n_spikes[pop_index] += np.bincount(neuron_index, minlength=n)
+        bins        = np.int_((times - self.t_start) / self.bin_width)
+        in_range    = bins < self.hist_spikes.shape[1]
+        self.hist_spikes[pop_index] += np.bincount(bins[in_range], minlength=self.hist_spikes.shape[1])
+
+        # ISIs: within the slice and from the last spike of the slices before
+        order       = np.lexsort((times, neuron_index))
+        neurons     = neuron_index[order]
+        times       = times[order]
+        first       = np.r_[True, neurons[1:] != neurons[:-1]]
+        last        = np.r_[neurons[1:] != neurons[:-1], True]
+        previous    = np.empty_like(times)
+        previous[1:]        = times[:-1]
+        previous[first]     = self.last_spike[pop_index][neurons[first]]
+        isi         = times - previous
+        valid       = ~np.isnan(isi)
+        self.isi_n[pop_index]       += np.bincount(neurons[valid], minlength=n)
+        self.isi_sum[pop_index]     += np.bincount(neurons[valid], isi[valid], minlength=n)
+        self.isi_sum_sq[pop_index]  += np.bincount(neurons[valid], isi[valid]**2, minlength=n)
+        self.last_spike[pop_index][neurons[last]] = times[last]
+
+    def cv_isi(self, pop_index):
+        """CV of ISIs of the neurons of population pop_index with more than 2 spikes."""
+        fired   = self.isi_n[pop_index] >= 2
+        mean    = self.isi_sum[pop_index][fired] / self.isi_n[pop_index][fired]
+        var     = np.maximum(self.isi_sum_sq[pop_index][fired] / self.isi_n[pop_index][fired] - mean**2, 0.)
+        return np.sqrt(var) / mean
+
+    def save(self, res_grp, populations, t_stop):
+        """Write the datasets of prep_data.py to res_grp for the run ending at t_stop (ms).
+        Times of the result file are in s.
+        """
+        t_measure   = (t_stop - self.t_start) * 1e-3    # s
+        n_bins      = min(int((t_stop - self.t_start) / self.bin_width), self.hist_spikes.shape[1])
+        hist_spikes = self.hist_spikes[:, :n_bins]
+        rates_mean  = np.zeros(self.n_populations)
+        rates_std   = np.zeros(self.n_populations)
+        cv_isi_mean = np.zeros(self.n_populations)
+        cv_isi_std  = np.zeros(self.n_populations)
+        synchrony   = np.zeros(self.n_populations)
+        for i, population in enumerate(populations):
+            rates           = self.n_spikes[i] / t_measure  # Hz; single neuron firing rates
+            cv_isi_all      = self.cv_isi(i)
+            rates_mean[i]   = np.mean(rates)
+            rates_std[i]    = np.std(rates)
+            cv_isi_mean[i]  = np.mean(cv_isi_all)
+            cv_isi_std[i]   = np.std(cv_isi_all)
+            synchrony[i]    = np.var(hist_spikes[i]) / np.mean(hist_spikes[i])
+            res_grp.create_dataset("single_rates/" + str(population), data=rates)
+            res_grp.create_dataset("single_cv_isi/" + str(population), data=cv_isi_all)
+
+        res_grp.create_dataset("rates_mean", data=rates_mean)
+        res_grp.create_dataset("rates_std", data=rates_std)
+        res_grp.create_dataset("cv_isi_mean", data=cv_isi_mean)
+        res_grp.create_dataset("cv_isi_std", data=cv_isi_std)
+        res_grp.create_dataset("synchrony", data=synchrony)
+        res_grp.create_dataset("n_neurons_rec_spike", data=self.n_neurons_rec)
+        res_grp.create_dataset("hist_spikes", data=hist_spikes)
+        bin_edges   = (self.t_start + np.arange(n_bins) * self.bin_width) * 1e-3  # s
+        dset_hist_times = res_grp.create_dataset("hist_times", data=bin_edges)
+        dset_hist_times.attrs["bin_size"] = self.bin_width * 1e-3
+        res_grp.attrs["t_trans"]    = self.t_start * 1e-3
+        res_grp.attrs["t_sim"]      = t_stop * 1e-3
@@ -0,0 +1,149 @@
+"""profiler.py
+
+Instrumentation of the phases of a simulation run,
+applied in:
+simulate_microcircuit.py
+simulate_transition.py
+simulate_numpy.py
+sweep_functions.py
+
+For each phase (prepare_simulation, create_nodes, connect, simulate, save_data)
+the profiler records
+    wall                wall clock time (s)
+    cpu                 user + system CPU time of the process (s)
+    peak_rss_mb         peak resident memory of the process up to the end of the phase (MB)
+    bytes_written       bytes written by the process (Linux only, /proc/self/io)
+    file_bytes          growth of the data file (bytes)
+    num_connections     NEST kernel statistics at the end of the phase
+    local_spike_counter
+    real_time_factor    wall / simulated time (if the phase has a model time t_model)
+The results are saved as attributes of grp["profile"][phase] and as JSON file
+(save_json: JSON file only).
+
+Usage:
+    prof = profiler.profiler(data_file)
+    prof.start("connect")
+    ...
+    T_connect = prof.stop()
+    prof.save(grp)
+
+Contains:
+    kernel_statistics
+    class profiler
+"""
+from __future__ import print_function
+try:
+    import nest
+except ImportError:     # profiling without NEST (numpy_backend.py)
+    nest = None
+import numpy as np
+import sys, os
+import time
+import json
+import resource
+
+kernel_keys = ["num_connections", "local_spike_counter"]
+
+def kernel_statistics():
+    """NEST kernel statistics (kernel_keys), as far as provided by the NEST version."""
+    statistics = {}
+    if nest is None:
+        return statistics
+    for key in kernel_keys:
+        try:
+            statistics[key] = int(nest.GetKernelStatus(key))
+        except Exception:
+            pass
+    return statistics
+
+class profiler:
+    def __init__(self, data_file=None):
+        """Profiler of the phases of one run.
+
+        data_file: open HDF5 file whose growth is recorded (optional).
+        """
+        self.data_file  = data_file
+        self.phases     = []    # names of the phases, in the order of execution
+        self.stats      = {}    # statistics of each phase
+        self.current    = None
+
+    def snapshot(self):
+        """Current counters of the process."""
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        peak_rss = usage.ru_maxrss / 1024.    # kB on Linux
+        if sys.platform == "darwin":
+            peak_rss /= 1024.                 # bytes on OS X
+        bytes_written = None
+        if os.path.exists("/proc/self/io"):
+            with open("/proc/self/io", "r") as io_file:
+                for line in io_file:
+                    if line.startswith("wchar:"):
+                        bytes_written = int(line.split()[1])
+        file_bytes = None
+        if not self.data_file is None:
+            self.data_file.flush()
+            file_bytes = os.path.getsize(self.data_file.filename)
+        return {"wall":             time.time(),
+                "cpu":              usage.ru_utime + usage.ru_stime,
+                "peak_rss_mb":      peak_rss,
+                "bytes_written":    bytes_written,
+                "file_bytes":       file_bytes}
+
+    def start(self, phase, t_model=None):
+        """Start phase; t_model: simulated time of the phase (ms) for the real time factor."""
+        if not self.current is None:
+            self.stop()
+        self.current = (phase, t_model, self.snapshot())
+
+    def stop(self, t_model=None):
+        """Stop the current phase. Returns its wall clock time (s).
+        t_model: simulated time of the phase (ms), if only known at its end.
+        """
+        phase, t_model_start, before = self.current
+        if t_model is None:
+            t_model = t_model_start
+        after   = self.snapshot()
+        stats   = {"wall":          after["wall"] - before["wall"],
+                   "cpu":           after["cpu"] - before["cpu"],
+                   "peak_rss_mb":   after["peak_rss_mb"]}
+        for key in ("bytes_written", "file_bytes"):
+            if not after[key] is None:
+                stats[key] = after[key] - before[key]
+        if not t_model is None:
+            stats["t_model"]            = t_model
+            stats["real_time_factor"]   = stats["wall"] / (t_model * 1e-3)
+        stats.update(kernel_statistics())
+        if not phase in self.phases:
+            self.phases.append(phase)
+        self.stats[phase] = stats
+        self.current = None
+        return stats["wall"]
+
+    def wall(self, phase):
+        """Wall clock time (s) of phase."""
+        return self.stats[phase]["wall"]
+
+    def to_dict(self):
+        """All statistics, phases in the order of execution."""
+        return {"phases": self.phases,
+                "stats":  dict((phase, self.stats[phase]) for phase in self.phases)}
+
+    def save(self, grp, json_path=None):
+        """Save statistics as attributes of grp["profile"][phase] and as JSON file
+        (default: next to the data file, data_file_<group>.profile.json).
+        """
+        profile_grp = grp.require_group("profile")
+        profile_grp.attrs["phases"] = [str(phase) for phase in self.phases]
+        for phase in self.phases:
+            phase_grp = profile_grp.require_group(phase)
+            for key, value in self.stats[phase].items():
+                phase_grp.attrs[key] = value
+        if json_path is None:
+            json_path = grp.file.filename + "_" + grp.name.strip("/").replace("/", "_") + ".profile.json"
+        return self.save_json(json_path)
+
+    def save_json(self, json_path):
+        """Save statistics as JSON file only (phases not belonging to a group of the data file)."""
+        with open(json_path, "w") as json_file:
+            json.dump(self.to_dict(), json_file, indent=2, sort_keys=True)
+        return json_path
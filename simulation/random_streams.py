@@ -0,0 +1,117 @@
+"""random_streams.py
+
+Seeds of a run and counter-based random streams,
+applied in:
+functions.py            (prepare_simulation, initialize_neurons, save_checkpoint)
+numpy_backend.py
+registry.py
+simulate_microcircuit.py, simulate_transition.py, simulate_numpy.py, sweep_functions.py
+
+Seeds of a run with master_seed (n_vp virtual processes):
+    master_seed ... master_seed + n_vp - 1          NEST rngs (one per virtual process)
+    master_seed + n_vp                              NEST grng
+    master_seed + n_vp + 1 ... master_seed + 2 n_vp pyrngs (sim.counter_streams = False)
+    master_seed + 2 n_vp + 1                        connectome (sim.counter_streams = False)
+    ... master_seed + 2 n_vp + 2 n_populations      last_seed, reserved
+With sim.counter_streams, the values drawn in Python do not depend on n_vp:
+each value is a function of (master_seed, purpose, population, neuron index),
+computed with the counter-based generator Philox4x32-10 (Salmon et al. 2011),
+and the connectome seed is derived from (master_seed, "connectome").
+Networks (initial membrane potentials, heterogeneous parameters, connectome
+of connectome.py) are thus identical for any number of threads and MPI processes.
+Input drawn by NEST (Poisson generators, nest.Connect) still depends on n_vp.
+As the drawn values of a master_seed differ between both modes, each run records
+sim.counter_streams (group attribute "counter_streams" and registry).
+
+Contains:
+    last_seed
+    nest_seeds
+    pyrng_seeds
+    connectome_seed
+    philox
+    class counter_stream
+        uniform
+        normal
+"""
+from __future__ import print_function
+import numpy as np
+import zlib
+# Import specific moduls
+from imp import reload
+import sim_params as sim; reload(sim)
+
+######################################################
+# Seeds
+######################################################
+def last_seed(master_seed, n_vp, n_populations):
+    """Last seed of the range reserved for a run with master_seed."""
+    return master_seed + 2 * n_vp + 2 * n_populations
+
+def nest_seeds(master_seed, n_vp):
+    """Seeds of the NEST rngs (one per virtual process) and of the grng."""
+    return list(range(master_seed, master_seed + n_vp)), master_seed + n_vp
+
+def pyrng_seeds(master_seed, n_vp):
+    """Seeds of the pyrngs (one per virtual process)."""
+    return list(range(master_seed + n_vp + 1, master_seed + 2 * n_vp + 1))
+
+def connectome_seed(master_seed, n_vp):
+    """Seed of the connectome (connectome.py) of a run with master_seed."""
+    if sim.counter_streams:
+        return int(philox(np.zeros(1, dtype=np.uint64), 0, 0,
+                          key=stream_key(master_seed, "connectome"))[0][0])
+    return master_seed + 2 * n_vp + 1   # first seed not used by NEST and pyrngs
+
+######################################################
+# Philox4x32-10
+######################################################
+philox_M    = (0xD2511F53, 0xCD9E8D57)  # multipliers
+philox_W    = (0x9E3779B9, 0xBB67AE85)  # Weyl sequence of the key
+mask_32     = np.uint64(0xFFFFFFFF)
+
+def stream_key(master_seed, purpose):
+    """Key (two 32 bit words) of the stream of purpose (string)."""
+    return (master_seed & 0xFFFFFFFF, zlib.crc32(purpose.encode("utf-8")) & 0xFFFFFFFF)
+
+def philox(c0, c1, c2, c3=0, key=(0, 0), rounds=10):
+    """Philox4x32 of the counters (c0, c1, c2, c3), arrays or scalars (< 2**32).
+    Returns four arrays of uint64 values < 2**32.
+    """
+    c0, c1, c2, c3 = np.broadcast_arrays(*[np.asarray(c, dtype=np.uint64) for c in (c0, c1, c2, c3)])
+    c0, c1, c2, c3 = c0.copy(), c1.copy(), c2.copy(), c3.copy()
+    k0, k1  = key
+    for i in range(rounds):
+        product_0   = np.uint64(philox_M[0]) * c0
+        product_1   = np.uint64(philox_M[1]) * c2
+        c0, c1, c2, c3 = ((product_1 >> np.uint64(32)) ^ c1 ^ np.uint64(k0),
+                          product_1 & mask_32,
+                          (product_0 >> np.uint64(32)) ^ c3 ^ np.uint64(k1),
+                          product_0 & mask_32)
+        k0  = (k0 + philox_W[0]) & 0xFFFFFFFF
+        k1  = (k1 + philox_W[1]) & 0xFFFFFFFF
+    return c0, c1, c2, c3
+
+class counter_stream:
+    def __init__(self, master_seed):
+        """Random values as functions of (master_seed, purpose, pop_index, neuron_index).
+        Returned by functions.prepare_simulation instead of pyrngs if sim.counter_streams.
+        """
+        self.master_seed = master_seed
+
+    def _words(self, purpose, pop_index, neuron_index):
+        """Four 32 bit words per neuron."""
+        neuron_index = np.asarray(neuron_index, dtype=np.uint64)
+        return philox(neuron_index, pop_index, 0, self.master_seed >> 32,
+                      key=stream_key(self.master_seed, purpose))
+
+    def uniform(self, purpose, pop_index, neuron_index):
+        """One value in (0, 1) per neuron_index (index within population pop_index)."""
+        words = self._words(purpose, pop_index, neuron_index)
+        return (words[0].astype(float) + 0.5) / 2.**32
+
+    def normal(self, purpose, pop_index, neuron_index, mean=0., std=1.):
+        """One normally distributed value per neuron_index (Box-Muller)."""
+        words   = self._words(purpose, pop_index, neuron_index)
+        u_1     = (words[0].astype(float) + 0.5) / 2.**32
+        u_2     = (words[1].astype(float) + 0.5) / 2.**32
+        return mean + std * np.sqrt(-2. * np.log(u_1)) * np.cos(2. * np.pi * u_2)
@@ -0,0 +1,351 @@
+"""registry.py
+
+Registry of master seeds and runs (SQLite database in sim.log_path),
+replacing seeds.log and info.log, and catalog of the groups of all data files.
+applied in:
+simulate_microcircuit.py
+simulate_transition.py
+simulate_numpy.py
+brunel_simulation/brunel_simulate.py
+analysis/text_to_hdf5.py, analysis/text_to_hdf5_append.py
+
+Each run obtains the seeds master_seed ... last_seed with
+    last_seed = master_seed + 2 * n_vp + 2 * n_populations
+(NEST rngs and grng, pyrngs, connectome and the remaining purposes; random_streams.py),
+beyond the last run of the registry and the last entry of seeds.log (test_micro.py).
+Ranges are allocated in an exclusive transaction of the database, thus
+simulations started at the same time never obtain overlapping seeds.
+With several MPI processes, only rank 0 allocates and records a run
+(allocate_seeds_rank0); the other ranks obtain its run_id and master_seed.
+Note that SQLite locking is not reliable on some network file systems.
+
+Catalog: each data file is entered after it is written (catalog_file), with
+    files       path, size, modification time, SHA-1 checksum
+    groups      each top level group of the file
+    attributes  all attributes of the file and of the group (group attributes 
+                take precedence): model and simulation parameters, master_seed,
+                distance, timings (time_to_connect, ...), contents (spikes, voltage)
+Files already in the catalog with unchanged size and modification time are skipped.
+find_groups queries the catalog without opening any data file, e.g.
+    find_groups(connection_rule="fixed_indegree", distance=(0.4, 0.6))
+Existing data: python registry.py [directory ...]   (default: sim.data_dir)
+
+Contains:
+    open_registry
+    seed_log_seed
+    allocate_seeds
+    allocate_seeds_rank0
+    record_run
+    get_runs
+    file_checksum
+    attribute_value
+    catalog_file
+    catalog_directory
+    find_groups
+"""
+from __future__ import print_function
+import numpy as np
+import h5py
+import sqlite3
+import hashlib
+import socket
+import sys, os
+import datetime
+# Import specific moduls
+from imp import reload
+import sim_params as sim; reload(sim)
+import random_streams; reload(random_streams)
+import distributed; reload(distributed)
+
+# columns of the runs table
+run_columns = [("run_id",           "INTEGER PRIMARY KEY AUTOINCREMENT"),
+               ("master_seed",      "INTEGER"),
+               ("last_seed",        "INTEGER"),
+               ("n_vp",             "INTEGER"),
+               ("n_populations",    "INTEGER"),
+               ("counter_streams",  "INTEGER"),
+               ("host",             "TEXT"),
+               ("pid",              "INTEGER"),
+               ("date_and_time",    "TEXT"),
+               ("data_file",        "TEXT"),
+               ("group_name",       "TEXT"),
+               ("area",             "REAL"),
+               ("t_sim",            "REAL"),
+               ("T_connect",        "REAL"),
+               ("T_simulate",       "REAL"),
+               ("T_save",           "REAL"),
+               ("status",           "TEXT")]
+
+# tables of the catalog
+catalog_tables = ["""CREATE TABLE IF NOT EXISTS files (
+                        file_id     INTEGER PRIMARY KEY AUTOINCREMENT,
+                        path        TEXT UNIQUE,
+                        size        INTEGER,
+                        mtime       REAL,
+                        checksum    TEXT,
+                        cataloged   TEXT)""",
+                  """CREATE TABLE IF NOT EXISTS groups (
+                        group_id    INTEGER PRIMARY KEY AUTOINCREMENT,
+                        file_id     INTEGER REFERENCES files(file_id) ON DELETE CASCADE,
+                        group_name  TEXT)""",
+                  """CREATE TABLE IF NOT EXISTS attributes (
+                        group_id    INTEGER REFERENCES groups(group_id) ON DELETE CASCADE,
+                        name        TEXT,
+                        value_real  REAL,
+                        value_text  TEXT)""",
+                  "CREATE INDEX IF NOT EXISTS attributes_real ON attributes (name, value_real)",
+                  "CREATE INDEX IF NOT EXISTS attributes_text ON attributes (name, value_text)",
+                  "CREATE INDEX IF NOT EXISTS groups_file ON groups (file_id)"]
+
+def open_registry(db_path=None):
+    """Open (and create if necessary) the registry at db_path (default: sim.log_path/registry.db)."""
+    if db_path is None:
+        db_path = os.path.join(sim.log_path, "registry.db")
+    # isolation_level=None: transactions are started explicitly
+    connection = sqlite3.connect(db_path, timeout=60., isolation_level=None)
+    connection.row_factory = sqlite3.Row
+    connection.execute("PRAGMA foreign_keys = ON")
+    connection.execute("CREATE TABLE IF NOT EXISTS runs (" +
+                       ", ".join(name + " " + col_type for name, col_type in run_columns) + ")")
+    # registries created before a column was added
+    existing = [row["name"] for row in connection.execute("PRAGMA table_info(runs)")]
+    for name, col_type in run_columns:
+        if not name in existing:
+            connection.execute("ALTER TABLE runs ADD COLUMN " + name + " " + col_type)
+    for table in catalog_tables:
+        connection.execute(table)
+    return connection
+
+def seed_log_seed():
+    """Seed following the last entry of seeds.log (scripts not using the registry), 
+    None if there is none.
+    """
+    seed_file_path = os.path.join(sim.log_path, "seeds.log")
+    if os.path.exists(seed_file_path):
+        with open(seed_file_path, "r") as seed_file:
+            old_seeds = seed_file.readlines()
+        try:
+            return int(old_seeds[-1].split("\t")[0]) + 1
+        except:
+            pass
+    return None
+
+def allocate_seeds(n_vp, n_populations, data_file=None, group_name=None, db_path=None):
+    """Allocate a range of seeds for a new run.
+
+    Returns run_id and master_seed; the range ends at master_seed + 2 * n_vp + 2 * n_populations.
+    """
+    connection = open_registry(db_path)
+    try:
+        connection.execute("BEGIN IMMEDIATE")   # write lock until commit
+        last_seed = connection.execute("SELECT MAX(last_seed) FROM runs").fetchone()[0]
+        if last_seed is None:
+            master_seed = sim.master_seed
+        else:
+            master_seed = last_seed + 1
+        # Beyond the seeds taken by scripts still writing seeds.log
+        log_seed = seed_log_seed()
+        if not log_seed is None:
+            master_seed = max(master_seed, log_seed)
+        now     = str(datetime.datetime.now())[:-7]
+        cursor  = connection.execute(
+            "INSERT INTO runs (master_seed, last_seed, n_vp, n_populations, counter_streams, host, pid, " +
+            "date_and_time, data_file, group_name, status) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (master_seed, random_streams.last_seed(master_seed, n_vp, n_populations), n_vp, n_populations,
+             int(sim.counter_streams), socket.gethostname(), os.getpid(), now, data_file, group_name, 
+             "allocated"))
+        run_id  = cursor.lastrowid
+        connection.execute("COMMIT")
+    except:
+        connection.execute("ROLLBACK")
+        raise
+    finally:
+        connection.close()
+    return (run_id, master_seed)
+
+def allocate_seeds_rank0(n_vp, n_populations, data_file=None, group_name=None, db_path=None):
+    """allocate_seeds on MPI rank 0, broadcast to all ranks (distributed.broadcast),
+    such that all ranks simulate the same network. Returns run_id and master_seed.
+    """
+    seeds = None
+    if distributed.rank() == 0:
+        seeds = allocate_seeds(n_vp, n_populations, data_file, group_name, db_path)
+    return distributed.broadcast(seeds)
+
+def record_run(run_id, db_path=None, status="done", **info):
+    """Save details of the run (group_name, area, t_sim, T_connect, T_simulate, T_save, ...)."""
+    names = [name for name, col_type in run_columns]
+    for key in info:
+        if not key in names:
+            raise Exception("No column " + key + " in the registry.")
+    info["status"] = status
+    keys        = sorted(info.keys())
+    values      = [info[key].item() if hasattr(info[key], "item") else info[key] for key in keys]
+    connection  = open_registry(db_path)
+    try:
+        connection.execute("UPDATE runs SET " + ", ".join(key + " = ?" for key in keys) +
+                           " WHERE run_id = ?", values + [int(run_id)])
+    finally:
+        connection.close()
+
+def get_runs(db_path=None, **conditions):
+    """List of runs (dictionaries) matching conditions, e.g. get_runs(data_file=path)."""
+    connection  = open_registry(db_path)
+    query       = "SELECT * FROM runs"
+    keys        = sorted(conditions.keys())
+    for key in keys:
+        if not key in [name for name, col_type in run_columns]:
+            raise Exception("No column " + key + " in the registry.")
+    if len(keys) > 0:
+        query  += " WHERE " + " AND ".join(key + " = ?" for key in keys)
+    try:
+        rows = connection.execute(query + " ORDER BY run_id", [conditions[key] for key in keys]).fetchall()
+    finally:
+        connection.close()
+    return [dict(zip(row.keys(), row)) for row in rows]
+
+######################################################
+# Catalog of data files
+######################################################
+def file_checksum(file_path, block_size=2**24):
+    """SHA-1 of the file at file_path (hex), read in blocks of block_size bytes."""
+    sha1 = hashlib.sha1()
+    with open(file_path, "rb") as data_file:
+        for block in iter(lambda: data_file.read(block_size), b""):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+def attribute_value(value):
+    """(value_real, value_text) of an HDF5 attribute: numbers and booleans as real, 
+    strings as text, arrays as text (list).
+    """
+    if isinstance(value, bytes):
+        return None, value.decode("utf-8", "replace")
+    if isinstance(value, str):
+        return None, value
+    value = np.asarray(value)
+    if value.size == 1 and value.dtype.kind in "biuf":
+        return float(value.ravel()[0]), None
+    if value.dtype.kind == "S":
+        value = value.astype("U")
+    return None, str(value.tolist())
+
+def catalog_file(file_path, db_path=None, checksum=True, force=False):
+    """Enter the groups of the HDF5 file at file_path and their attributes into the catalog
+    (replacing earlier entries of the file). Skipped if the file is cataloged with the 
+    same size and modification time, unless force.
+    Returns the number of cataloged groups.
+    """
+    file_path   = os.path.abspath(file_path)
+    size        = os.path.getsize(file_path)
+    mtime       = os.path.getmtime(file_path)
+    connection  = open_registry(db_path)
+    try:
+        row = connection.execute("SELECT size, mtime FROM files WHERE path = ?", (file_path,)).fetchone()
+        if not force and not row is None and row["size"] == size and row["mtime"] == mtime:
+            return 0
+        entries = []
+        with h5py.File(file_path, "r") as data_file:
+            file_attrs = dict(data_file.attrs.items())
+            for group_name, grp in data_file.items():
+                if not isinstance(grp, h5py.Group):
+                    continue
+                attrs = dict(file_attrs)
+                attrs.update(grp.attrs.items())
+                attrs["contents"] = ",".join(sorted(grp.keys()))
+                entries.append((group_name, attrs))
+        file_sha1   = file_checksum(file_path) if checksum else None
+        now         = str(datetime.datetime.now())[:-7]
+
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            connection.execute("DELETE FROM files WHERE path = ?", (file_path,))
+            file_id = connection.execute(
+                "INSERT INTO files (path, size, mtime, checksum, cataloged) VALUES (?, ?, ?, ?, ?)",
+                (file_path, size, mtime, file_sha1, now)).lastrowid
+            for group_name, attrs in entries:
+                group_id = connection.execute("INSERT INTO groups (file_id, group_name) VALUES (?, ?)",
+                                              (file_id, group_name)).lastrowid
+                connection.executemany(
+                    "INSERT INTO attributes (group_id, name, value_real, value_text) VALUES (?, ?, ?, ?)",
+                    [(group_id, name) + attribute_value(value) for name, value in sorted(attrs.items())])
+            connection.execute("COMMIT")
+        except:
+            connection.execute("ROLLBACK")
+            raise
+    finally:
+        connection.close()
+    return len(entries)
+
+def catalog_directory(data_dir=None, db_path=None, checksum=True, verbose=True):
+    """catalog_file for all HDF5 files below data_dir (default: sim.data_dir),
+    except the files of single MPI ranks.
+    """
+    if data_dir is None:
+        data_dir = sim.data_dir
+    for dir_path, dir_names, file_names in os.walk(data_dir):
+        for file_name in sorted(file_names):
+            if not file_name.endswith(".hdf5") or ".rank" in file_name:
+                continue
+            file_path = os.path.join(dir_path, file_name)
+            try:
+                n_groups = catalog_file(file_path, db_path, checksum)
+            except (IOError, OSError) as error:
+                if verbose: print("%s: %s"%(file_path, error))
+                continue
+            if verbose and n_groups > 0: print("%s: %i groups"%(file_path, n_groups))
+
+def find_groups(db_path=None, **conditions):
+    """Cataloged groups (dictionaries of path, group_name, checksum and all attributes)
+    matching all conditions:
+        name=value          equal (numbers or strings)
+        name=(low, high)    low < value < high (None: no bound)
+    e.g. find_groups(connection_rule="fixed_indegree", distance=(0.4, 0.6))
+    """
+    query       = ("SELECT groups.group_id, files.path, files.checksum, groups.group_name " +
+                   "FROM groups JOIN files ON groups.file_id = files.file_id")
+    clauses     = []
+    parameters  = []
+    for name in sorted(conditions.keys()):
+        value   = conditions[name]
+        clause  = "groups.group_id IN (SELECT group_id FROM attributes WHERE name = ?"
+        parameters.append(name)
+        if isinstance(value, tuple):
+            low, high = value
+            if not low is None:
+                clause += " AND value_real > ?"
+                parameters.append(float(low))
+            if not high is None:
+                clause += " AND value_real < ?"
+                parameters.append(float(high))
+        else:
+            value_real, value_text = attribute_value(value)
+            if value_real is None:
+                clause += " AND value_text = ?"
+                parameters.append(value_text)
+            else:
+                clause += " AND value_real = ?"
+                parameters.append(value_real)
+        clauses.append(clause + ")")
+    if len(clauses) > 0:
+        query  += " WHERE " + " AND ".join(clauses)
+    connection  = open_registry(db_path)
+    try:
+        groups  = []
+        for row in connection.execute(query + " ORDER BY files.path, groups.group_name", parameters).fetchall():
+            group = {"path": row["path"], "group_name": row["group_name"], "checksum": row["checksum"]}
+            for name, value_real, value_text in connection.execute(
+                    "SELECT name, value_real, value_text FROM attributes WHERE group_id = ?",
+                    (row["group_id"],)):
+                group[name] = value_text if value_real is None else value_real
+            groups.append(group)
+    finally:
+        connection.close()
+    return groups
+
+if __name__ == "__main__":
+    data_dirs = sys.argv[1:]
+    if len(data_dirs) == 0:
+        data_dirs = [sim.data_dir]
+    for data_dir in data_dirs:
+        catalog_directory(data_dir)
@@ -22,12 +22,50 @@ t_measure = 600.0e3   # ms; time actually measured
 t_sim = t_measure + t_trans    # ms; simulated time 
 dt = 0.1            # ms; simulation step; default is 0.1 ms. (resolution of kernel)
 allgather = True    # communication protocol
+# Simulate in slices of t_chunk (ms), streaming spikes to disk after each slice 
+# (functions.simulate_chunked). None: simulate t_sim at once.
+t_chunk = None
+# With t_chunk: write a checkpoint every t_checkpoint (ms) of simulated time, 
+# such that the run can be resumed (simulate_microcircuit.py --resume). None: no checkpoints.
+t_checkpoint = None
+# Adaptive run length (functions.simulate_adaptive, stationarity.py): simulate in windows 
+# of t_window; the transient ends when the population rates no longer drift, the measurement
+# when the rates are known to rel_precision. t_trans and t_measure are then upper bounds; 
+# the actual values are saved as attributes of each group.
+adaptive = False
+t_window = 50.0         # ms; window of the running statistics
+n_windows_stable = 2    # end of transient: rates of the last n_windows_stable windows equal 
+drift_z = 2.0           # those of the n_windows_stable windows before within drift_z standard errors
+t_trans_max = 2.0e3     # ms; longest transient
+t_batch = 1.0e3         # ms; batches for the confidence intervals of the rates
+rel_precision = 0.02    # half width of the 95% confidence interval relative to each population rate
+t_measure_min = 10.0e3  # ms; shortest measurement
+# Accumulate the statistics of analysis/prep_data.py while simulating (online_statistics.py) 
+# and write them to the result file <data file>_res.hdf5. Spikes are fetched after each slice 
+# of t_chunk (one slice if t_chunk is None) or window (adaptive).
+online_statistics = False
+save_raw_spikes = True  # whether to save all spikes in addition (online_statistics only)
+# Format of saved spike times (spike_functions.write_spikes): 
+# "plain":  uint64 ticks, contiguous (memory mapped by spike_store.py)
+# "delta":  uint32 differences per neuron, chunked with shuffle and lzf compression;
+#           read transparently by spike_functions.read_spikes and spike_store.py
+spike_format = "plain"
+# Save a time-sorted copy of the spikes of each population with an index of time buckets
+# of t_bucket (spike_functions.write_time_index), such that windows of spikes are read
+# without scanning all neurons (spike_store.py). Doubles the size of the spike data.
+spike_time_index = False
+t_bucket = 10.0         # ms
 
 # master seed for random number generators
-# actual seeds will be master_seed ... master_seed + 2*n_vp
-#  ==>> different master seeds must be spaced by at least 2*n_vp + 1
+# actual seeds will be master_seed ... master_seed + 2*n_vp + 2*n_populations
+# (random_streams.py; ranges are allocated by registry.py)
 # see Gewaltig et al. '2012' for details       
 master_seed = 0    # changes rng_seeds and grng_seed
+# Draw membrane potentials, heterogeneous parameters and the connectome seed from 
+# counter-based streams keyed by (master_seed, purpose, neuron), independent of n_vp
+# (random_streams.py). Changes the drawn values for a given master_seed, thus saved
+# with each run (group attribute and registry). False: one pyrng per virtual process.
+counter_streams = False
 
 n_mpi_procs = 1         # number of MPI processes
 
@@ -40,6 +78,16 @@ n_vp = int(n_threads_per_proc * n_mpi_procs)# number of virtual processes
                                             # See Morrison et al. '2005' Neural Comput
 
 
+###################################################
+###     	Connectome		                    ###        
+###################################################
+
+# Whether to draw the connectome with NumPy (connectome.py) instead of using 
+# NEST's connection rules. Connectomes are cached in connectome_dir, keyed by 
+# model parameters and seed: runs on the same frozen network skip drawing.
+use_connectome_cache = False
+connectome_dir = data_dir + "/connectomes"
+
 ###################################################
 ###     	Recording parameters		###        
 ################################################### 
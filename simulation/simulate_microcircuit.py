@@ -5,16 +5,22 @@ Repetitive runs for Potjans' model.
 Structure:
 instantiate model                   from model_class.py
 initialize_data_file                creates file_name and opens HDF5-file
-initialize_seeds                    opens seeds.log and looks for previous master seeds 
-initialize_info_file                opens and initializes info_file, where basic parameters of the simulation are saved in plain text
 
 Loop over n_runs:
+    allocate_seeds                  obtain an independent range of seeds from the registry (registry.py; 
+                                    MPI rank 0 only, broadcast to the other ranks)
     prepare_simulation              prepare random generators such that each simulation is independent 
     derive_parameters               calculate number of neurons to record from (spikes and membrane potentials separately)
     create_nodes                    node parameters are set here (incl. membrane potential initialization)
     connect                         synapse parameters are set here
-    nest.simulate
+    nest.simulate                   at once or in slices of sim.t_chunk, streaming spikes to disk (simulate_chunked)
+                                    or until the rates are stationary and precise (sim.adaptive, simulate_adaptive)
     save_data                       saves data to HDF5-file.
+                                    (each phase is profiled: time, memory, NEST statistics; profiler.py)
+    record_run                      saves timings etc. of the run to the registry
+
+With n_workers > 1, the runs are simulated in parallel worker processes,
+each with its own NEST kernel of n_threads_worker threads (sweep_functions.py).
 
 Naming convention: layer (e.g. L4), type (usually e and i), population (e.g. L4e)
 """
@@ -29,12 +35,37 @@ from imp import reload
 import sim_params as sim; reload(sim)
 import functions; reload(functions)
 import model_class; reload(model_class)
+import connectome; reload(connectome)
+import sweep_functions; reload(sweep_functions)
+import registry; reload(registry)
+import profiler; reload(profiler)
+import online_statistics; reload(online_statistics)
+import random_streams; reload(random_streams)
+import distributed; reload(distributed)
 verbose     = False                     # whether to print every connection made
 
 # ONLY PUT THIS IF YOU DONT WANT TO HAVE A FILE NAME AUTOMATICALLY ASSIGNED
 name    = "simulate_ergocity"
 # whether to append the selected data_file (if it existist, otherwise might cause error!)
 append_data = False 
+# whether all runs share the connectome of the first run (only with sim.use_connectome_cache)
+frozen_network = False
+# Number of worker processes simulating runs in parallel. 1: serial, in this process.
+n_workers           = 1
+n_threads_worker    = sim.n_threads_per_proc   # threads of each worker's kernel
+
+# Resume a run from its last checkpoint (requires sim.t_chunk and sim.t_checkpoint):
+#   python simulate_microcircuit.py --resume <path to data file> <group name>
+resume = "--resume" in sys.argv
+if resume and sim.adaptive:
+    raise Exception("Adaptive runs can't be resumed; set adaptive = False.")
+if resume and (sim.t_chunk is None or sim.t_checkpoint is None):
+    raise Exception("Resuming requires sim.t_chunk and sim.t_checkpoint (as for the interrupted run)!")
+if resume and sim.record_voltage:
+    raise Exception("Membrane potentials are not part of checkpoints; set record_voltage = False.")
+if resume:
+    resume_file_path    = sys.argv[sys.argv.index("--resume") + 1]
+    resume_group_name   = sys.argv[sys.argv.index("--resume") + 2]
 
 #######################################################
 # Instantiate model
@@ -50,103 +81,173 @@ model           = model_class.model(neuron_model=neuron_model,
 # Create data file
 #######################################################
 sub_path = "micro"
-data_file, file_name, data_path = functions.initialize_data_file(sub_path, model, verbose, name=name, append=append_data)
-seed_file, master_seed          = functions.initialize_seeds()
-info_file                       = functions.initialize_info_file(file_name, data_path)
+if resume:
+    data_path, file_name        = os.path.split(resume_file_path)
+    data_file                   = h5py.File(resume_file_path, "r+")
+else:
+    data_file, file_name, data_path = functions.initialize_data_file(sub_path, model, verbose, name=name, append=append_data)
+# Statistics of prep_data.py, accumulated while simulating
+if sim.online_statistics:
+    res_file = online_statistics.initialize_result_file(data_file)
 
 #######################################################
 # Looping
 #######################################################
 # The steps on the way from Brunel to microcircuit
 n_runs = 1
+if resume:
+    n_runs = 1
 
-for run_i in range(n_runs):
-    ######################################################
-    # Prepare simulation
-    ######################################################
-    pyrngs = functions.prepare_simulation(master_seed, n_populations=model.n_populations)
-
-    ######################################################
-    # Derive parameters
-    ######################################################
-    (n_neurons_rec_spike, n_neurons_rec_voltage) = functions.derive_parameters(model)
-     
+if n_workers > 1 and not resume:
     ######################################################
-    # Create nodes
+    # Parallel: one task per run
     ######################################################
-    print("Create nodes")
-    all_GIDs = functions.create_nodes(model, pyrngs)
-
-    ###################################################
-    # Connect
-    ###################################################
-    print("Connect")
-    t_connect_0 = time.time()
-    functions.connect(model, all_GIDs,
-                      n_neurons_rec_spike, n_neurons_rec_voltage,
-                      verbose)
-    T_connect   = time.time() - t_connect_0
-
-    ###################################################
-    # Simulate
-    ###################################################
-    print("Simulate")
-    t_simulate_0 = time.time()
-    nest.Simulate(sim.t_sim)
-    T_simulate  = time.time() - t_simulate_0
-   
-     
-    ###################################################
-    # Save recorded data
-    ###################################################
-    print("Save data")
+    n_vp_worker = n_threads_worker * sim.n_mpi_procs
+    data_file.attrs["n_vp"] = n_vp_worker
+    max_grp = -1
     if append_data: 
-        max_grp = 0
         for key in data_file.keys():
             max_grp = max(max_grp, int(key))
-        group_name  = "%i"%(max_grp + 1)  
-    else:
-        group_name  = "%i"%(run_i)  
-    print(group_name)
-    now         = str(datetime.datetime.now())[:-7]
-    grp         = data_file.create_group(group_name)
-    grp.attrs["date_and_time"] = now
-    grp.attrs["master_seed"] = master_seed
-    grp.attrs["C_ab"] = model.C_ab
-
-    t_save_0    = time.time()
-    functions.save_data(grp, all_GIDs, model.populations, n_neurons_rec_spike, n_neurons_rec_voltage)
-    T_save = time.time() - t_save_0
-
-    ###################################################
-    # Save info, set new seed
-    ###################################################
-    print("T_connect    = ", T_connect)
-    print("T_simulate   = ", T_simulate)
-    print("T_save       = ", T_save)
-    grp.attrs["time_to_connect"]    = T_connect
-    grp.attrs["time_to_simulate"]   = T_simulate
-    grp.attrs["time_to_save"]       = T_save
-
-    info_str    = "{0:4d} {1:4.1f} {2:6.1f} {3:8.1f} {4:10.1f} {5:6.1f} {6:4d} {7:11d}  ".format(
-                    run_i, model.area, sim.t_sim*1e-3, 
-                    T_connect, T_simulate, T_save, sim.n_vp, master_seed)
-    info_str += now + "  " + group_name
-    info_file.write(info_str + "\n")
-
-    # save the last seed to file, such that independent realizations are possible
-    last_seed = master_seed + 1 + 2 * sim.n_vp + 2 * model.n_populations - 1  # last -1 since range ends beforehand
-    seed_file.write("{0:6d}".format(last_seed) + "\t\t" + 
-                    now + "\t" + 
-                    os.path.join(file_name, group_name) + "\n")
-    master_seed = last_seed + 1
+    model_kwargs = {"neuron_model": neuron_model, "connection_rule": connection_rule}
+    tasks = []
+    for run_i in range(n_runs):
+        group_name  = "%i"%(max_grp + 1 + run_i)
+        run_id, master_seed = registry.allocate_seeds(n_vp_worker, model.n_populations, 
+                                                      data_file.filename, group_name)
+        if not frozen_network or run_i == 0:
+            connectome_seed = random_streams.connectome_seed(master_seed, n_vp_worker)
+        tasks.append(sweep_functions.make_task(model_kwargs, master_seed, group_name, 
+                                               n_threads_worker, run_id=run_id, 
+                                               connectome_seed=connectome_seed, verbose=verbose))
+
+    sweep_functions.run_sweep(tasks, data_file, n_workers)
+
+else:
+    for run_i in range(n_runs):
+        if resume:  # seeds of the interrupted run
+            grp             = data_file[resume_group_name]
+            group_name      = resume_group_name
+            master_seed     = int(grp.attrs["master_seed"])
+            run_id          = grp.attrs.get("run_id", None)
+            if "connectome_seed" in grp.attrs:
+                connectome_seed = int(grp.attrs["connectome_seed"])
+            if bool(grp.attrs.get("counter_streams", False)) != sim.counter_streams:
+                raise Exception("Resuming requires sim.counter_streams = %s (as for the interrupted run)!"%
+                                bool(grp.attrs.get("counter_streams", False)))
+
+        else:
+            run_id, master_seed = registry.allocate_seeds_rank0(sim.n_vp, model.n_populations, 
+                                                                data_file.filename)
+
+        ######################################################
+        # Prepare simulation
+        ######################################################
+        prof = profiler.profiler(data_file)
+        prof.start("prepare_simulation")
+        pyrngs = functions.prepare_simulation(master_seed, n_populations=model.n_populations)
+        prof.stop()
+
+        ######################################################
+        # Derive parameters
+        ######################################################
+        (n_neurons_rec_spike, n_neurons_rec_voltage) = functions.derive_parameters(model)
+     
+        ######################################################
+        # Create nodes
+        ######################################################
+        print("Create nodes")
+        prof.start("create_nodes")
+        all_GIDs = functions.create_nodes(model, pyrngs)
+        prof.stop()
+
+        ###################################################
+        # Connect
+        ###################################################
+        print("Connect")
+        prof.start("connect")
+        if not (frozen_network and run_i > 0) and not resume:
+            connectome_seed = random_streams.connectome_seed(master_seed, sim.n_vp)
+        if sim.use_connectome_cache:
+            connections = connectome.load_connectome(model, connectome_seed, verbose=verbose,
+                                                     save=distributed.rank() == 0)
+        else:
+            connections = None
+        functions.connect(model, all_GIDs,
+                          n_neurons_rec_spike, n_neurons_rec_voltage,
+                          verbose, connections)
+        T_connect   = prof.stop()
+
+        ###################################################
+        # Create group for recorded data
+        ###################################################
+        now         = str(datetime.datetime.now())[:-7]
+        if resume:
+            grp.attrs["resumed"] = now
+        else:
+            if append_data: 
+                max_grp = 0
+                for key in data_file.keys():
+                    max_grp = max(max_grp, int(key))
+                group_name  = "%i"%(max_grp + 1)  
+            else:
+                group_name  = "%i"%(run_i)  
+            grp         = data_file.create_group(group_name)
+            grp.attrs["date_and_time"] = now
+            grp.attrs["master_seed"] = master_seed
+            grp.attrs["counter_streams"] = sim.counter_streams
+            grp.attrs["run_id"] = run_id
+            grp.attrs["C_ab"] = model.C_ab
+            if sim.use_connectome_cache:
+                grp.attrs["connectome_key"] = connectome.connectome_key(model, connectome_seed)
+                grp.attrs["connectome_seed"] = connectome_seed
+        print(group_name)
+
+        ###################################################
+        # Simulate
+        ###################################################
+        print("Simulate")
+        res_grp = None
+        if sim.online_statistics:
+            res_grp = res_file.create_group(group_name)
+        prof.start("simulate", t_model=sim.t_sim)
+        t_simulated, spikes_saved = functions.run_simulation(grp, model, all_GIDs, n_neurons_rec_spike, 
+                                                             master_seed, resume=resume, res_grp=res_grp)
+        T_simulate  = prof.stop(t_model=t_simulated)
+   
+     
+        ###################################################
+        # Save recorded data
+        ###################################################
+        print("Save data")
+        prof.start("save_data")
+        functions.save_data(grp, all_GIDs, model.populations, n_neurons_rec_spike, n_neurons_rec_voltage, 
+                            save_spikes=not spikes_saved, t_simulated=t_simulated)
+        T_save = prof.stop()
+
+        ###################################################
+        # Save info
+        ###################################################
+        print("T_connect    = ", T_connect)
+        print("T_simulate   = ", T_simulate)
+        print("T_save       = ", T_save)
+        grp.attrs["time_to_connect"]    = T_connect
+        grp.attrs["time_to_simulate"]   = T_simulate
+        grp.attrs["time_to_save"]       = T_save
+        prof.save(grp)
+
+        if not run_id is None and distributed.rank() == 0:
+            registry.record_run(run_id, group_name=group_name, area=model.area, t_sim=t_simulated, 
+                                T_connect=T_connect, T_simulate=T_simulate, T_save=T_save)
     
+
 T_total = time.time() - T0
 print("T_total      = ", T_total)
 data_file.attrs["total_time"]    = T_total
-info_file.write("total time: %.2f\n"%T_total)
 
+data_file_path = data_file.filename
 data_file.close()
-seed_file.close()
-info_file.close()
+if sim.online_statistics:
+    res_file.close()
+if nest.Rank() == 0:
+    registry.catalog_file(data_file_path)  # catalog of all data files
 ####################################################################################
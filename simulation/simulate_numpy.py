@@ -0,0 +1,147 @@
+"""simulate_numpy.py
+
+Repetitive runs for Potjans' model with the NumPy backend (numpy_backend.py),
+no NEST kernel required. Use for small areas only.
+
+Structure:
+instantiate model                   from model_class.py
+initialize_data_file                creates file_name and opens HDF5-file
+
+Loop over n_runs:
+    allocate_seeds                  obtain an independent range of seeds from the registry (registry.py)
+    derive_parameters               calculate number of neurons to record from (spikes and membrane potentials separately)
+    numpy_backend.network           initializes neurons and draws connections
+    network.simulate
+    network.save_data               saves data to HDF5-file (same layout as functions.save_data).
+    record_run                      saves timings etc. of the run to the registry
+
+Naming convention: layer (e.g. L4), type (usually e and i), population (e.g. L4e)
+"""
+from __future__ import print_function
+import numpy as np
+import h5py
+import sys, os, shutil
+import time, datetime
+
+from imp import reload
+import sim_params as sim; reload(sim)
+import functions; reload(functions)
+import model_class; reload(model_class)
+import connectome; reload(connectome)
+import numpy_backend; reload(numpy_backend)
+import registry; reload(registry)
+import profiler; reload(profiler)
+import random_streams; reload(random_streams)
+verbose     = False                     # whether to print every connection made
+
+# ONLY PUT THIS IF YOU DONT WANT TO HAVE A FILE NAME AUTOMATICALLY ASSIGNED
+name    = None
+# whether to append the selected data_file (if it existist, otherwise might cause error!)
+append_data = False
+# whether all runs share the connectome of the first run (only with sim.use_connectome_cache)
+frozen_network = False
+
+#######################################################
+# Instantiate model
+#######################################################
+T0 = time.time()
+# Unchanged parameters
+area            = 0.1
+neuron_model    = "iaf_psc_exp"  # "iaf_psc_delta", "iaf_psc_exp" or "iaf_psc_alpha"
+connection_rule = "fixed_total_number" # "fixed_total_number" or "fixed_indegree"
+model           = model_class.model(area=area,
+                                    neuron_model=neuron_model,
+                                    connection_rule=connection_rule)
+
+#######################################################
+# Create data file
+#######################################################
+sub_path = "numpy"
+data_file, file_name, data_path = functions.initialize_data_file(sub_path, model, verbose, name=name, append=append_data)
+data_file.attrs["backend"]      = "numpy"
+
+#######################################################
+# Looping
+#######################################################
+n_runs = 1
+
+for run_i in range(n_runs):
+    ######################################################
+    # Derive parameters
+    ######################################################
+    (n_neurons_rec_spike, n_neurons_rec_voltage) = functions.derive_parameters(model)
+    run_id, master_seed = registry.allocate_seeds(sim.n_vp, model.n_populations, data_file.filename)
+
+    ###################################################
+    # Create nodes and connect
+    ###################################################
+    print("Connect")
+    prof        = profiler.profiler(data_file)
+    prof.start("connect")
+    if not (frozen_network and run_i > 0):
+        connectome_seed = random_streams.connectome_seed(master_seed, sim.n_vp)
+    if sim.use_connectome_cache:
+        connections = connectome.load_connectome(model, connectome_seed, verbose=verbose)
+    else:
+        connections = None
+    network     = numpy_backend.network(model, master_seed,
+                                        n_neurons_rec_spike, n_neurons_rec_voltage,
+                                        connections, verbose)
+    T_connect   = prof.stop()
+
+    ###################################################
+    # Simulate
+    ###################################################
+    print("Simulate")
+    prof.start("simulate", t_model=sim.t_sim)
+    network.simulate(sim.t_sim, verbose=True)
+    T_simulate  = prof.stop()
+
+    ###################################################
+    # Save recorded data
+    ###################################################
+    print("Save data")
+    if append_data:
+        max_grp = 0
+        for key in data_file.keys():
+            max_grp = max(max_grp, int(key))
+        group_name  = "%i"%(max_grp + 1)
+    else:
+        group_name  = "%i"%(run_i)
+    print(group_name)
+    now         = str(datetime.datetime.now())[:-7]
+    grp         = data_file.create_group(group_name)
+    grp.attrs["date_and_time"] = now
+    grp.attrs["master_seed"] = master_seed
+    grp.attrs["counter_streams"] = sim.counter_streams
+    grp.attrs["run_id"] = run_id
+    grp.attrs["C_ab"] = model.C_ab
+    if sim.use_connectome_cache:
+        grp.attrs["connectome_key"] = connectome.connectome_key(model, connectome_seed)
+
+    prof.start("save_data")
+    network.save_data(grp)
+    T_save = prof.stop()
+
+    ###################################################
+    # Save info
+    ###################################################
+    print("T_connect    = ", T_connect)
+    print("T_simulate   = ", T_simulate)
+    print("T_save       = ", T_save)
+    grp.attrs["time_to_connect"]    = T_connect
+    grp.attrs["time_to_simulate"]   = T_simulate
+    grp.attrs["time_to_save"]       = T_save
+    prof.save(grp)
+
+    registry.record_run(run_id, group_name=group_name, area=model.area, t_sim=sim.t_sim, 
+                        T_connect=T_connect, T_simulate=T_simulate, T_save=T_save)
+
+T_total = time.time() - T0
+print("T_total      = ", T_total)
+data_file.attrs["total_time"]    = T_total
+
+data_file_path = data_file.filename
+data_file.close()
+registry.catalog_file(data_file_path)  # catalog of all data files
+####################################################################################
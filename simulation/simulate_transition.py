@@ -5,20 +5,31 @@ Simulating the transition from Brunel's to Potjans' model.
 Structure:
 instantiate models                  initial and final; from model_class.py
 initialize_data_file                creates file_name and opens HDF5-file
-initialize_seeds                    opens seeds.log and looks for previous master seeds 
-initialize_info_file                opens and initializes info_file, where basic parameters of the simulation are saved in plain text
 
 Loop over distance(*) from Brunel to Potjans:
     new model                       instantiate model at given distance
+    allocate_seeds                  obtain an independent range of seeds from the registry (registry.py; 
+                                    MPI rank 0 only, broadcast to the other ranks)
     prepare_simulation              prepare random generators such that each simulation is independent 
     derive_parameters               calculate number of neurons to record from (spikes and membrane potentials separately)
     create_nodes                    node parameters are set here (incl. membrane potential initialization)
     connect                         synapse parameters are set here
-    nest.simulate
+    nest.simulate                   at once or in slices of sim.t_chunk, streaming spikes to disk (simulate_chunked)
+                                    or until the rates are stationary and precise (sim.adaptive, simulate_adaptive)
     save_data                       saves data to HDF5-file.
+                                    (each phase is profiled: time, memory, NEST statistics; profiler.py)
+    record_run                      saves timings etc. of the run to the registry
 
 (*) distance = L2(Brunel - model) / L2(Brunel - Potjans)
 
+With n_workers > 1, the distances are simulated in parallel worker processes,
+each with its own NEST kernel of n_threads_worker threads (sweep_functions.py).
+
+With warm = True, one network is built for all distances (warm_network.py);
+each distance only sets weights, external input and neuron state (set_model)
+instead of creating nodes and connecting anew. All distances share one
+range of seeds (registry entry "warm").
+
 Naming convention: layer (e.g. L4), type (usually e and i), population (e.g. L4e)
 """
 from __future__ import print_function
@@ -31,9 +42,23 @@ import time, datetime
 from imp import reload
 import sim_params as sim; reload(sim)
 import model_class; reload(model_class)
+import connectome; reload(connectome)
 import functions; reload(functions)
+import sweep_functions; reload(sweep_functions)
+import registry; reload(registry)
+import profiler; reload(profiler)
+import warm_network; reload(warm_network)
+import online_statistics; reload(online_statistics)
+import random_streams; reload(random_streams)
+import distributed; reload(distributed)
 verbose     = True                     # whether to print every connection made
 
+# Number of worker processes simulating distances in parallel. 1: serial, in this process.
+n_workers           = 1
+n_threads_worker    = sim.n_threads_per_proc   # threads of each worker's kernel
+# Build the network once and reuse it for all distances (serial only)
+warm                = False
+
 #######################################################
 # Instantiate model
 #######################################################
@@ -74,8 +99,9 @@ model_micro     = model_class.model(area=area,
 #######################################################
 sub_path = "trans"
 data_file, file_name, data_path = functions.initialize_data_file(sub_path, model_micro, verbose)
-seed_file, master_seed          = functions.initialize_seeds()
-info_file                       = functions.initialize_info_file(file_name, data_path)
+# Statistics of prep_data.py, accumulated while simulating
+if sim.online_statistics:
+    res_file = online_statistics.initialize_result_file(data_file)
 
 
 #######################################################
@@ -91,105 +117,202 @@ n_steps     = int(round(abs(dist_final - dist_init) / step)) + 1
 dists       = np.linspace(dist_init, dist_final, n_steps)
 data_file.attrs["dists"] = dists 
 
-for distance in dists:
-    ######################################################
-    # New model
-    ######################################################
-    area            = (1. - distance) * model_init.area         + distance * model_final.area        
-    n_neurons       = (1. - distance) * model_init.n_neurons    + distance * model_final.n_neurons   
-    C_ab            = (1. - distance) * model_init.C_ab         + distance * model_final.C_ab        
-    j02             = (1. - distance) * model_init.j02          + distance * model_final.j02         
-    g               = (1. - distance) * model_init.g            + distance * model_final.g           
-    rate_ext        = (1. - distance) * model_init.rate_ext     + distance * model_final.rate_ext    
-    weight_rel_sd      = (1. - distance) * model_init.weight_rel_sd   + distance * model_final.weight_rel_sd  
-    delay_rel_sd    = (1. - distance) * model_init.delay_rel_sd + distance * model_final.delay_rel_sd
-    model   = model_class.model(area=area, 
-                                n_neurons=n_neurons, C_ab=C_ab, 
-                                connection_rule="fixed_indegree",
-                                j02=j02, g=g, rate_ext=rate_ext,
-                                weight_rel_sd=weight_rel_sd, 
-                                delay_rel_sd=delay_rel_sd) 
+def interpolate_model(distance):
+    """Parameters of the model at distance between model_init and model_final."""
+    model_kwargs = {"connection_rule": "fixed_indegree"}
+    for key in ("area", "n_neurons", "C_ab", "j02", "g", "rate_ext", "weight_rel_sd", "delay_rel_sd"):
+        model_kwargs[key] = (1. - distance) * getattr(model_init, key) + distance * getattr(model_final, key)
+    return model_kwargs
 
+if n_workers > 1:
     ######################################################
-    # Prepare simulation
+    # Parallel: one task per distance
     ######################################################
-    pyrngs = functions.prepare_simulation(master_seed, n_populations=model.n_populations)
+    n_vp_worker = n_threads_worker * sim.n_mpi_procs
+    data_file.attrs["n_vp"] = n_vp_worker
+    tasks = []
+    for distance in dists:
+        model_kwargs    = interpolate_model(distance)
+        group_name      = "d%.2f_j%.2f_sdJ%.2f"%(distance, model_kwargs["j02"], model_kwargs["weight_rel_sd"])  
+        run_id, master_seed = registry.allocate_seeds(n_vp_worker, model_init.n_populations, 
+                                                      data_file.filename, group_name)
+        tasks.append(sweep_functions.make_task(model_kwargs, master_seed, group_name, n_threads_worker,
+                                               attrs={"distance": distance}, run_id=run_id, verbose=verbose))
+
+    sweep_functions.run_sweep(tasks, data_file, n_workers)
 
+elif warm:
     ######################################################
-    # Derive parameters
+    # Warm: one network for all distances
     ######################################################
-    (n_neurons_rec_spike, n_neurons_rec_voltage) = functions.derive_parameters(model)
+    if not sim.t_chunk is None or sim.adaptive or sim.online_statistics:
+        raise Exception("Warm network does not support t_chunk, adaptive or online_statistics.")
+    models      = [model_class.model(**interpolate_model(distance)) for distance in dists]
+    run_id, master_seed = registry.allocate_seeds_rank0(sim.n_vp, model_init.n_populations, 
+                                                        data_file.filename, "warm")
+    prof = profiler.profiler(data_file)
+    prof.start("prepare_simulation")
+    pyrngs = functions.prepare_simulation(master_seed, n_populations=model_init.n_populations)
+    prof.stop()
+
+    print("Create nodes and connect")
+    prof.start("connect")
+    connectome_seed = random_streams.connectome_seed(master_seed, sim.n_vp)
+    network = warm_network.warm_network(models, pyrngs, np.random.RandomState(connectome_seed), verbose)
+    T_connect   = prof.stop()
+    data_file.attrs["time_to_connect"] = T_connect
+
+    T_simulate  = 0.
+    T_save      = 0.
+    for i, distance in enumerate(dists):
+        model           = models[i]
+        group_name      = "d%.2f_j%.2f_sdJ%.2f"%(distance, model.j02, model.weight_rel_sd)  
+        print(group_name)
+        prof_step = profiler.profiler(data_file)
+        prof_step.start("set_model")
+        t_origin = network.set_model(i, pyrngs)
+        prof_step.stop()
+
+        now         = str(datetime.datetime.now())[:-7]
+        grp         = data_file.create_group(group_name)
+        grp.attrs["date_and_time"] = now
+        grp.attrs["master_seed"] = master_seed
+        grp.attrs["counter_streams"] = sim.counter_streams
+        grp.attrs["run_id"] = run_id
+        grp.attrs["C_ab"] = model.C_ab
+        grp.attrs["distance"] = distance
+        grp.attrs["warm"] = True
+
+        prof_step.start("simulate", t_model=sim.t_sim)
+        nest.Simulate(sim.t_sim)
+        T_simulate += prof_step.stop()
+
+        # Only neurons of this model are recorded
+        n_neurons_rec_spike = np.minimum(functions.derive_parameters(model)[0], network.n_neurons_rec_spike)
+        prof_step.start("save_data")
+        functions.save_data(grp, network.all_GIDs, model.populations, 
+                            n_neurons_rec_spike, network.n_neurons_rec_voltage, t_origin=t_origin)
+        T_save += prof_step.stop()
+        grp.attrs["time_to_simulate"]   = prof_step.wall("simulate")
+        grp.attrs["time_to_save"]       = prof_step.wall("save_data")
+        prof_step.save(grp)
+
+    # JSON only: a group "profile" would be taken for a run by prep_data.py and the catalog
+    prof.save_json(data_file.filename + "_warm.profile.json")
+    if distributed.rank() == 0:
+        registry.record_run(run_id, group_name="warm", area=model_init.area, t_sim=sim.t_sim * len(dists), 
+                            T_connect=T_connect, T_simulate=T_simulate, T_save=T_save)
+
+else:
+    for distance in dists:
+        ######################################################
+        # New model
+        ######################################################
+        model_kwargs    = interpolate_model(distance)
+        area            = model_kwargs["area"]
+        j02             = model_kwargs["j02"]
+        weight_rel_sd   = model_kwargs["weight_rel_sd"]
+        model           = model_class.model(**model_kwargs) 
+        group_name      = "d%.2f_j%.2f_sdJ%.2f"%(distance, j02, weight_rel_sd)  
+        run_id, master_seed = registry.allocate_seeds_rank0(sim.n_vp, model.n_populations, 
+                                                            data_file.filename, group_name)
+
+        ######################################################
+        # Prepare simulation
+        ######################################################
+        prof = profiler.profiler(data_file)
+        prof.start("prepare_simulation")
+        pyrngs = functions.prepare_simulation(master_seed, n_populations=model.n_populations)
+        prof.stop()
+
+        ######################################################
+        # Derive parameters
+        ######################################################
+        (n_neurons_rec_spike, n_neurons_rec_voltage) = functions.derive_parameters(model)
      
-    ######################################################
-    # Create nodes
-    ######################################################
-    print("Create nodes")
-    all_GIDs = functions.create_nodes(model, pyrngs)
-
-    ###################################################
-    # Connect
-    ###################################################
-    print("Connect")
-    t_connect_0 = time.time()
-    functions.connect(model, all_GIDs, 
-                      n_neurons_rec_spike, n_neurons_rec_voltage,
-                      verbose)
-    T_connect   = time.time() - t_connect_0
-
-    ###################################################
-    # Simulate
-    ###################################################
-    print("Simulate")
-    t_simulate_0 = time.time()
-    nest.Simulate(sim.t_sim)
-    T_simulate  = time.time() - t_simulate_0
+        ######################################################
+        # Create nodes
+        ######################################################
+        print("Create nodes")
+        prof.start("create_nodes")
+        all_GIDs = functions.create_nodes(model, pyrngs)
+        prof.stop()
+
+        ###################################################
+        # Connect
+        ###################################################
+        print("Connect")
+        prof.start("connect")
+        connectome_seed = random_streams.connectome_seed(master_seed, sim.n_vp)
+        if sim.use_connectome_cache:
+            connections = connectome.load_connectome(model, connectome_seed, verbose=verbose,
+                                                     save=distributed.rank() == 0)
+        else:
+            connections = None
+        functions.connect(model, all_GIDs, 
+                          n_neurons_rec_spike, n_neurons_rec_voltage,
+                          verbose, connections)
+        T_connect   = prof.stop()
+
+        ###################################################
+        # Create group for recorded data
+        ###################################################
+        print(group_name)
+        now         = str(datetime.datetime.now())[:-7]
+        grp         = data_file.create_group(group_name)
+        grp.attrs["date_and_time"] = now
+        grp.attrs["master_seed"] = master_seed
+        grp.attrs["counter_streams"] = sim.counter_streams
+        grp.attrs["run_id"] = run_id
+        grp.attrs["C_ab"] = model.C_ab
+        if sim.use_connectome_cache:
+            grp.attrs["connectome_key"] = connectome.connectome_key(model, connectome_seed)
+        grp.attrs["distance"] = distance
+
+        ###################################################
+        # Simulate
+        ###################################################
+        print("Simulate")
+        res_grp = None
+        if sim.online_statistics:
+            res_grp = res_file.create_group(group_name)
+        prof.start("simulate", t_model=sim.t_sim)
+        t_simulated, spikes_saved = functions.run_simulation(grp, model, all_GIDs, n_neurons_rec_spike, 
+                                                             master_seed, res_grp=res_grp)
+        T_simulate  = prof.stop(t_model=t_simulated)
     
-    ###################################################
-    # Save recorded data
-    ###################################################
-    print("Save data")
-    group_name  = "d%.2f_j%.2f_sdJ%.2f"%(distance, j02, weight_rel_sd)  
-    print(group_name)
-    now         = str(datetime.datetime.now())[:-7]
-    grp         = data_file.create_group(group_name)
-    grp.attrs["date_and_time"] = now
-    grp.attrs["master_seed"] = master_seed
-    grp.attrs["C_ab"] = model.C_ab
-    grp.attrs["distance"] = distance
-
-    t_save_0    = time.time()
-    functions.save_data(grp, all_GIDs, model.populations, n_neurons_rec_spike, n_neurons_rec_voltage)
-    T_save = time.time() - t_save_0
-
-    ###################################################
-    # Save info, set new seed
-    ###################################################
-    print("T_connect    = ", T_connect)
-    print("T_simulate   = ", T_simulate)
-    print("T_save       = ", T_save)
-    grp.attrs["time_to_connect"]    = T_connect
-    grp.attrs["time_to_simulate"]   = T_simulate
-    grp.attrs["time_to_save"]       = T_save
+        ###################################################
+        # Save recorded data
+        ###################################################
+        print("Save data")
+        prof.start("save_data")
+        functions.save_data(grp, all_GIDs, model.populations, n_neurons_rec_spike, n_neurons_rec_voltage, 
+                            save_spikes=not spikes_saved, t_simulated=t_simulated)
+        T_save = prof.stop()
+
+        ###################################################
+        # Save info
+        ###################################################
+        print("T_connect    = ", T_connect)
+        print("T_simulate   = ", T_simulate)
+        print("T_save       = ", T_save)
+        grp.attrs["time_to_connect"]    = T_connect
+        grp.attrs["time_to_simulate"]   = T_simulate
+        grp.attrs["time_to_save"]       = T_save
+        prof.save(grp)
     
-    info_str    = "{0:4.2f} {1:4.1f} {2:6.1f} {3:8.1f} {4:10.1f} {5:6.1f} {6:4d} {7:11d}  ".format(
-                    distance, area, sim.t_sim*1e-3, 
-                    T_connect, T_simulate, T_save, sim.n_vp, master_seed)
-    info_str += now + "  " + group_name
-    info_file.write(info_str + "\n")
-
-    # save the last seed to file, such that independent realizations are possible
-    last_seed = master_seed + 1 + 2 * sim.n_vp + 2 * model.n_populations - 1  # last -1 since range ends beforehand
-    seed_file.write("{0:6d}".format(last_seed) + "\t\t" + 
-                    now + "\t" + 
-                    os.path.join(file_name, group_name) + "\n")
-    master_seed = last_seed + 1
+        if distributed.rank() == 0:
+            registry.record_run(run_id, group_name=group_name, area=model.area, t_sim=t_simulated, 
+                                T_connect=T_connect, T_simulate=T_simulate, T_save=T_save)
 
 T_total = time.time() - T0
 print("T_total      = ", T_total)
 data_file.attrs["total_time"]    = T_total
-info_file.write("total time: %.2f\n"%T_total)
 
-info_file.close()
-seed_file.close()
+data_file_path = data_file.filename
 data_file.close()
+if sim.online_statistics:
+    res_file.close()
+if nest.Rank() == 0:
+    registry.catalog_file(data_file_path)  # catalog of all data files
 ####################################################################################
@@ -0,0 +1,445 @@
+"""spike_functions.py
+
+Functions for writing spike data to HDF5 files, independent of NEST,
+applied in:
+functions.py
+brunel_functions.py
+text_to_hdf5.py
+text_to_hdf5_append.py
+data_to_npy_functions.py
+
+Spikes are saved per population as
+    times           spike times in units of dt, sorted by neuron and time
+    rec_neuron_i    times_{ith neuron} = times[rec_neuron_i[i]:rec_neuron_i[i+1]]
+
+Text files of NEST/SLI (gdf: GID time, dat: GID time V) are parsed in blocks
+of block_size bytes into NumPy arrays (read_text_file); only the rows after t_trans
+(and of the given GIDs) are kept, such that memory is bounded by the output.
+The files of all virtual processes of a population are parsed in parallel 
+(read_text_files). Membrane potentials are streamed into a preallocated array
+(neuron, time), e.g. a memory mapped .npy file (voltage_layout, fill_voltages).
+
+Contains:
+    to_steps
+    text_file_paths
+    text_blocks
+    read_text_file
+    read_text_files
+    voltage_layout
+    fill_voltages
+    write_voltage_block
+    read_population_GIDs
+    rec_GIDs_sli
+    rec_neuron_index
+    sort_spikes
+    encode_delta
+    decode_delta
+    write_spikes
+    read_spikes
+    write_time_index
+    add_time_index
+    create_stream_file
+    append_spikes
+    finalize_spikes
+    write_checkpoint
+    read_checkpoint
+"""
+from __future__ import print_function
+import numpy as np
+import h5py
+import os
+
+def to_steps(times, dt):
+    """Spike times (ms) in units of dt, rounded to the nearest step."""
+    return np.uint(np.rint(np.asarray(times) / dt))
+
+def text_file_paths(data_path, prefix):
+    """Paths of the files in data_path starting with prefix (e.g. one per virtual process)."""
+    return [os.path.join(data_path, file_name) for file_name in sorted(os.listdir(data_path))
+            if file_name.startswith(prefix)]
+
+def text_blocks(file_path, n_columns, block_size=2**26):
+    """Rows of the text file file_path as arrays (n_rows, n_columns), one per block 
+    of about block_size bytes (ending at a line break), each parsed with one call 
+    of np.fromstring.
+    """
+    rest    = b""
+    with open(file_path, "rb") as text_file:
+        while True:
+            block   = text_file.read(block_size)
+            if len(block) == 0:
+                block, rest = rest, b""
+            else:
+                block   = rest + block
+                end     = block.rfind(b"\n") + 1
+                if end == 0:        # no line break yet
+                    rest = block
+                    continue
+                block, rest = block[:end], block[end:]
+            if len(block) == 0:
+                break
+            values  = np.fromstring(block.decode("ascii"), sep=" ")
+            if len(values) % n_columns != 0:
+                raise Exception("Unexpected number of columns in " + file_path)
+            yield values.reshape(-1, n_columns)
+
+def read_text_file(file_path, n_columns, t_trans=None, GIDs=None, block_size=2**26):
+    """Rows (GID, time, ...) of the text file file_path as array (n_rows, n_columns).
+
+    Only rows with time >= t_trans (ms) and GID in GIDs are kept (if given), 
+    block by block (text_blocks).
+    """
+    if not GIDs is None:
+        GIDs = np.unique(GIDs)
+    rows    = []
+    for values in text_blocks(file_path, n_columns, block_size):
+        keep    = np.ones(len(values), dtype=bool)
+        if not t_trans is None:
+            keep &= values[:, 1] >= t_trans
+        if not GIDs is None:
+            keep &= np.isin(values[:, 0], GIDs)
+        rows.append(values[keep])
+    if len(rows) == 0:
+        return np.zeros((0, n_columns))
+    return np.concatenate(rows)
+
+def _read_text_file(args):
+    return read_text_file(*args)
+
+def read_text_files(file_paths, n_columns, t_trans=None, GIDs=None, n_processes=None):
+    """Rows of all files (read_text_file), parsed in n_processes parallel processes
+    (default: one per file, at most the number of CPUs).
+    """
+    import multiprocessing
+    if n_processes is None:
+        n_processes = min(len(file_paths), multiprocessing.cpu_count())
+    tasks = [(file_path, n_columns, t_trans, GIDs) for file_path in file_paths]
+    if n_processes > 1:
+        pool = multiprocessing.Pool(n_processes)
+        try:
+            rows = pool.map(_read_text_file, tasks, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        rows = [_read_text_file(task) for task in tasks]
+    if len(rows) == 0:
+        return np.zeros((0, n_columns))
+    return np.concatenate(rows)
+
+def voltage_layout(file_paths, t_trans, head_size=2**20):
+    """GIDs (sorted) and times (ms, >= t_trans) of the membrane potentials of 
+    the multimeter files file_paths (lines: GID time V, sorted by time, all GIDs 
+    of a file at each time), from the first head_size bytes and the last line of each file.
+    """
+    GIDs        = []
+    t_first     = []
+    t_last      = []
+    dts         = []
+    for file_path in file_paths:
+        with open(file_path, "rb") as text_file:
+            head    = text_file.read(head_size)
+            head    = head[:head.rfind(b"\n") + 1]
+            if len(head) == 0:
+                continue
+            text_file.seek(max(os.path.getsize(file_path) - 1024, 0))
+            tail    = text_file.read().rstrip(b"\n").split(b"\n")[-1]
+        values  = np.fromstring(head.decode("ascii"), sep=" ").reshape(-1, 3)
+        GIDs.append(values[values[:, 1] == values[0, 1], 0])
+        t_first.append(values[0, 1])
+        t_last.append(float(tail.split()[1]))
+        times   = np.unique(values[:, 1])
+        if len(times) > 1:
+            dts.append(times[1] - times[0])
+    if len(dts) == 0:
+        raise Exception("No membrane potentials at more than one time in " + str(file_paths))
+    dt      = min(dts)
+    t_start = min(t_first)
+    t_start += max(np.ceil((t_trans - t_start) / dt - 1e-6), 0) * dt    # first time >= t_trans
+    n_times = int(np.rint((max(t_last) - t_start) / dt)) + 1
+    return np.unique(np.concatenate(GIDs)), t_start + np.arange(n_times) * dt
+
+def fill_voltages(Vs, file_paths, GIDs, times, block_size=2**26):
+    """Write the membrane potentials of file_paths to Vs[neuron, time index] 
+    (array, memory mapped array or HDF5 dataset of shape (len(GIDs), len(times))),
+    block by block: at most one block of each file is held in memory.
+    """
+    dt  = times[1] - times[0]
+    for file_path in file_paths:
+        carry   = np.zeros((0, 3))
+        for values in text_blocks(file_path, 3, block_size):
+            values  = np.concatenate((carry, values))
+            columns = np.int_(np.rint((values[:, 1] - times[0]) / dt))
+            # The last time of a block may continue in the next one
+            last    = columns == columns[-1]
+            carry, values, columns = values[last], values[~last], columns[~last]
+            write_voltage_block(Vs, GIDs, values, columns)
+        if len(carry) > 0:
+            write_voltage_block(Vs, GIDs, carry, np.int_(np.rint((carry[:, 1] - times[0]) / dt)))
+
+def write_voltage_block(Vs, GIDs, values, columns):
+    """Write the rows (GID, time, V) at columns (time indices) to Vs.
+    Raises if a GID is not in GIDs (the layout of voltage_layout).
+    """
+    keep    = (columns >= 0) & (columns < Vs.shape[1])
+    values, columns = values[keep], columns[keep]
+    if len(values) == 0:
+        return
+    block_GIDs  = np.unique(values[:, 0])
+    rows        = np.searchsorted(GIDs, block_GIDs)
+    if np.any(rows >= len(GIDs)) or not np.all(GIDs[np.minimum(rows, len(GIDs) - 1)] == block_GIDs):
+        raise Exception("GIDs %s are not in the layout (first time step of each voltage file)!"%
+                        block_GIDs[np.isin(block_GIDs, GIDs, invert=True)][:10])
+    first       = columns.min()
+    block       = np.full((len(block_GIDs), columns.max() - first + 1), np.nan, dtype=Vs.dtype)
+    block[np.searchsorted(block_GIDs, values[:, 0]), columns - first] = values[:, 2]
+    if np.all(np.diff(rows) == 1):
+        Vs[rows[0]:rows[-1] + 1, first:first + block.shape[1]] = block
+    else:
+        Vs[rows.tolist(), first:first + block.shape[1]] = block
+
+def read_population_GIDs(file_path):
+    """Read first and last GID of each population from the file written 
+    by the sli simulation (GID_filename, e.g. population_GIDs.dat).
+
+    Returns array of shape (n_populations, 2).
+    """
+    return np.loadtxt(file_path, dtype=int, ndmin=2)
+
+def rec_GIDs_sli(data_path, pop_id, n_neurons_rec, senders, GID_filename="population_GIDs.dat"):
+    """GIDs of the recorded neurons of population pop_id in the sli simulation
+    (the first n_neurons_rec neurons of each population).
+
+    If GID_filename is missing in data_path, the smallest sender is taken as 
+    first GID, which is wrong if the first neuron never fired.
+    """
+    file_path = os.path.join(data_path, GID_filename)
+    if os.path.exists(file_path):
+        first_GID = read_population_GIDs(file_path)[pop_id, 0]
+    elif len(senders) > 0:
+        print("Warning: " + file_path + " not found, first GID taken from spikes.")
+        first_GID = np.min(senders)
+    else:
+        first_GID = 1 
+    return np.arange(first_GID, first_GID + n_neurons_rec)
+
+def rec_neuron_index(senders, rec_GIDs):
+    """Index of each sender in rec_GIDs, for the senders which are recorded.
+
+    Returns neuron_i (index, for the recorded senders only) and the mask recorded.
+    """
+    rec_GIDs    = np.asarray(rec_GIDs)
+    senders     = np.asarray(senders)
+    GID_order   = np.argsort(rec_GIDs)
+    sorted_GIDs = rec_GIDs[GID_order]
+    index       = np.minimum(np.searchsorted(sorted_GIDs, senders), max(len(rec_GIDs) - 1, 0))
+    recorded    = np.zeros(len(index), dtype=bool)
+    if len(rec_GIDs) > 0:
+        recorded = sorted_GIDs[index] == senders    # drop spikes of other neurons
+    return GID_order[index[recorded]], recorded
+
+def sort_spikes(senders, times, rec_GIDs, n_neurons_rec=None):
+    """Sort spikes by neuron and time.
+
+    One lexsort on (neuron, time) and one bincount for the offsets. Neurons are 
+    identified by their GID, thus spikes are correctly attributed even if 
+    some recorded neurons did not fire at all.
+
+    rec_GIDs: GIDs of the recorded neurons, in the order of the output.
+    n_neurons_rec: length of rec_neuron_i - 1, if larger than len(rec_GIDs)
+        (populations smaller than n_neurons_rec_spike).
+    Returns sorted_times and rec_neuron_i, such that
+        times_{ith neuron} = sorted_times[rec_neuron_i[i]:rec_neuron_i[i+1]]
+    """
+    if n_neurons_rec is None:
+        n_neurons_rec = len(rec_GIDs)
+    n_neurons_rec = max(n_neurons_rec, len(rec_GIDs))
+    neuron_i, recorded = rec_neuron_index(senders, rec_GIDs)
+    times       = np.asarray(times)[recorded]
+    order       = np.lexsort((times, neuron_i))
+    rec_neuron_i        = np.zeros(n_neurons_rec + 1)
+    rec_neuron_i[1:]    = np.cumsum(np.bincount(neuron_i, minlength=n_neurons_rec))
+    return times[order], rec_neuron_i
+
+def encode_delta(sorted_times, rec_neuron_i):
+    """Times (units of dt) as differences to the previous spike of the same neuron
+    (first spike of each neuron: absolute), as uint32.
+    """
+    times   = np.asarray(sorted_times, dtype=np.int64)
+    if len(times) > 0 and (times.max() >= 2**32 or times.min() < 0):
+        raise Exception("Spike times exceed the range of uint32 ticks!")
+    deltas      = times.copy()
+    deltas[1:] -= times[:-1]
+    starts      = np.int_(rec_neuron_i[:-1])[np.diff(rec_neuron_i) > 0]
+    deltas[starts] = times[starts]
+    return deltas.astype(np.uint32)
+
+def decode_delta(deltas, rec_neuron_i):
+    """Absolute times of delta-encoded times (encode_delta)."""
+    rec_neuron_i    = np.int_(rec_neuron_i)
+    cumulated       = np.cumsum(deltas, dtype=np.uint64)
+    before          = np.append(np.uint64(0), cumulated)[rec_neuron_i[:-1]]  # sum before each neuron
+    return cumulated - np.repeat(before, np.diff(rec_neuron_i))
+
+def write_spikes(spikes_subgrp, sorted_times, rec_neuron_i, spike_format="plain"):
+    """Save sorted spike times and indices to the group of one population.
+
+    spike_format:
+        "plain"     times as given, contiguous (can be memory mapped, spike_store.py)
+        "delta"     times delta-encoded per neuron as uint32 (encode_delta), chunked 
+                    with shuffle and lzf; rec_neuron_i as int64. 
+                    Attribute "encoding" of times. Read with read_spikes.
+    """
+    if spike_format == "delta":
+        deltas      = encode_delta(sorted_times, rec_neuron_i)
+        if len(deltas) == 0:
+            deltas  = np.zeros(1, dtype=np.uint32)
+        dset_times  = spikes_subgrp.create_dataset("times", data=deltas, chunks=(min(len(deltas), 2**16),),
+                                                   shuffle=True, compression="lzf")
+        dset_times.attrs["encoding"] = "delta"
+        dset_indices    = spikes_subgrp.create_dataset("rec_neuron_i", data=np.int64(rec_neuron_i))
+    elif spike_format == "plain":
+        if len(sorted_times) > 0:
+            dset_times  = spikes_subgrp.create_dataset("times", data=sorted_times)
+        else:
+            dset_times  = spikes_subgrp.create_dataset("times", data=np.array([0]))
+        dset_indices    = spikes_subgrp.create_dataset("rec_neuron_i", data=rec_neuron_i)
+    else:
+        raise Exception("Unknown spike_format " + spike_format)
+
+def read_spikes(pop_grp):
+    """Sorted times (units of dt) and rec_neuron_i of one population,
+    decoded if saved with spike_format "delta".
+    """
+    rec_neuron_i    = np.int_(pop_grp["rec_neuron_i"][:])
+    times           = pop_grp["times"][:rec_neuron_i[-1]]
+    if pop_grp["times"].attrs.get("encoding", "plain") == "delta":
+        times       = decode_delta(times, rec_neuron_i)
+    return times, rec_neuron_i
+
+def write_time_index(pop_grp, t_bucket):
+    """Time-ordered companion of the spikes of pop_grp for window queries
+    (spike_store.population_spikes.window), in the group 'time_index':
+        times       all spike times (units of dt) sorted by time
+        neurons     index of the recorded neuron of each spike
+        bucket_i    bucket_i[k] = first spike with time >= k * t_bucket (units of dt)
+    """
+    times, rec_neuron_i = read_spikes(pop_grp)
+    neurons         = np.repeat(np.arange(len(rec_neuron_i) - 1, dtype=np.uint32), np.diff(rec_neuron_i))
+    order           = np.argsort(times, kind="mergesort")
+    times, neurons  = times[order], neurons[order]
+    t_max           = times[-1] if len(times) > 0 else 0
+    bucket_i        = np.searchsorted(times, np.arange(int(t_max // t_bucket) + 2) * t_bucket)
+
+    index_grp = pop_grp.create_group("time_index")
+    index_grp.attrs["t_bucket"] = t_bucket
+    index_grp.create_dataset("times", data=times, dtype=pop_grp["times"].dtype)
+    index_grp.create_dataset("neurons", data=neurons)
+    index_grp.create_dataset("bucket_i", data=np.int64(bucket_i))
+
+def add_time_index(spikes_grp, t_bucket):
+    """write_time_index for each population of spikes_grp not yet indexed
+    (t_bucket in ms).
+    """
+    t_bucket = max(int(round(t_bucket / spikes_grp.attrs["dt"])), 1)
+    for population in spikes_grp:
+        if not "time_index" in spikes_grp[population]:
+            write_time_index(spikes_grp[population], t_bucket)
+
+def create_stream_file(file_path, populations, chunk_size=2**16):
+    """Create HDF5 file with one group per population, containing extendable
+    datasets 'senders' and 'times' (in units of dt) for streaming spike data.
+    """
+    stream_file = h5py.File(file_path, "w")
+    for population in populations:
+        pop_grp = stream_file.create_group(population)
+        pop_grp.create_dataset("senders", shape=(0,), maxshape=(None,),
+                               chunks=(chunk_size,), dtype=np.int64)
+        pop_grp.create_dataset("times", shape=(0,), maxshape=(None,),
+                               chunks=(chunk_size,), dtype=np.uint64)
+    return stream_file
+
+def append_spikes(pop_grp, senders, times):
+    """Append spikes (times in units of dt) to the datasets of pop_grp."""
+    n_old   = len(pop_grp["senders"])
+    n_new   = n_old + len(senders)
+    for name, data in (("senders", senders), ("times", times)):
+        pop_grp[name].resize((n_new,))
+        pop_grp[name][n_old:n_new] = data
+
+def finalize_spikes(stream_file, spikes_grp, populations, rec_GIDs_all, n_neurons_rec_spike,
+                    spike_format="plain"):
+    """Sort the streamed spikes of each population and save them to spikes_grp
+    (write_spikes with spike_format).
+    Checkpoints in the stream file are dropped with it.
+
+    Only one population is held in memory at once.
+    The stream file is closed and deleted afterwards.
+    """
+    for j, population in enumerate(populations):
+        senders = stream_file[population]["senders"][:]
+        times   = stream_file[population]["times"][:]
+        sorted_times, rec_neuron_i = sort_spikes(senders, times, rec_GIDs_all[j], 
+                                                 n_neurons_rec_spike[j])
+        write_spikes(spikes_grp.create_group(population), sorted_times, rec_neuron_i, spike_format)
+    file_path = stream_file.filename
+    stream_file.close()
+    os.remove(file_path)
+
+def write_checkpoint(stream_file, populations, keys, states, t_elapsed, seeds):
+    """Save a checkpoint to stream_file.
+
+    keys:   names of the state variables
+    states: one tuple (GIDs, values[neuron, key]) per population
+    seeds:  dictionary of seed bookkeeping (master_seed, n_vp, ...)
+    Two slots are used alternately, such that a crash while writing 
+    leaves the previous checkpoint intact.
+    """
+    slots = [stream_file.require_group("checkpoint_%i"%i) for i in range(2)]
+    t_slots = [slot.attrs.get("t_elapsed", -1.) if slot.attrs.get("complete", False) else -1.
+               for slot in slots]
+    checkpoint = slots[int(np.argmin(t_slots))]   # overwrite the older one
+    checkpoint.attrs["complete"] = False
+    stream_file.flush()
+    for j, population in enumerate(populations):
+        GIDs, values = states[j]
+        pop_grp = checkpoint.require_group(population)
+        for name, data in (("GIDs", GIDs), ("state", values)):
+            if name in pop_grp and pop_grp[name].shape == data.shape:
+                pop_grp[name][...] = data   # overwrite in place, no new space in file
+            else:
+                if name in pop_grp:
+                    del pop_grp[name]
+                pop_grp.create_dataset(name, data=data)
+        pop_grp.attrs["n_spikes"] = len(stream_file[population]["senders"])
+    checkpoint.attrs["keys"]        = [str(key) for key in keys]
+    checkpoint.attrs["t_elapsed"]   = t_elapsed
+    for name, value in seeds.items():
+        checkpoint.attrs[name]      = value
+    checkpoint.attrs["complete"]    = True
+    stream_file.flush()
+
+def read_checkpoint(stream_file, populations):
+    """Read the latest complete checkpoint of stream_file and truncate the streamed 
+    spikes to the state at the checkpoint.
+
+    Returns dictionary with t_elapsed, seeds, keys, states (as for write_checkpoint).
+    """
+    checkpoints = [stream_file[name] for name in ("checkpoint_0", "checkpoint_1") 
+                   if name in stream_file and stream_file[name].attrs.get("complete", False)]
+    if len(checkpoints) == 0:
+        raise Exception("No complete checkpoint in " + stream_file.filename)
+    checkpoint = max(checkpoints, key=lambda ckpt: ckpt.attrs["t_elapsed"])
+    seeds = dict((name, checkpoint.attrs[name]) for name in checkpoint.attrs 
+                 if not name in ("complete", "keys", "t_elapsed"))
+    states = []
+    for population in populations:
+        pop_grp = checkpoint[population]
+        states.append((pop_grp["GIDs"][:], pop_grp["state"][:]))
+        n_spikes = pop_grp.attrs["n_spikes"]
+        for name in ("senders", "times"):
+            stream_file[population][name].resize((n_spikes,))
+    return {"t_elapsed":    float(checkpoint.attrs["t_elapsed"]), 
+            "seeds":        seeds, 
+            "keys":         [str(key) for key in checkpoint.attrs["keys"]],
+            "states":       states}
@@ -0,0 +1,206 @@
+"""spike_store.py
+
+Lazy access to stored spikes,
+applied in:
+analysis/prep_data.py
+analysis/spontaneous_activity.py
+analysis/first_steps.py
+
+Spikes of each population are stored as
+    times           sorted by recorded neuron and time
+    rec_neuron_i    offsets: times_{ith neuron} = times[rec_neuron_i[i]:rec_neuron_i[i+1]]
+either in the spikes group of a data file (times in units of dt, functions.save_data)
+or as times_<population>.npy, n_GIDs_<population>.npy (times in ms, analysis/data_to_npy.py).
+Contiguous uncompressed datasets and .npy files are memory mapped: opening a
+store reads only the offsets, and each neuron is a view of the mapped times,
+such that only the pages actually used are read. Other datasets (chunked,
+compressed or virtual) are read per neuron through h5py.
+Times are converted (to ms or s) only for the requested neuron. Delta-encoded
+times (sim.spike_format = "delta") are decoded per neuron as well.
+
+Windows of spikes (spikes_in_window) are found by binary search in the 
+time-ordered index of a population (spike_functions.write_time_index, 
+sim.spike_time_index): only the two bucket offsets and the spikes within 
+the window are read. Without index, all spikes of the population are scanned.
+
+Contains:
+    memory_map
+    class spike_store
+        populations
+        __getitem__
+        spikes_in_window
+        close
+    class population_spikes
+        n_spikes
+        neuron
+        window
+        __iter__
+"""
+from __future__ import print_function
+import numpy as np
+import h5py
+import os
+# Import specific moduls
+from imp import reload
+import spike_functions; reload(spike_functions)
+
+def memory_map(dset):
+    """Read-only memory map of the HDF5 dataset dset, or dset itself
+    if it is not stored contiguously in its file (chunked, compressed, virtual).
+    """
+    if not dset.chunks is None or dset.is_virtual or not dset.compression is None:
+        return dset
+    if dset.size == 0:
+        return np.zeros(dset.shape, dtype=dset.dtype)
+    offset = dset.id.get_offset()
+    if offset is None:  # not allocated
+        return dset
+    return np.memmap(dset.file.filename, dtype=dset.dtype, mode="r",
+                     offset=offset, shape=dset.shape)
+
+class spike_store:
+    def __init__(self, source, group="spikes"):
+        """Spikes of source: a spikes group of a data file, the path of a data file
+        (with the spikes group group, e.g. "0/spikes") or a directory of .npy files.
+        """
+        self.file = None
+        if isinstance(source, h5py.Group):
+            self.grp        = source
+        elif os.path.isdir(source):
+            self.grp        = None
+            self.npy_path   = source
+        else:
+            self.file       = h5py.File(source, "r")
+            self.grp        = self.file[group]
+        if self.grp is None:
+            self.ms_per_unit = 1.           # times in ms
+        else:
+            self.ms_per_unit = self.grp.attrs["dt"] # times in units of dt
+        self._populations = {}
+
+    def populations(self):
+        """Names of the stored populations."""
+        if self.grp is None:
+            prefix = "times_"
+            return sorted(file_name[len(prefix):-len(".npy")] for file_name in os.listdir(self.npy_path)
+                          if file_name.startswith(prefix) and file_name.endswith(".npy"))
+        return [population for population in self.grp if "times" in self.grp[population]]
+
+    def __getitem__(self, population):
+        """population_spikes of population (opened once)."""
+        population = str(population)
+        if not population in self._populations:
+            time_index, delta = None, False
+            if self.grp is None:
+                times           = np.load(os.path.join(self.npy_path, "times_" + population + ".npy"),
+                                          mmap_mode="r")
+                rec_neuron_i    = np.load(os.path.join(self.npy_path, "n_GIDs_" + population + ".npy"))
+            else:
+                pop_grp         = self.grp[population]
+                times           = memory_map(pop_grp["times"])
+                rec_neuron_i    = pop_grp["rec_neuron_i"][:]
+                delta           = pop_grp["times"].attrs.get("encoding", "plain") == "delta"
+                if "time_index" in pop_grp:
+                    index_grp   = pop_grp["time_index"]
+                    time_index  = (memory_map(index_grp["times"]), memory_map(index_grp["neurons"]),
+                                   memory_map(index_grp["bucket_i"]), index_grp.attrs["t_bucket"])
+            self._populations[population] = population_spikes(times, rec_neuron_i, self.ms_per_unit,
+                                                              time_index, delta)
+        return self._populations[population]
+
+    def spikes_in_window(self, population, t0, t1, unit="s"):
+        """Spikes of population with t0 <= time < t1 (in unit), sorted by time.
+        Returns times (unit) and the index of the recorded neuron of each spike.
+        """
+        return self[population].window(t0, t1, unit)
+
+    def close(self):
+        """Close the data file if opened by the store."""
+        self._populations = {}
+        if not self.file is None:
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+class population_spikes:
+    def __init__(self, times, rec_neuron_i, ms_per_unit, time_index=None, delta=False):
+        """Spikes of the recorded neurons of one population.
+        times: memory mapped array or HDF5 dataset (units: ms_per_unit ms)
+        time_index: (times, neurons, bucket_i, t_bucket) of spike_functions.write_time_index
+        delta: whether times are delta-encoded (spike_functions.encode_delta)
+        """
+        self.times          = times
+        self.rec_neuron_i   = np.int_(rec_neuron_i)
+        self.ms_per_unit    = ms_per_unit
+        self.n_neurons      = len(self.rec_neuron_i) - 1
+        self.time_index     = time_index
+        self.delta          = delta
+
+    def _unit(self, unit):
+        """Size of the stored units in unit."""
+        if unit == "raw":
+            return 1.
+        elif unit == "ms":
+            return self.ms_per_unit
+        elif unit == "s":
+            return self.ms_per_unit * 1e-3
+        else:
+            raise Exception("Unknown unit " + unit)
+
+    def __len__(self):
+        return self.n_neurons
+
+    def n_spikes(self):
+        """Number of spikes of each recorded neuron."""
+        return np.diff(self.rec_neuron_i)
+
+    def neuron(self, i, unit="s"):
+        """Spike times of the ith recorded neuron in unit "s", "ms" or "raw"
+        (as stored; a view without copy for memory mapped times).
+        """
+        times = self.times[self.rec_neuron_i[i]:self.rec_neuron_i[i + 1]]
+        if self.delta:
+            times = np.cumsum(times, dtype=np.uint64)
+        if unit == "raw":
+            return times
+        return times * self._unit(unit)
+
+    def window(self, t0, t1, unit="s"):
+        """Spike times (unit) with t0 <= time < t1, sorted by time,
+        and the index of the recorded neuron of each spike.
+        """
+        scale   = self._unit(unit)
+        t0, t1  = t0 / scale, t1 / scale    # stored units
+        if self.time_index is None:
+            n_spikes    = self.rec_neuron_i[-1]
+            times       = np.asarray(self.times[:n_spikes])
+            if self.delta:
+                times   = spike_functions.decode_delta(times, self.rec_neuron_i)
+            neurons     = np.repeat(np.arange(self.n_neurons), np.diff(self.rec_neuron_i))
+            in_window   = (times >= t0) & (times < t1)
+            order       = np.argsort(times[in_window], kind="mergesort")
+            times, neurons = times[in_window][order], neurons[in_window][order]
+        else:
+            index_times, index_neurons, bucket_i, t_bucket = self.time_index
+            # Buckets containing the window, then binary search within
+            n_buckets   = len(bucket_i) - 1
+            k0          = int(min(max(t0 // t_bucket, 0), n_buckets))
+            k1          = int(min(max(t1 // t_bucket + 1, 0), n_buckets))
+            i0, i1      = int(bucket_i[k0]), int(bucket_i[k1])
+            times       = np.asarray(index_times[i0:i1])
+            first       = np.searchsorted(times, t0, side="left")
+            last        = np.searchsorted(times, t1, side="left")
+            times       = times[first:last]
+            neurons     = np.asarray(index_neurons[i0 + first:i0 + last])
+        if unit == "raw":
+            return times, neurons
+        return times * scale, neurons
+
+    def __iter__(self):
+        """Spike times (s) of each recorded neuron."""
+        for i in range(self.n_neurons):
+            yield self.neuron(i)
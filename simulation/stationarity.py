@@ -0,0 +1,129 @@
+"""stationarity.py
+
+Online detection of the end of the transient and of converged statistics,
+applied in:
+functions.py    (simulate_adaptive)
+
+The network is simulated in windows of t_window. After each window,
+stationarity_monitor.end_window decides:
+    transient   ends when the spike counts of each population in the last
+                n_windows_stable windows differ from those of the n_windows_stable
+                windows before by less than drift_z standard errors (Poisson),
+                or at t_trans_max.
+    measurement ends when the 95% confidence interval of each population rate
+                (batch means over batches of t_batch) is narrower than
+                +- rel_precision * rate, but not before t_measure_min;
+                at the latest after t_measure_max.
+During the measurement, all statistics of prep_data.py are accumulated
+(statistics: online_statistics.spike_statistics).
+
+Contains:
+    class stationarity_monitor
+        add_spikes
+        end_window
+        rates
+        rates_ci
+        cv_isi
+"""
+from __future__ import print_function
+import numpy as np
+from scipy.stats import t as student_t
+# Import specific moduls
+from imp import reload
+import online_statistics; reload(online_statistics)
+
+class stationarity_monitor:
+    def __init__(self, n_neurons_rec, t_window, n_windows_stable, drift_z, t_trans_max,
+                 t_batch, rel_precision, t_measure_min, t_measure_max):
+        """Monitor of the spikes of n_neurons_rec[j] neurons of each population j.
+        Times in ms.
+        """
+        self.n_neurons_rec      = np.array(n_neurons_rec)
+        self.n_populations      = len(n_neurons_rec)
+        self.t_window           = t_window
+        self.n_windows_stable   = n_windows_stable
+        self.drift_z            = drift_z
+        self.t_trans_max        = t_trans_max
+        self.t_batch            = t_batch
+        self.rel_precision      = rel_precision
+        self.t_measure_min      = t_measure_min
+        self.t_measure_max      = t_measure_max
+
+        self.t                  = 0.            # end of the last window
+        self.t_trans            = None          # set at the end of the transient
+        self.t_measure          = 0.
+        self.converged          = False
+        self.window_counts      = []            # spikes per population and window (transient)
+        self.counts             = np.zeros(self.n_populations)  # spikes of the current window
+        self.batch_counts       = []            # spikes per population and batch (measurement)
+        self.batch_count        = np.zeros(self.n_populations)
+        self.t_batch_start      = None
+        self.statistics         = None          # spike_statistics of the measurement
+
+    @property
+    def in_transient(self):
+        return self.t_trans is None
+
+    def add_spikes(self, pop_index, neuron_index, times):
+        """Spikes of the current window: index of the recorded neuron and time (ms)."""
+        self.counts[pop_index] += len(times)
+        if not self.in_transient:
+            self.statistics.add_spikes(pop_index, neuron_index, times)
+
+    def end_window(self, t):
+        """Close the window ending at time t (ms). Returns True if the run is done."""
+        self.t = t
+        if self.in_transient:
+            self.window_counts.append(self.counts.copy())
+            n = self.n_windows_stable
+            if len(self.window_counts) >= 2 * n:
+                before  = np.sum(self.window_counts[-2 * n:-n], axis=0)
+                after   = np.sum(self.window_counts[-n:], axis=0)
+                drift   = np.abs(after - before) / np.sqrt(np.maximum(after + before, 1.))
+                stable  = np.all(drift < self.drift_z)
+            else:
+                stable  = False
+            if stable or t >= self.t_trans_max:
+                self.t_trans        = t
+                self.t_batch_start  = t
+                self.statistics     = online_statistics.spike_statistics(self.n_neurons_rec, t, 
+                                                                         t + self.t_measure_max)
+        else:
+            self.batch_count   += self.counts
+            self.t_measure      = t - self.t_trans
+            if t - self.t_batch_start >= self.t_batch - 1e-9:
+                self.batch_counts.append(self.batch_count)
+                self.batch_count    = np.zeros(self.n_populations)
+                self.t_batch_start  = t
+                if self.t_measure >= self.t_measure_min - 1e-9 and len(self.batch_counts) > 1:
+                    self.converged  = np.all(self.rates_ci() <= self.rel_precision * self.rates())
+        self.counts = np.zeros(self.n_populations)
+        if self.in_transient:
+            return False
+        return self.converged or self.t_measure >= self.t_measure_max - 1e-9
+
+    def rates(self):
+        """Population rates (Hz) of the completed batches."""
+        if len(self.batch_counts) == 0:
+            return np.zeros(self.n_populations)
+        t_batches = len(self.batch_counts) * self.t_batch * 1e-3    # s
+        return np.sum(self.batch_counts, axis=0) / (self.n_neurons_rec * t_batches)
+
+    def rates_ci(self):
+        """Half width (Hz) of the 95% confidence interval of the population rates."""
+        n_batches = len(self.batch_counts)
+        if n_batches < 2:
+            return np.inf * np.ones(self.n_populations)
+        batch_rates = np.array(self.batch_counts) / (self.n_neurons_rec * self.t_batch * 1e-3)
+        return student_t.ppf(0.975, n_batches - 1) * np.std(batch_rates, axis=0, ddof=1) / np.sqrt(n_batches)
+
+    def cv_isi(self):
+        """Mean CV of ISIs of each population (neurons with more than 2 spikes)."""
+        cv_isi = np.zeros(self.n_populations)
+        if self.statistics is None:
+            return cv_isi
+        for j in range(self.n_populations):
+            cv_isi_all = self.statistics.cv_isi(j)
+            if len(cv_isi_all) > 0:
+                cv_isi[j] = np.mean(cv_isi_all)
+        return cv_isi
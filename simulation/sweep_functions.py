@@ -0,0 +1,196 @@
+"""sweep_functions.py
+
+Run independent simulations in parallel worker processes,
+applied in:
+simulate_microcircuit.py    (runs)
+simulate_transition.py      (distances)
+
+Each task is run by a separate python process (this file, called as script)
+which owns a NEST kernel with n_threads threads. The worker saves its run to
+a HDF5 file of its own. When all tasks are done, the groups are copied
+to the data file, such that the usual file/group layout results.
+
+Contains:
+    make_task
+    run_task
+    run_sweep
+    result_path
+    merge_worker_files
+"""
+from __future__ import print_function
+import numpy as np
+import h5py
+import sys, os, shutil
+import pickle
+import subprocess
+import time, datetime
+from multiprocessing.pool import ThreadPool
+# Import specific moduls
+from imp import reload
+import sim_params as sim; reload(sim)
+import model_class; reload(model_class)
+import connectome; reload(connectome)
+import functions; reload(functions)
+import registry; reload(registry)
+import profiler; reload(profiler)
+import online_statistics; reload(online_statistics)
+import random_streams; reload(random_streams)
+
+def make_task(model_kwargs, master_seed, group_name, n_threads,
+              attrs={}, run_id=None, connectome_seed=None, verbose=False):
+    """Task for run_task: one simulation of model_class.model(**model_kwargs).
+
+    attrs:  additional attributes of the group (e.g. the distance)
+    run_id: of the registry entry of master_seed (registry.allocate_seeds)
+    connectome_seed: defaults to random_streams.connectome_seed(master_seed, n_vp)
+    """
+    return {"model_kwargs":     model_kwargs,
+            "master_seed":      master_seed,
+            "group_name":       group_name,
+            "n_threads":        n_threads,
+            "attrs":            attrs,
+            "run_id":           run_id,
+            "connectome_seed":  connectome_seed,
+            "verbose":          verbose}
+
+def run_task(task_path):
+    """Run the task saved in task_path (pickle) and save the data to task["file_path"].
+    Called in the worker process.
+    """
+    with open(task_path, "rb") as task_file:
+        task = pickle.load(task_file)
+    import nest
+    # Each worker runs its own kernel with a part of the threads
+    sim.n_threads_per_proc  = task["n_threads"]
+    sim.n_vp                = int(sim.n_threads_per_proc * sim.n_mpi_procs)
+    verbose     = task["verbose"]
+    model       = model_class.model(**task["model_kwargs"])
+    master_seed = task["master_seed"]
+
+    prof = profiler.profiler()
+    prof.start("prepare_simulation")
+    pyrngs = functions.prepare_simulation(master_seed, n_populations=model.n_populations)
+    prof.stop()
+    (n_neurons_rec_spike, n_neurons_rec_voltage) = functions.derive_parameters(model)
+    prof.start("create_nodes")
+    all_GIDs = functions.create_nodes(model, pyrngs)
+    prof.stop()
+
+    prof.start("connect")
+    connectome_seed = task["connectome_seed"]
+    if connectome_seed is None:
+        connectome_seed = random_streams.connectome_seed(master_seed, sim.n_vp)
+    if sim.use_connectome_cache:
+        connections = connectome.load_connectome(model, connectome_seed, verbose=verbose)
+    else:
+        connections = None
+    functions.connect(model, all_GIDs,
+                      n_neurons_rec_spike, n_neurons_rec_voltage,
+                      verbose, connections)
+    T_connect   = prof.stop()
+
+    if sim.online_statistics:
+        res_file = h5py.File(result_path(task["file_path"]), "w")
+    with h5py.File(task["file_path"], "w") as worker_file:
+        now         = str(datetime.datetime.now())[:-7]
+        grp         = worker_file.create_group(task["group_name"])
+        prof.data_file = worker_file
+        grp.attrs["date_and_time"] = now
+        grp.attrs["master_seed"] = master_seed
+        grp.attrs["counter_streams"] = sim.counter_streams
+        if not task["run_id"] is None:
+            grp.attrs["run_id"] = task["run_id"]
+        grp.attrs["n_vp"] = sim.n_vp
+        grp.attrs["C_ab"] = model.C_ab
+        if sim.use_connectome_cache:
+            grp.attrs["connectome_key"] = connectome.connectome_key(model, connectome_seed)
+            grp.attrs["connectome_seed"] = connectome_seed
+        for key, value in task["attrs"].items():
+            grp.attrs[key] = value
+
+        res_grp = None
+        if sim.online_statistics:
+            res_grp = res_file.create_group(task["group_name"])
+        prof.start("simulate", t_model=sim.t_sim)
+        t_simulated, spikes_saved = functions.run_simulation(grp, model, all_GIDs, n_neurons_rec_spike, 
+                                                             master_seed, res_grp=res_grp)
+        T_simulate  = prof.stop(t_model=t_simulated)
+
+        prof.start("save_data")
+        functions.save_data(grp, all_GIDs, model.populations, n_neurons_rec_spike, n_neurons_rec_voltage,
+                            save_spikes=not spikes_saved, t_simulated=t_simulated)
+        T_save = prof.stop()
+
+        grp.attrs["time_to_connect"]    = T_connect
+        grp.attrs["time_to_simulate"]   = T_simulate
+        grp.attrs["time_to_save"]       = T_save
+        prof.save(grp, json_path=task["json_path"])
+    if sim.online_statistics:
+        res_file.close()
+
+    if not task["run_id"] is None:
+        registry.record_run(task["run_id"], group_name=task["group_name"], area=model.area, t_sim=t_simulated,
+                            T_connect=T_connect, T_simulate=T_simulate, T_save=T_save)
+
+def run_sweep(tasks, data_file, n_workers, verbose=True):
+    """Run tasks on n_workers worker processes and merge the results into data_file.
+
+    Worker files, tasks and logs (stdout of each worker) are kept in the
+    directory data_file.filename + "_workers" until all tasks succeeded.
+    Returns the groups of data_file, in the order of tasks.
+    """
+    if sim.n_mpi_procs > 1:
+        raise Exception("Worker processes are not run with MPI; set n_mpi_procs = 1.")
+    worker_dir  = data_file.filename + "_workers"
+    if not os.path.exists(worker_dir):
+        os.makedirs(worker_dir)
+    script      = os.path.splitext(os.path.abspath(__file__))[0] + ".py"
+    task_paths  = []
+    for i, task in enumerate(tasks):
+        task["file_path"] = os.path.join(worker_dir, "task_%i.hdf5"%i)
+        task["json_path"] = data_file.filename + "_" + task["group_name"] + ".profile.json"
+        task_path = os.path.join(worker_dir, "task_%i.pkl"%i)
+        with open(task_path, "wb") as task_file:
+            pickle.dump(task, task_file, protocol=2)
+        task_paths.append(task_path)
+
+    def call_worker(i):
+        env = dict(os.environ, OMP_NUM_THREADS=str(tasks[i]["n_threads"]))
+        with open(os.path.join(worker_dir, "task_%i.log"%i), "w") as log_file:
+            return_code = subprocess.call([sys.executable, script, task_paths[i]],
+                                          cwd=os.path.dirname(script), env=env,
+                                          stdout=log_file, stderr=subprocess.STDOUT)
+        if verbose: print("Task %i (%s) finished with code %i"%(i, tasks[i]["group_name"], return_code))
+        return return_code
+
+    pool = ThreadPool(n_workers)
+    return_codes = pool.map(call_worker, range(len(tasks)))
+    pool.close()
+    pool.join()
+
+    done    = [i for i, return_code in enumerate(return_codes) if return_code == 0]
+    merge_worker_files(data_file, [tasks[i]["file_path"] for i in done])
+    if sim.online_statistics:
+        res_file = online_statistics.initialize_result_file(data_file)
+        merge_worker_files(res_file, [result_path(tasks[i]["file_path"]) for i in done])
+        res_file.close()
+    failed  = [i for i in range(len(tasks)) if not i in done]
+    if len(failed) > 0:
+        raise Exception("Tasks %s failed, see logs in %s"%(str(failed), worker_dir))
+    shutil.rmtree(worker_dir)
+    return [data_file[task["group_name"]] for task in tasks]
+
+def result_path(file_path):
+    """Result file of a worker file (online statistics, as online_statistics.initialize_result_file)."""
+    return os.path.splitext(file_path)[0] + "_res.hdf5"
+
+def merge_worker_files(data_file, worker_paths):
+    """Copy all groups of the worker files to data_file."""
+    for worker_path in worker_paths:
+        with h5py.File(worker_path, "r") as worker_file:
+            for group_name in worker_file:
+                worker_file.copy(worker_file[group_name], data_file, name=group_name)
+    data_file.flush()
+
+if __name__ == "__main__":
+    run_task(sys.argv[1])
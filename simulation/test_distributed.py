@@ -0,0 +1,89 @@
+"""test_distributed.py
+
+Tests of the layout of spikes joined from several ranks (distributed.py),
+without MPI: the files of two "ranks" are written as by functions.save_data,
+then joined with virtual_spikes as by join_spikes on rank 0.
+Run with:
+    python -m pytest test_distributed.py
+
+Contains:
+    join_ranks
+    spikes
+    test_virtual_spikes_round_robin
+    test_virtual_spikes_blocks
+    test_virtual_spikes_no_spikes
+"""
+from __future__ import print_function
+import numpy as np
+import h5py
+import os
+import pytest
+# Import specific moduls
+from imp import reload
+import spike_functions; reload(spike_functions)
+import distributed; reload(distributed)
+
+def join_ranks(data_path, senders, times, rec_GIDs, local_rank, spike_format):
+    """Write the spikes of each rank (local_rank: rank of each GID of rec_GIDs) to its
+    rank file, join them in the data file and compare to the serial result.
+    """
+    file_path   = os.path.join(data_path, "data.hdf5")
+    n_ranks     = max(local_rank) + 1
+    counts      = []
+    for rank_i in range(n_ranks):
+        local   = np.isin(senders, rec_GIDs[local_rank == rank_i])
+        sorted_times, rec_neuron_i = spike_functions.sort_spikes(senders[local], times[local], rec_GIDs)
+        with h5py.File(distributed.rank_file_path(file_path, rank_i), "w") as rank_file:
+            spike_functions.write_spikes(rank_file.create_group("0/spikes/L23e"), sorted_times,
+                                         rec_neuron_i, spike_format)
+        counts.append(np.diff(rec_neuron_i).astype(int))
+    sources = [(os.path.basename(distributed.rank_file_path(file_path, rank_i)), "/0/spikes/L23e/times")
+               for rank_i in range(n_ranks)]
+    dtype   = np.uint32 if spike_format == "delta" else times.dtype
+    with h5py.File(file_path, "w") as data_file:
+        pop_grp = data_file.create_group("0/spikes/L23e")
+        distributed.virtual_spikes(pop_grp, sources, np.array(counts), dtype, spike_format)
+        if spike_format == "delta":
+            pop_grp["times"].attrs["encoding"] = "delta"
+    with h5py.File(file_path, "r") as data_file:
+        joined_times, joined_rec_neuron_i = spike_functions.read_spikes(data_file["0/spikes/L23e"])
+        # Offsets as written by write_spikes for the format of the rank files
+        with h5py.File(distributed.rank_file_path(file_path, 0), "r") as rank_file:
+            assert data_file["0/spikes/L23e/rec_neuron_i"].dtype == \
+                rank_file["0/spikes/L23e/rec_neuron_i"].dtype
+        if spike_format == "delta":
+            assert data_file["0/spikes/L23e/rec_neuron_i"].dtype == np.int64
+    serial_times, serial_rec_neuron_i = spike_functions.sort_spikes(senders, times, rec_GIDs)
+    assert np.array_equal(joined_rec_neuron_i, serial_rec_neuron_i)
+    assert np.array_equal(joined_times, serial_times)
+
+def spikes(rec_GIDs, n_spikes=5000, seed=0):
+    """Random spikes (senders, times in units of dt) of rec_GIDs, sorted by time."""
+    rng     = np.random.RandomState(seed)
+    senders = rng.choice(rec_GIDs, n_spikes)
+    times   = np.sort(rng.randint(0, 10**5, n_spikes)).astype(np.uint64)
+    return senders, times
+
+@pytest.mark.parametrize("spike_format", ["plain", "delta"])
+def test_virtual_spikes_round_robin(tmp_path, spike_format):
+    # Neurons alternate between the ranks (as NEST distributes them): one block per neuron
+    rec_GIDs        = np.arange(1, 41)
+    senders, times  = spikes(rec_GIDs)
+    fired           = (senders != 7) & (senders != 40)     # neurons without spikes
+    senders, times  = senders[fired], times[fired]
+    join_ranks(str(tmp_path), senders, times, rec_GIDs, rec_GIDs % 2, spike_format)
+
+@pytest.mark.parametrize("spike_format", ["plain", "delta"])
+def test_virtual_spikes_blocks(tmp_path, spike_format):
+    # Consecutive neurons of one rank, mapped at once
+    rec_GIDs        = np.arange(1, 41)
+    senders, times  = spikes(rec_GIDs, seed=1)
+    join_ranks(str(tmp_path), senders, times, rec_GIDs, np.int_(rec_GIDs > 25), spike_format)
+
+@pytest.mark.parametrize("spike_format", ["plain", "delta"])
+def test_virtual_spikes_no_spikes(tmp_path, spike_format):
+    # One rank without spikes, then no spikes at all
+    rec_GIDs        = np.arange(1, 11)
+    senders, times  = spikes(rec_GIDs[:5], n_spikes=100, seed=2)
+    join_ranks(str(tmp_path), senders, times, rec_GIDs, np.int_(rec_GIDs > 5), spike_format)
+    join_ranks(str(tmp_path), senders[:0], times[:0], rec_GIDs, rec_GIDs % 2, spike_format)
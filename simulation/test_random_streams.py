@@ -0,0 +1,68 @@
+"""test_random_streams.py
+
+Tests of random_streams.py (no NEST required),
+run with:
+    python -m pytest test_random_streams.py
+
+Contains:
+    test_philox_known_answers
+    test_counter_stream_independent_of_n_vp
+    test_connectome_seed_independent_of_n_vp
+"""
+from __future__ import print_function
+import numpy as np
+# Import specific moduls
+from imp import reload
+import sim_params as sim; reload(sim)
+import random_streams; reload(random_streams)
+
+# Known-answer vectors of philox4x32_10 (Random123, kat_vectors):
+# counter (4 words), key (2 words), result (4 words)
+philox_kat = [((0x00000000, 0x00000000, 0x00000000, 0x00000000), (0x00000000, 0x00000000),
+               (0x6627e8d5, 0xe169c58d, 0xbc57ac4c, 0x9b00dbd8)),
+              ((0xffffffff, 0xffffffff, 0xffffffff, 0xffffffff), (0xffffffff, 0xffffffff),
+               (0x408f276d, 0x41c83b0e, 0xa20bc7c6, 0x6d5451fd)),
+              ((0x243f6a88, 0x85a308d3, 0x13198a2e, 0x03707344), (0xa4093822, 0x299f31d0),
+               (0xd16cfe09, 0x94fdcceb, 0x5001e420, 0x24126ea1))]
+
+def vp_values(stream, n_neurons, n_vp, pop_index=0):
+    """Values of functions.initialize_neurons for n_vp virtual processes:
+    each process draws V_m for its local neurons (round robin, as NEST distributes them).
+    """
+    values = np.zeros(n_neurons)
+    for vp in range(n_vp):
+        local = np.arange(n_neurons) % n_vp == vp
+        values[local] = stream.normal("V_m", pop_index, np.flatnonzero(local), -58., 10.)
+    return values
+
+def test_philox_known_answers():
+    for counter, key, result in philox_kat:
+        words = random_streams.philox(*counter, key=key)
+        assert [int(word) for word in words] == list(result)
+    # Arrays of counters: each element as for the scalar counter
+    counters = np.array([kat[0] for kat, key, result in philox_kat], dtype=np.uint64)
+    words    = np.array(random_streams.philox(counters, 7, 8, 9, key=(1, 2)))
+    for i, c0 in enumerate(counters):
+        assert np.array_equal(words[:, i], np.array(random_streams.philox(c0, 7, 8, 9, key=(1, 2))))
+
+def test_counter_stream_independent_of_n_vp():
+    stream      = random_streams.counter_stream(12345)
+    n_neurons   = 1000
+    V_m         = vp_values(stream, n_neurons, 1)
+    for n_vp in (2, 3, 8, 24):
+        assert np.array_equal(vp_values(stream, n_neurons, n_vp), V_m)
+    # Different populations and master seeds give different values
+    assert not np.array_equal(vp_values(stream, n_neurons, 1, pop_index=1), V_m)
+    assert not np.array_equal(vp_values(random_streams.counter_stream(12346), n_neurons, 1), V_m)
+    assert abs(np.mean(V_m) + 58.) < 1.5 and abs(np.std(V_m) - 10.) < 1.
+
+def test_connectome_seed_independent_of_n_vp():
+    counter_streams = sim.counter_streams
+    try:
+        sim.counter_streams = True
+        seeds = [random_streams.connectome_seed(12345, n_vp) for n_vp in (1, 8, 24)]
+        assert seeds[0] == seeds[1] == seeds[2]
+        sim.counter_streams = False
+        assert random_streams.connectome_seed(12345, 8) != random_streams.connectome_seed(12345, 24)
+    finally:
+        sim.counter_streams = counter_streams
@@ -0,0 +1,96 @@
+"""test_spike_functions.py
+
+Tests of the spike formats of spike_functions.py (no NEST required),
+run with:
+    python -m pytest test_spike_functions.py
+
+Contains:
+    spikes
+    write_population
+    check_formats
+    test_delta_round_trip
+    test_zero_spike_neurons
+    test_no_spikes
+    test_uint32_range
+"""
+from __future__ import print_function
+import numpy as np
+import h5py
+import pytest
+# Import specific moduls
+from imp import reload
+import spike_functions; reload(spike_functions)
+import spike_store; reload(spike_store)
+
+def spikes(n_spikes, rec_GIDs, t_max, seed=0):
+    """Random spikes (senders, times in units of dt) of the neurons rec_GIDs
+    and a non-recorded neuron (GID 1000), sorted by time as recorded by NEST.
+    """
+    rng     = np.random.RandomState(seed)
+    senders = rng.choice(list(rec_GIDs) + [1000], n_spikes)
+    times   = np.sort(rng.randint(1, t_max, n_spikes)).astype(np.uint64)
+    return senders, times
+
+def write_population(file_path, sorted_times, rec_neuron_i):
+    """Write the population "L23e" in both formats; returns the file path."""
+    with h5py.File(file_path, "w") as data_file:
+        for spike_format in ("plain", "delta"):
+            spikes_grp = data_file.create_group(spike_format)
+            spikes_grp.attrs["dt"] = 0.1
+            spike_functions.write_spikes(spikes_grp.create_group("L23e"), sorted_times, rec_neuron_i,
+                                         spike_format)
+    return file_path
+
+def check_formats(file_path, sorted_times, rec_neuron_i):
+    """Both formats give the original times, via read_spikes and spike_store."""
+    with h5py.File(file_path, "r") as data_file:
+        for spike_format in ("plain", "delta"):
+            times, rec_neuron_i_read = spike_functions.read_spikes(data_file[spike_format]["L23e"])
+            assert np.array_equal(times, sorted_times)
+            assert np.array_equal(rec_neuron_i_read, rec_neuron_i)
+            population = spike_store.spike_store(data_file[spike_format])["L23e"]
+            for i in range(len(rec_neuron_i) - 1):
+                assert np.array_equal(population.neuron(i, "raw"),
+                                      sorted_times[int(rec_neuron_i[i]):int(rec_neuron_i[i + 1])])
+        assert data_file["delta/L23e/times"].dtype == np.uint32
+        assert data_file["delta/L23e/times"].attrs["encoding"] == "delta"
+
+def test_delta_round_trip(tmp_path):
+    rec_GIDs        = np.arange(100, 150)
+    senders, times  = spikes(20000, rec_GIDs, 10**6)
+    sorted_times, rec_neuron_i = spike_functions.sort_spikes(senders, times, rec_GIDs)
+    file_path = write_population(str(tmp_path / "spikes.hdf5"), sorted_times, rec_neuron_i)
+    check_formats(file_path, sorted_times, rec_neuron_i)
+    # Repeated times of one neuron (delta 0)
+    assert np.array_equal(spike_functions.decode_delta(spike_functions.encode_delta(
+        np.array([5, 5, 7, 3, 3]), np.array([0, 3, 5])), np.array([0, 3, 5])), [5, 5, 7, 3, 3])
+
+def test_zero_spike_neurons(tmp_path):
+    # First, middle and last neurons without spikes, population smaller than n_neurons_rec
+    rec_GIDs        = np.arange(1, 11)
+    senders, times  = spikes(500, [2, 3, 4, 6, 7, 8], 10**4, seed=1)
+    senders         = np.append(senders, [2, 3])     # spikes at time 0
+    times           = np.append(times, [0, 0]).astype(np.uint64)
+    sorted_times, rec_neuron_i = spike_functions.sort_spikes(senders, times, rec_GIDs, 12)
+    n_spikes        = np.diff(rec_neuron_i)
+    assert len(n_spikes) == 12 and n_spikes[0] == 0 and n_spikes[4] == 0 and np.all(n_spikes[8:] == 0)
+    file_path = write_population(str(tmp_path / "spikes.hdf5"), sorted_times, rec_neuron_i)
+    check_formats(file_path, sorted_times, rec_neuron_i)
+
+def test_no_spikes(tmp_path):
+    sorted_times, rec_neuron_i = spike_functions.sort_spikes(np.zeros(0, dtype=int),
+                                                             np.zeros(0, dtype=np.uint64), np.arange(1, 6))
+    file_path = write_population(str(tmp_path / "spikes.hdf5"), sorted_times, rec_neuron_i)
+    check_formats(file_path, sorted_times, rec_neuron_i)
+
+def test_uint32_range(tmp_path):
+    # Largest representable time: decoded without overflow of the cumulated deltas
+    sorted_times    = np.array([2**31, 2**32 - 2, 2**32 - 1, 1, 2**32 - 1], dtype=np.uint64)
+    rec_neuron_i    = np.array([0, 3, 5])
+    file_path = write_population(str(tmp_path / "spikes.hdf5"), sorted_times, rec_neuron_i)
+    check_formats(file_path, sorted_times, rec_neuron_i)
+    # Beyond: refused instead of wrapping around
+    with h5py.File(str(tmp_path / "overflow.hdf5"), "w") as data_file:
+        with pytest.raises(Exception, match="uint32"):
+            spike_functions.write_spikes(data_file.create_group("L23e"),
+                                         np.array([1, 2**32], dtype=np.uint64), np.array([0, 2]), "delta")
@@ -0,0 +1,137 @@
+"""validate_background.py
+
+Compare the population rates of Potjans' model with Poisson background input
+(background = "poisson") and its diffusion approximation (background = "noise").
+
+Usage:
+    python validate_background.py           # NEST
+    python validate_background.py numpy     # numpy_backend.py, no NEST required
+
+Structure:
+For each neuron_model and background:
+    simulate t_sim at area, with the same master_seed
+    rates of the recorded neurons after t_trans
+The rates of both backgrounds, their relative difference and the mean field rates
+(model_class.model.mean_field_rates of the "poisson" model) are printed as table and saved to
+    data_dir/background/validate_background_<backend>_<date>.txt
+Populations whose rates differ by more than rel_tol (and abs_tol) are marked in the
+table; the validation then fails (exception after saving the table).
+"""
+from __future__ import print_function
+import numpy as np
+import sys, os
+import datetime
+
+from imp import reload
+import sim_params as sim; reload(sim)
+import functions; reload(functions)
+import model_class; reload(model_class)
+import numpy_backend; reload(numpy_backend)
+
+# Parameters of the validation
+area            = 0.1
+neuron_models   = ["iaf_psc_exp", "iaf_psc_delta"]
+backgrounds     = ["poisson", "noise"]
+t_sim           = 5e3       # ms
+t_trans         = 0.5e3     # ms; rates are measured after t_trans
+master_seed     = sim.master_seed
+rel_tol         = 0.15      # accepted relative difference of the rates (noise - poisson) / poisson
+                            # (rates of different master seeds differ by ~10 % at area 0.1, 2 s)
+abs_tol         = 0.2       # Hz; accepted absolute difference (populations with low rates)
+
+def population_rates(senders, times, first_GIDs, n_neurons_rec):
+    """Rates (Hz) of the recorded neurons of each population after t_trans.
+    senders, times (ms): lists of arrays, one per population.
+    """
+    rates = np.zeros(len(senders))
+    for j in range(len(senders)):
+        after       = times[j] > t_trans
+        recorded    = senders[j][after] < first_GIDs[j] + n_neurons_rec[j]
+        rates[j]    = np.sum(recorded) / (n_neurons_rec[j] * (t_sim - t_trans) * 1e-3)
+    return rates
+
+def run_nest(model, n_neurons_rec_spike, n_neurons_rec_voltage):
+    """Simulate with NEST; returns the population rates."""
+    import nest
+    pyrngs      = functions.prepare_simulation(master_seed, n_populations=model.n_populations)
+    all_GIDs    = functions.create_nodes(model, pyrngs)
+    functions.connect(model, all_GIDs, n_neurons_rec_spike, n_neurons_rec_voltage, False)
+    nest.Simulate(t_sim)
+    senders, times = [], []
+    for spike_detector in all_GIDs[1]:
+        events = nest.GetStatus(spike_detector, "events")[0]
+        senders.append(events["senders"])
+        times.append(events["times"])
+    first_GIDs = [GIDs[0] for GIDs in all_GIDs[0]]
+    return population_rates(senders, times, first_GIDs, n_neurons_rec_spike)
+
+def run_numpy(model, n_neurons_rec_spike, n_neurons_rec_voltage):
+    """Simulate with numpy_backend.py; returns the population rates."""
+    network = numpy_backend.network(model, master_seed, n_neurons_rec_spike, n_neurons_rec_voltage)
+    network.simulate(t_sim)
+    if network.spike_senders:
+        all_senders = np.concatenate(network.spike_senders)
+        all_times   = np.concatenate(network.spike_steps) * sim.dt
+    else:
+        all_senders = np.zeros(0, dtype=int)
+        all_times   = np.zeros(0)
+    pop_index   = network.pop_index[all_senders]
+    senders     = [all_senders[pop_index == j] for j in range(model.n_populations)]
+    times       = [all_times[pop_index == j] for j in range(model.n_populations)]
+    return population_rates(senders, times, network.pop_first[:-1],
+                            np.minimum(n_neurons_rec_spike, model.n_neurons))
+
+if __name__ == "__main__":
+    backend = "nest"
+    if len(sys.argv) > 1:
+        backend = sys.argv[1]
+    if not backend in ("nest", "numpy"):
+        raise Exception("Backend should be 'nest' or 'numpy'!")
+    sim.t_sim           = t_sim
+    sim.record_voltage  = False
+
+    lines = []
+    failed = []
+    for neuron_model in neuron_models:
+        rates = {}
+        for background in backgrounds:
+            model = model_class.model(area=area, neuron_model=neuron_model,
+                                      connection_rule="fixed_indegree", background=background)
+            (n_neurons_rec_spike, n_neurons_rec_voltage) = functions.derive_parameters(model)
+            print("Simulate %s, %s background"%(neuron_model, background))
+            if backend == "nest":
+                rates[background] = run_nest(model, n_neurons_rec_spike, n_neurons_rec_voltage)
+            else:
+                rates[background] = run_numpy(model, n_neurons_rec_spike, n_neurons_rec_voltage)
+        model_mf = model_class.model(area=area, neuron_model=neuron_model, connection_rule="fixed_indegree")
+        try:
+            rates_mf = model_mf.mean_field_rates()
+        except Exception as error:  # keep the simulated rates
+            print(error)
+            rates_mf = np.nan * np.ones(model_mf.n_populations)
+
+        lines.append(neuron_model + ", area %.2f, %.1f s (after %.1f s)"%(area, (t_sim - t_trans) * 1e-3,
+                                                                           t_trans * 1e-3))
+        lines.append("%-6s %10s %10s %9s %10s"%("pop", "poisson", "noise", "rel_diff", "mean_field"))
+        for j, population in enumerate(model.populations):
+            diff        = rates["noise"][j] - rates["poisson"][j]
+            rel_diff    = diff / max(rates["poisson"][j], 1e-3)
+            within      = abs(rel_diff) <= rel_tol or abs(diff) <= abs_tol
+            if not within:
+                failed.append(neuron_model + " " + population)
+            lines.append("%-6s %10.3f %10.3f %9.3f %10.3f%s"%(population, rates["poisson"][j],
+                                                                rates["noise"][j], rel_diff, rates_mf[j],
+                                                                "" if within else "  *"))
+        lines.append("")
+
+    print("\n".join(lines))
+    result_path = os.path.join(sim.data_dir, "background")
+    if not os.path.exists(result_path):
+        os.makedirs(result_path)
+    now         = str(datetime.datetime.now())[:-7]
+    file_name   = "validate_background_" + backend + "_" + now.replace(" ", "_").replace(":", "-") + ".txt"
+    with open(os.path.join(result_path, file_name), "w") as result_file:
+        result_file.write("\n".join(lines) + "\n")
+    if len(failed) > 0:
+        raise Exception("Rates of the noise background differ by more than %.0f %%: "%(rel_tol * 100) + 
+                        ", ".join(failed))
@@ -0,0 +1,281 @@
+"""warm_network.py
+
+One NEST network reused for all steps of simulate_transition.py (warm mode),
+applied in:
+simulate_transition.py
+
+The network is built once for all models of the sweep (fixed_indegree only):
+    neurons     maximal number of neurons of each population over all models
+    synapses    drawn such that the connectome of each model is a subset
+For each target neuron and source population, sources are drawn uniformly
+(with replacement) from the neurons of the largest population. For model s,
+the active synapses of a target are the first C_ab(s) of those drawn sources
+which are neurons of model s (index < n_neurons(s)). Each model's connectome
+thus has the distribution of connectome.draw_connectome; draws not used by any
+model are dropped. Neurons with index >= n_neurons(s) are inactive (silenced).
+
+For each step (set_model), only the synaptic weights (zero for inactive
+synapses), the rates of the external input and the neuron state are set in
+bulk. Before, the network is drained (all weights and input zero) such that
+no spikes of the previous step are in transit. Delays are those of the first
+model; the connect phase is paid once per sweep.
+
+Contains:
+    check_models
+    required_counts
+    draw_warm_connectome
+    weights_from_quantiles
+    active_synapses
+    class warm_network
+        set_model
+"""
+from __future__ import print_function
+import numpy as np
+from scipy.special import ndtr, ndtri
+import copy
+# Import specific moduls
+from imp import reload
+import sim_params as sim; reload(sim)
+import connectome; reload(connectome)
+import functions; reload(functions)
+
+V_th_inactive = 1e6     # mV; threshold of inactive neurons
+
+def check_models(models):
+    """Raise if the models can't share one network."""
+    model0 = models[0]
+    for model in models:
+        if not model.connection_rule == "fixed_indegree":
+            raise Exception("Warm network requires connection_rule 'fixed_indegree'!")
+        if not model.n_th == 0:
+            raise Exception("Warm network does not support thalamic input!")
+        if not model.neuron_model == model0.neuron_model:
+            raise Exception("All models of the warm network need the same neuron_model!")
+        if not (np.allclose(model.delays, model0.delays) and model.delay_rel_sd == model0.delay_rel_sd):
+            raise Exception("All models of the warm network need the same delays!")
+        if not np.allclose(model.weight_ext, model0.weight_ext):
+            raise Exception("All models of the warm network need the same weight_ext!")
+        if not model.background == model0.background:
+            raise Exception("All models of the warm network need the same background!")
+        if not np.any(model.dc_ext != 0) == np.any(model0.dc_ext != 0):
+            raise Exception("All models of the warm network need DC input, or none!")
+
+def required_counts(C_ab, n_target, priority):
+    """Number of synapses of each target neuron for in-degree C_ab
+    and n_target active targets (as in connectome.draw_connectome).
+
+    For C_ab < 1, int(C_ab * n_target) active targets with the lowest priority
+    obtain one synapse.
+    """
+    counts = np.zeros(len(priority), dtype=int)
+    if C_ab >= 1:
+        counts[:n_target] = int(C_ab)
+    else:
+        n_chosen = int(C_ab * n_target)
+        counts[np.argsort(priority[:n_target])[:n_chosen]] = 1
+    return counts
+
+def draw_warm_connectome(models, rng, chunk_size=2**22, verbose=False):
+    """Draw the synapses for all models (see module doc).
+
+    Returns a list of tuples, one per pair of populations:
+        (target_index, source_index, sources, targets, u, delays, counts)
+    with sources and targets as indices within the largest populations,
+    sorted by target and draw, u uniform in [0, 1) (quantile of the weight, see
+    weights_from_quantiles) and counts[s, target] = in-degree of target in model s.
+    chunk_size limits the number of draws held at once.
+    """
+    model0      = models[0]
+    n_neurons   = np.array([model.n_neurons for model in models])
+    n_max       = n_neurons.max(axis=0)
+    pairs       = []
+    for target_index in range(model0.n_populations):
+        for source_index in range(model0.n_populations):
+            priority    = rng.random_sample(n_max[target_index])
+            counts      = np.array([required_counts(model.C_ab[target_index, source_index],
+                                                    n_neurons[s, target_index], priority)
+                                    for s, model in enumerate(models)])
+            if not np.any(counts):
+                continue
+            if verbose: print("Drawing %i -> %i"%(source_index, target_index))
+            n_source    = n_neurons[:, source_index]
+            n_source_max = n_max[source_index]
+            # Draws per target: enough for the model with the smallest share of sources
+            max_counts  = counts.max(axis=1)
+            n_draws     = int(np.max(np.ceil((max_counts + 5 * np.sqrt(max_counts) + 5) *
+                                             n_source_max / n_source.astype(float))))
+            n_chunk     = max(1, chunk_size // n_draws)
+            sources, targets = [], []
+            for t0 in range(0, n_max[target_index], n_chunk):
+                t1      = min(t0 + n_chunk, n_max[target_index])
+                draws   = rng.randint(0, n_source_max, (t1 - t0, n_draws))
+                while True:
+                    used    = np.zeros(draws.shape, dtype=bool)
+                    failed  = np.zeros(t1 - t0, dtype=bool)
+                    for s in range(len(models)):
+                        eligible = draws < n_source[s]
+                        rank    = np.cumsum(eligible, axis=1) - 1
+                        needed  = counts[s, t0:t1][:, None]
+                        used   |= eligible & (rank < needed)
+                        failed |= eligible.sum(axis=1) < counts[s, t0:t1]
+                    if not np.any(failed):
+                        break
+                    # too few sources of some model drawn: redraw these targets (rare)
+                    draws[failed] = rng.randint(0, n_source_max, (np.sum(failed), n_draws))
+                rows, cols = np.nonzero(used)
+                sources.append(draws[rows, cols])
+                targets.append(rows + t0)
+            sources = np.concatenate(sources)
+            targets = np.concatenate(targets)
+            u       = rng.random_sample(len(targets))
+            mean_delay  = model0.delays[target_index, source_index]
+            delays  = connectome.normal_clipped(rng, mean_delay, mean_delay * model0.delay_rel_sd,
+                                                len(targets), low=0.1)
+            pairs.append((target_index, source_index, sources, targets, u, delays, counts))
+    return pairs
+
+def weights_from_quantiles(u, mean_weight, weight_rel_sd):
+    """Weights with quantiles u of the normal distribution (mean_weight, |mean_weight| * weight_rel_sd)
+    clipped at zero (redrawn outside, as weight_dict_exc/inh and connectome.normal_clipped).
+    """
+    if weight_rel_sd == 0 or mean_weight == 0:
+        return np.ones(len(u)) * mean_weight
+    # only the sign-preserving side of the distribution is kept
+    p_min   = ndtr(-1. / weight_rel_sd)
+    z       = np.maximum(ndtri(p_min + u * (1. - p_min)), -1. / weight_rel_sd)
+    return mean_weight * (1. + weight_rel_sd * z)
+
+def active_synapses(sources, targets, counts, n_source):
+    """Mask of synapses active for in-degrees counts[target] and n_source active sources.
+    sources and targets as returned by draw_warm_connectome (sorted by target and draw).
+    """
+    eligible    = sources < n_source
+    cum         = np.cumsum(eligible)
+    first       = np.searchsorted(targets, targets, side="left")     # first synapse of each target
+    before      = np.where(first > 0, cum[first - 1], 0)
+    rank        = cum - before - 1
+    return eligible & (rank < counts[targets])
+
+class warm_network:
+    def __init__(self, models, pyrngs, rng, verbose=False):
+        """Create nodes and connect once for all models.
+        Recording devices are connected for the largest populations
+        (n_neurons_rec_spike, n_neurons_rec_voltage).
+
+        pyrngs: as returned by functions.prepare_simulation
+        rng:    numpy RandomState for drawing the connectome
+        """
+        import nest
+        check_models(models)
+        self.models     = models
+        self.verbose    = verbose
+        n_max           = np.array([model.n_neurons for model in models]).max(axis=0)
+        self.model_max  = copy.copy(models[0])
+        self.model_max.n_neurons = n_max
+        self.model_max.n_total   = np.sum(n_max)
+        (self.n_neurons_rec_spike, 
+         self.n_neurons_rec_voltage) = functions.derive_parameters(self.model_max)
+
+        self.all_GIDs   = functions.create_nodes(self.model_max, pyrngs)
+        self.pairs      = draw_warm_connectome(models, rng, verbose=verbose)
+        # Create all synapses with zero weight, set by set_model
+        connections     = [(target_index, source_index, sources, targets, np.zeros(len(targets)), delays)
+                           for target_index, source_index, sources, targets, u, delays, counts in self.pairs]
+        functions.connect(self.model_max, self.all_GIDs,
+                          self.n_neurons_rec_spike, self.n_neurons_rec_voltage,
+                          verbose, connections)
+        self.map_connections()
+
+        # Time until spikes in transit are delivered and synaptic currents have decayed
+        model0          = models[0]
+        max_delay       = max(np.max(delays) for target_index, source_index, sources, targets, u, delays, counts
+                              in self.pairs)
+        self.t_drain    = np.ceil(max(max_delay, model0.model_params["t_ref"]) +
+                                  10. * max(model0.tau_syn_ex, model0.tau_syn_in))
+
+    def map_connections(self):
+        """Find the NEST connection of each local synapse of self.pairs.
+
+        Synapses are matched by source, target and delay (steps of dt); synapses
+        identical in these are interchangeable.
+        """
+        import nest
+        neuron_GIDs = [np.array(GIDs) for GIDs in self.all_GIDs[0]]
+        self.conns      = []    # local connections of each pair
+        self.syn_index  = []    # index of their synapse in the arrays of the pair
+        for target_index, source_index, sources, targets, u, delays, counts in self.pairs:
+            source_GIDs = neuron_GIDs[source_index]
+            target_GIDs = neuron_GIDs[target_index]
+            conns       = nest.GetConnections(source=source_GIDs.tolist(), target=target_GIDs.tolist(),
+                                              synapse_model=self.model_max.syn_dict["model"])
+            conn_info   = np.array(nest.GetStatus(conns, ["source", "target", "delay"])).reshape(-1, 3)
+            conn_order  = np.lexsort((np.rint(conn_info[:, 2] / sim.dt), conn_info[:, 0], conn_info[:, 1]))
+
+            local       = np.array(nest.GetStatus(target_GIDs.tolist(), "local"), dtype=bool)
+            local_syn   = np.flatnonzero(local[targets])
+            syn_keys    = (np.rint(delays[local_syn] / sim.dt),
+                           source_GIDs[sources[local_syn]], target_GIDs[targets[local_syn]])
+            syn_order   = local_syn[np.lexsort(syn_keys)]
+            if not (len(syn_order) == len(conns) and
+                    np.all(target_GIDs[targets[syn_order]] == conn_info[conn_order, 1]) and
+                    np.all(source_GIDs[sources[syn_order]] == conn_info[conn_order, 0])):
+                raise Exception("Connections of %i -> %i do not match the connectome!"%(
+                                source_index, target_index))
+            self.conns.append([conns[i] for i in conn_order])
+            self.syn_index.append(syn_order)
+
+    def set_model(self, model_index, pyrngs):
+        """Set weights, external input and neuron state for models[model_index].
+        Spike detectors are emptied.
+
+        Returns the time (ms) at which the step starts (origin of its spike times).
+        """
+        import nest
+        model           = self.models[model_index]
+        neuron_GIDs     = self.all_GIDs[0]
+        spike_detectors = self.all_GIDs[1]
+        multimeters     = self.all_GIDs[2]
+        ext_poisson     = self.all_GIDs[3]
+        ext_dc          = self.all_GIDs[4]
+
+        # Drain: no input until all spikes of the previous step are delivered
+        if nest.GetKernelStatus("time") > 0.:
+            for conns in self.conns:
+                nest.SetStatus(conns, "weight", 0.)
+            for j in range(model.n_populations):
+                if model.background == "poisson":
+                    nest.SetStatus(ext_poisson[j], {"rate": 0.})
+                else:
+                    nest.SetStatus(ext_poisson[j], {"mean": 0., "std": 0.})
+                nest.SetStatus(ext_dc[j], {"amplitude": 0.})
+            nest.Simulate(self.t_drain)
+
+        # Weights: active synapses of model, all others zero
+        for pair_index, (target_index, source_index, sources, targets, u, delays, counts) in enumerate(self.pairs):
+            active      = active_synapses(sources, targets, counts[model_index], model.n_neurons[source_index])
+            weights     = weights_from_quantiles(u, model.weights[target_index, source_index],
+                                                 model.weight_rel_sd)
+            weights[~active] = 0.
+            nest.SetStatus(self.conns[pair_index], "weight", weights[self.syn_index[pair_index]].tolist())
+
+        # Neurons: active ones reset and initialized, inactive ones silenced
+        for j in range(model.n_populations):
+            active_GIDs     = neuron_GIDs[j][:model.n_neurons[j]]
+            inactive_GIDs   = neuron_GIDs[j][model.n_neurons[j]:]
+            nest.SetStatus(active_GIDs, {"V_th": model.model_params["V_th"]})
+            functions.initialize_neurons(model, active_GIDs, pyrngs, pop_index=j)
+            if len(inactive_GIDs) > 0:
+                nest.SetStatus(inactive_GIDs, {"V_th": V_th_inactive})
+            if model.background == "poisson":
+                nest.SetStatus(ext_poisson[j], {"rate": model.rate_ext * model.C_aext[j]})
+            else:
+                nest.SetStatus(ext_poisson[j], {"mean": model.noise_mean[j], "std": model.noise_std[j]})
+            nest.SetStatus(ext_dc[j], {"amplitude": model.dc_ext[j]})
+
+        # Recording devices
+        t_origin = nest.GetKernelStatus("time")
+        for spike_detector in spike_detectors:
+            nest.SetStatus(spike_detector, {"n_events": 0})
+        for multimeter in multimeters:
+            nest.SetStatus(multimeter, {"n_events": 0, "origin": t_origin})
+        return t_origin